@@ -1,662 +1,700 @@
-import logging
-import os
-import re
-import sys
-import webbrowser
-from pathlib import Path
-
-import folium
-import numpy as np
-import pandas as pd
-import pyinputplus as pyip
-from arcgis.geocoding import geocode
-from arcgis.gis import GIS
-from dotenv import load_dotenv
-from opencage.geocoder import OpenCageGeocode
-
-dummy_bool = False
-if dummy_bool:
-    """
-    These are modules that are required by arcgis and are installed as dependencies.
-    The problem is that the importing inside the arcgis module is dynamic,
-    so py-installer do not take them in account when compiling the script into an .exe file.
-    Adding these lines of declared imports makes py-installer to consider the modules in the
-    .exe file that it creates, allowing arcgis module to access them.
-    """
-    import arcgis.env as arcgis_env
-    import arcgis as arcgis
-    import arcgis.gis.agoserver._api as _agoserver
-    import arcgis._impl.common._mixins as _mixins
-    import arcgis._impl.common._utils as _common_utils
-    import arcgis._impl.common._deprecate as _common_deprecated
-    import arcgis.gis._impl._portalpy as _portalpy
-    import arcgis.gis._impl._jb as _jb
-
-    import requests_ntlm
-    import requests
-    import requests_negotiate_sspi
-    import requests_gssapi
-    import requests_kerberos
-
-
-# --- Instrucciones para uso del programa ---
-instructions = """
-Para poder correr el programa se puede tener el .exe en un directorio a gusto del usuario.
-En el mismo directorio se deberá tener una carpeta con el nombre 'data' y un archivo '.env' con las credenciales.
-Dentro de la carpeta 'data', una subcarpeta con el año(aaaa) como nombre.
-Dentro de la carpeta con nombre del año, el archivo a geocodificar cuyo nombre debe tener el siguiente formato:
-'Avp <mes(mm)> del <anio(aaaa)> con género.xlsx'
-
-El dataset utilizado debe tener columnas con los siguientes nombres:
-- 'id'
-- 'fecha de ingreso'
-- 'lugar del avp'
-"""
-
-print(instructions)
-
-response = pyip.inputYesNo(
-    prompt="Ingrese 'si' en caso de cumplir los requerimientos. 'no' para salir. ('si/no') \n",
-    yesVal="si",
-    noVal="no",
-)
-
-if response == "si":
-    pass
-elif response == "no":
-    sys.exit(1)
-
-
-def city_filler(df, city, fill, ids_list):
-    """
-    This function completes the addresses queries with information about city, prov, country
-    of observations with any hint about that (except for observations located in Rosario)
-
-    :df: Original dataframe with an address column.
-    :city: Some kind of pattern or string referring to a city of Gran Rosario.
-    :fill: Desired name of the corresponding city.
-
-    :return: Dataframe with new information in the address column + IDs of corrected observations.
-    """
-    mask = df.apply(lambda r: bool(re.search(city, r["direccion_avp"])), axis=1)
-    df.loc[mask, "direccion_avp"] = (
-        df.loc[mask, "direccion_avp"]
-        .str.replace("-", "")
-        .str.replace(city, "")
-        .str.strip()
-    ) + f", {fill}, Santa Fe, Argentina"
-
-    ids_no_rosario = df.loc[mask, "id"].tolist()
-
-    ids_list = ids_list + ids_no_rosario
-
-    return df, ids_list
-
-
-def map_plotter(df, ids_wrong):
-    """
-    This function plots every observation in passed dataframe into a Folium Map (interactive).
-    It prints in green every observation except for those that the user marks as wrongly geocoded.
-
-    :df: Dataframe with Latitude and Longitude column.
-    :ids_wrong: List of IDs of wrongly geocoded addresses.
-
-    :return: Folium Map (interactive).
-    """
-    rosario_coords = [-32.940506, -60.712480]
-
-    # Create the map
-    map_geo = folium.Map(location=rosario_coords, zoom_start=12)
-
-    for index, row in df.iterrows():
-        popup = row["id"] + ": " + row["direccion_orig"]
-
-        if not row["id"] in (ids_wrong):
-            color = "green"
-        elif row["id"] in (ids_wrong):
-            color = "red"
-        try:
-            folium.Marker(
-                location=[row["lat"], row["lon"]],
-                popup=popup,
-                icon=folium.Icon(color=color, icon_color="white"),
-            ).add_to(map_geo)
-        except Exception as e:
-            exception_text = f"Problema encontrado con {row['id']}"
-            raise Exception(exception_text)
-
-    return map_geo
-
-
-def ids_validator(id):
-    """
-    This function checks format of ID inputted by the user.
-
-    :id: String ID to check.
-
-    :return: Raise Exception or pass.
-    """
-    if id == "t":
-        return
-    elif len(id) != len_id:
-        raise Exception(f"El id ingresado debe tener {len_id} caracteres numéricos")
-    try:
-        int(id)
-    except Exception as e:
-        raise Exception("El id ingresado debe tener solo caracteres numéricos")
-
-    return
-
-
-def ids_adder(list_ok, list_wrong):
-    """
-    This function ask the user to enter IDs of wrongly geocoded observations.
-
-    :list_ok: List of IDs present in plotted dataframe.
-    :list_wrong: List of wrongly geocoded observation's IDs into which append new ones.
-
-    :return: List of wrongly geocoded observation's Ids with new ones.
-    """
-    print()
-
-    response = ""
-
-    while response != "t":
-        print(
-            "Ingrese un ID para agregar a las direcciones erroneamente geocodificadas ('t' para terminar): "
-        )
-        while True:
-            try:
-                response = pyip.inputCustom(ids_validator)
-                break
-            except KeyboardInterrupt:
-                continue
-        if response == "t":
-            break
-        if response not in list_ok:
-            print(
-                "ID no presente entre las direcciones geocodificadas. Intente nuevamente. \n"
-            )
-            continue
-        elif response in list_ok:
-            if not response in list_wrong:
-                list_wrong.append(response)
-            print("ID aceptado \n")
-
-    return list_wrong
-
-
-def ids_remover(list_wrong):
-    """
-    This function ask the user to enter IDs of rightly geocoded observations present in wrong ones list.
-
-    :list_wrong: List of wrongly geocoded observation's IDs from which remove some.
-
-    :return: List of wrongly geocoded observation's Ids without removed ones.
-    """
-    response = ""
-
-    while response != "t":
-        print(
-            "Ingrese un ID a eliminar de las direcciones erroneamente geocodificadas ('t' para terminar): "
-        )
-        while True:
-            try:
-                response = pyip.inputCustom(ids_validator)
-                break
-            except KeyboardInterrupt:
-                continue
-        if response == "t":
-            break
-        if response not in list_wrong:
-            print(
-                "ID no presente entre las direcciones erroneamente geocodificadas. Intente nuevamente.\n"
-            )
-            continue
-        elif response in list_wrong:
-            list_wrong.remove(response)
-            print("ID aceptado \n")
-
-    return list_wrong
-
-
-def geo_checker(df, list_right, list_wrong):
-    """
-    This function provides some options to add or remove IDs to/from
-    the list of wrongly geocoded observation's IDs.
-    It acts as some kind of organizer of the three main functions to complete the task:
-        - map_plotter()
-        - ids_adder()
-        - ids_remover()
-    It displays interactive maps in the browser so that user can check if addresses were
-    rightly geocoded.
-
-    :df: Dataframe with geocoded observations with Latitude and Longitude columns.
-    :list_right: List of IDs present in the geocoded dataframe.
-    :list_wrong: List into which add or remove wrongly geocoded observation's IDs.
-
-    :return: List of wrongly geocoded observations Ids.
-    """
-    output_file = map_path / "map_geo.html"
-
-    map_geo = map_plotter(df, list_wrong)
-    map_geo.save(output_file)
-    webbrowser.open(output_file, new=1)
-
-    list_wrong = ids_adder(list_right, list_wrong)
-
-    while True:
-        map_geo = map_plotter(df, list_wrong)
-        map_geo.save(output_file)
-        webbrowser.open(output_file, new=1)
-
-        response = pyip.inputYesNo(
-            prompt="¿Desea confirmar los cambios y continuar? ('si/no') \n",
-            yesVal="si",
-            noVal="no",
-        )
-
-        if response == "si":
-            print("Cambios confirmados. \n")
-            print()
-            break
-        elif response == "no":
-            response = pyip.inputMenu(
-                [
-                    "Agregar a las observaciones erroneamente geocodificadas un nuevo ID.",
-                    "Eliminar de las observaciones erroneamente geocodificadas un ID.",
-                    "Confirmar los cambios y continuar.",
-                ],
-                prompt="¿Qué modificaciones desea realizar? \n",
-                lettered=True,
-            )
-
-            print()
-
-            if (
-                response
-                == "Agregar a las observaciones erroneamente geocodificadas un nuevo ID."
-            ):
-                list_wrong = ids_adder(list_right, list_wrong)
-                continue
-            elif (
-                response
-                == "Eliminar de las observaciones erroneamente geocodificadas un ID."
-            ):
-                list_wrong = ids_remover(list_wrong)
-            elif response == "Confirmar los cambios y continuar.":
-                break
-
-    return list_wrong
-
-
-def oc_geocoder(geocoder, x):
-    """
-    This function geocodes observations and get Latitude and Longitude information with OpenCage service.
-    """
-    results = geocoder.geocode(x)
-    lat = results[0]["geometry"]["lat"]
-    lon = results[0]["geometry"]["lng"]
-    return lat, lon
-
-
-def esri_geocoder(x):
-    """
-    This function geocodes observations and get Latitude and Longitude information with ESRI service.
-    """
-    results = geocode(x)
-    lat = str(results[0]["location"]["y"])
-    lon = str(results[0]["location"]["x"])
-    return lat, lon
-
-
-# --- SET ENVIRONMENT ---
-# Get environment variables
-load_dotenv()
-oc_apikey = os.getenv("OC_APIKEY")
-esri_apikey = os.getenv("ESRI_APIKEY")
-esri_user = os.getenv("ESRI_USER")
-esri_pass = os.getenv("ESRI_PASS")
-
-# Avoid Pandas's warnings
-pd.options.mode.chained_assignment = None
-
-# Ask for starting variables
-while True:
-    year = input("Ingresa el año de los datos a geocodificar (aaaa):")
-    if len(year) != 4:
-        print(f"El año ingresado debe tener 4 caracteres numéricos")
-        continue
-    try:
-        int(year)
-    except Exception as e:
-        print("El año ingresado debe tener solo caracteres numéricos")
-        continue
-    break
-
-while True:
-    month = input("Ingresa el mes de los datos a geocodificar (mm):")
-    if len(month) != 2:
-        print(f"El mes ingresado debe tener 2 caracteres numéricos")
-        continue
-    try:
-        int(month)
-    except Exception as e:
-        print("El año ingresado debe tener solo caracteres numéricos")
-        continue
-    break
-
-# Set starting variables
-os.chdir(input("Ingrese la ruta del directorio en el cual trabajar:\n"))
-
-main_path = Path.cwd()  # / "../"
-orig_filename = f"Avp {month} del {year} con género.xlsx"
-dest_filename = f"{year}-{month}_AVP-geocoded.xlsx"
-log_filename = f"{year}-{month}_AVP-geocoded.log"
-
-orig_path = main_path / f"data/{year}"
-dest_path = main_path / f"results/{year}"
-log_path = main_path / f"logs/{year}"
-map_path = main_path / "graphs"
-
-# Read main dataframe
-try:
-    df = pd.read_excel(orig_path / orig_filename)
-except Exception as e:
-    print("Error: Archivo no encontrado.")
-    print(f"Búsqueda de: {orig_filename}")
-    print(f"Búsqueda en: {orig_path}")
-    print()
-    input("Presione enter para salir.")
-    sys.exit(1)
-
-# Validate id column
-if df["id"].isnull().any():
-    print()
-    print("Error: La columna 'id' no debe tener celdas vacías.")
-    input("Presione enter para salir.")
-    sys.exit(1)
-
-try:
-    df["id"] = df["id"].astype("int64")
-except:
-    print()
-    print("Error: La columna 'id' debe tener sólo valores numéricos.")
-    input("Presione enter para salir.")
-    sys.exit(1)
-
-if df["id"].duplicated().any():
-    print()
-    print("Error: La columna 'id' no debe tener celdas repetidas.")
-    input("Presione enter para salir.")
-    sys.exit(1)
-
-# Create destination folders
-if not os.path.isdir(dest_path):
-    os.makedirs(dest_path)
-if not os.path.isdir(log_path):
-    os.makedirs(log_path)
-if not os.path.isdir(map_path):
-    os.makedirs(map_path)
-
-# Set up configuration for logging to a file and to the console
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(message)s", "%Y-%m-%d")
-
-file_handler = logging.FileHandler(log_path / log_filename)
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(formatter)
-
-stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.INFO)
-stream_handler.setFormatter(formatter)
-
-logger.addHandler(file_handler)
-
-
-# --- TRANSFORM DATASET ---
-
-# Format column names
-df.columns = [x.lower() for x in df.columns]
-
-dict_rename = {"fecha de ingreso": "fecha_ingreso", "lugar del avp": "direccion_avp"}
-df.rename(columns=dict_rename, inplace=True)
-
-df.columns = df.columns.str.replace(" ", "_")
-
-# Create unique ID for each row
-n_rows = len(df.index)
-n_digits = len(str(n_rows))
-
-df["id"] = year + month + df["id"].astype(str).str.zfill(n_digits)
-
-len_id = len(df.loc[0, "id"])
-
-# Format addresses columns
-df["direccion_avp"] = df["direccion_avp"].str.lower()
-
-df["direccion_orig"] = df["direccion_avp"]
-
-# Create column for Latitude and Longitude
-df.insert(len(df.columns), "lat", np.NaN)
-df.insert(len(df.columns), "lon", np.NaN)
-
-# Separate null values for adress into a new dataframe
-mask = df["direccion_orig"].isnull()
-df_geo_na = df.loc[mask, :]
-df1 = df.loc[~mask, :]
-
-# Format queries, adding city of location as suffix and changing some streets names
-ids_rosario_no = []
-dict_cities = {
-    "vgg": "Villa Gobernador Galvez",
-    "luis palacios": "Luis Palacios",
-    "casilda": "Casilda",
-    "funes": "Funes",
-    "roldan": "Roldan",
-    "soldini": "Soldini",
-}
-
-for k, v in dict_cities.items():
-    df1, ids_rosario_no = city_filler(df1, k, v, ids_rosario_no)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace("ref ", "")
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace("/", " y ")
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"circun\w*\s?", "Avenida de Circunvalación 25 de Mayo ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(av\w*\s)?27 de feb\w*\s?", "Bulevar 27 de Febrero ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(bulevar\w*\s)?(bv)?(av\w*\s)?oroño\s?",
-    "Bulevar Nicasio Oroño ",
-    regex=True,
-    case=False,
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(bulevar\w*\s)?(bv)?(av\w*\s)?rond\w*\s?",
-    "Bulevar General José Rondeau ",
-    regex=True,
-    case=False,
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(av\w*\s)?uriburu\s?", "Avenida José Uriburu ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(av\w*\s)?san mart\w*\s?", "Avenida José de San Martín ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(ovidio\s)?lagos\s?", "Avenida Ovidio Lagos ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(av\w*\s)?pel(l)?egrini\s?", "Avenida Carlos Pellegrini ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(av\w*\s)?francia\s?", "Avenida Francia ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"(av\w*\s)?godoy\s?", "Avenida Presidente Perón ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"colectora\s?", "Colectora Juan Pablo II ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"a(0)?(o)?(\s)?12", "Ruta Nacional A012 ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"b(\w*)?\s*(y)?\s*ordoñez", "Avenida Battle y Ordoñez ", regex=True, case=False
-)
-
-df1["direccion_avp"] = df1["direccion_avp"].str.replace(
-    r"\s+", " ", regex=True, case=False
-)
-
-mask = ~df1["id"].isin(ids_rosario_no)
-df1.loc[mask, "direccion_avp"] = (
-    df1.loc[mask, "direccion_avp"].str.strip() + ", Rosario, Santa Fe, Argentina"
-)
-
-
-# --- Geocode addresses with OpenCage ---
-# Get adresses to geocode as a list (discard intersections for OpenCage)
-mask = df1.apply(lambda r: bool(re.search(" y ", r["direccion_avp"])), axis=1)
-df_geo_oc = df1.loc[~mask, :]
-
-list_addresses_oc = df_geo_oc["direccion_avp"].tolist()
-
-# Set geocoder object using the corresponding apikey
-try:
-    geocoder = OpenCageGeocode(oc_apikey)
-except Exception as e:
-    logger.error(e, exc_info=True)
-    raise
-
-# Geocode list of addresses and add Latitude and Longitude to the dataframe
-list_oc = []
-list_oc_lat = []
-list_oc_lon = []
-
-print("- Comienzo de la geocodificación con el servicio OpenCage -")
-for address in list_addresses_oc:
-    lat = lon = np.NaN
-    try:
-        lat, lon = oc_geocoder(geocoder, address)
-    except Exception as e:
-        logger.debug("Can not geocode address: " + address)
-        logger.debug(e)
-    list_oc_lat.append(lat)
-    list_oc_lon.append(lon)
-
-
-df_geo_oc["lat"] = list_oc_lat
-df_geo_oc["lon"] = list_oc_lon
-
-# Discard observations with generic coords or null coords (worongly geocoded addresses)
-mask = (df_geo_oc["lat"] == -32.946820) | (df_geo_oc["lon"] == -60.63932)
-df_geo_oc.loc[mask, "lat"] = np.NaN
-df_geo_oc.loc[mask, "lon"] = np.NaN
-
-mask = ~((df_geo_oc["lat"].isnull()) | (df_geo_oc["lon"].isnull()))
-df_geo_oc = df_geo_oc.loc[mask, :]
-
-# Check interactively for wrongly geocoded adresses
-ids_geo_oc = df_geo_oc.loc[:, "id"].tolist()
-ids_geo_oc_wrong = []
-
-ids_geo_oc_wrong = geo_checker(
-    df=df_geo_oc, list_right=ids_geo_oc, list_wrong=ids_geo_oc_wrong
-)
-
-# Keep just correctly geocoded addresses
-mask = ~df_geo_oc["id"].isin(ids_geo_oc_wrong)
-df_geo_oc = df_geo_oc.loc[mask, :]
-
-
-# --- Geocode remaining adresses with Esri ---
-# Get adresses to geocode as a list
-mask = ~df1["id"].isin(ids_geo_oc_wrong)
-df_geo_esri = df1.loc[mask, :]
-
-list_addresses_esri = df_geo_esri["direccion_avp"].tolist()
-
-# Set gis object using the corresponding user, password, apikey
-try:
-    gis = GIS(username=esri_user, password=esri_pass, api_key=esri_apikey)
-except Exception as e:
-    logger.error(e, exc_info=True)
-    raise
-
-# Geocode list of addresses and add Latitude and Longitude to the dataframe
-list_esri = []
-list_esri_lat = []
-list_esri_lon = []
-
-print("- Comienzo de la geocodificación con el servicio ESRI de ArcGis -")
-for address in list_addresses_esri:
-    lat = lon = np.NaN
-    try:
-        lat, lon = esri_geocoder(address)
-    except Exception as e:
-        logger.debug("Can not geocode address: " + address)
-        logger.debug(e)
-    list_esri_lat.append(lat)
-    list_esri_lon.append(lon)
-
-df_geo_esri.loc[:, "lat"] = list_esri_lat
-df_geo_esri.loc[:, "lon"] = list_esri_lon
-
-# Discard observations with null coords and add them to the original null list
-mask = ~((df_geo_esri["lat"].isnull()) | (df_geo_esri["lon"].isnull()))
-df_geo_na = pd.concat([df_geo_na, df_geo_esri.loc[~mask, :]], axis=0)
-df_geo_esri = df_geo_esri.loc[mask, :]
-
-# Check interactively for wrongly geocoded adresses
-ids_geo_esri = df_geo_esri.loc[:, "id"].tolist()
-ids_geo_esri_wrong = []
-
-ids_geo_esri_wrong = geo_checker(
-    df=df_geo_esri, list_right=ids_geo_esri, list_wrong=ids_geo_esri_wrong
-)
-
-# Set Latitude and Longitude to null value for wrongly geocoded observations
-mask = df_geo_esri["id"].isin(ids_geo_esri_wrong)
-df_geo_esri.loc[mask, "lat"] = np.NaN
-df_geo_esri.loc[mask, "lon"] = np.NaN
-
-
-# --- Save concatenation of the three dataframes: OpenCage, Esri and not geocoded ---
-df_list = [df_geo_na, df_geo_oc, df_geo_esri]
-
-df_total = pd.concat(df_list, axis=0)
-
-try:
-    assert df.shape[0] == df_total.shape[0]
-except Exception as e:
-    logger.error(e, exc_info=True)
-    pass
-
-while True:
-    try:
-        df_total.to_excel(dest_path / dest_filename, index=False)
-        print("- Archivo guardado correctamente")
-        break
-    except Exception as e:
-        print(e)
-    input("Press enter to try again")
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyinputplus as pyip
+from arcgis.gis import GIS
+from dotenv import load_dotenv
+from fun.aggregates import AggregateStore, cells_labeler
+from fun.archive import archive_writer, cache_warmer
+from fun.corrections import CorrectionStore
+from fun.enrich import boundaries_getter
+from fun.export import gis_formats, gis_writer
+from fun.formatqueries import rules_loader
+from fun.geocache import GeocodeCache
+from fun.geocoders import calls_estimator, checks_estimator
+from fun.hotspots import HotspotStore
+from fun.incremental import previous_rows_getter, previous_rows_joiner, rows_hasher
+from fun.pipeline import geocode_dataframe, settings_getter
+from fun.quota import QuotaExhausted, QuotaTracker
+from fun.regionpack import region_getter
+from fun.review import geo_checker
+from fun.reviewboard import ReviewBoard
+from fun.sampling import sample_selector, strata_evaluator
+from fun.streets import streets_getter
+from fun.tiles import archive_tiler, tiles_updater, zooms_parser
+from fun.workqueue import WorkQueue
+from opencage.geocoder import OpenCageGeocode
+
+dummy_bool = False
+if dummy_bool:
+    """
+    These are modules that are required by arcgis and are installed as dependencies.
+    The problem is that the importing inside the arcgis module is dynamic,
+    so py-installer do not take them in account when compiling the script into an .exe file.
+    Adding these lines of declared imports makes py-installer to consider the modules in the
+    .exe file that it creates, allowing arcgis module to access them.
+    """
+    import arcgis.env as arcgis_env
+    import arcgis as arcgis
+    import arcgis.gis.agoserver._api as _agoserver
+    import arcgis._impl.common._mixins as _mixins
+    import arcgis._impl.common._utils as _common_utils
+    import arcgis._impl.common._deprecate as _common_deprecated
+    import arcgis.gis._impl._portalpy as _portalpy
+    import arcgis.gis._impl._jb as _jb
+
+    import requests_ntlm
+    import requests
+    import requests_negotiate_sspi
+    import requests_gssapi
+    import requests_kerberos
+
+
+# Formatting processes of the .exe start here, without running the program again
+multiprocessing.freeze_support()
+
+# --- Instrucciones para uso del programa ---
+instructions = """
+Para poder correr el programa se puede tener el .exe en un directorio a gusto del usuario.
+En el mismo directorio se deberá tener una carpeta con el nombre 'data' y un archivo '.env' con las credenciales.
+Dentro de la carpeta 'data', una subcarpeta con el año(aaaa) como nombre.
+Dentro de la carpeta con nombre del año, el archivo a geocodificar cuyo nombre debe tener el siguiente formato:
+'Avp <mes(mm)> del <anio(aaaa)> con género.xlsx'
+
+El dataset utilizado debe tener columnas con los siguientes nombres:
+- 'id'
+- 'fecha de ingreso'
+- 'lugar del avp'
+"""
+
+print(instructions)
+
+response = pyip.inputYesNo(
+    prompt="Ingrese 'si' en caso de cumplir los requerimientos. 'no' para salir. ('si/no') \n",
+    yesVal="si",
+    noVal="no",
+)
+
+if response == "si":
+    pass
+elif response == "no":
+    sys.exit(1)
+
+
+def shared_checker(df, session):
+    """
+    This function reviews the observations together with other reviewers through the shared
+    review board: observations are split into geographic partitions, this reviewer checks
+    partitions (each one in its own map) while the others do the same with avp-reviewer, and
+    the wrong IDs of every partition are merged when all of them are done.
+
+    :df: Dataframe with geocoded observations to review.
+    :session: Name of the review session (month and stage).
+
+    :return: List of wrongly geocoded observations Ids.
+    """
+    board = ReviewBoard(review_board_path)
+    n_parts = board.session_opener(session, df, review_partitions)
+
+    print(f"Revisión compartida '{session}' en {n_parts} partes.")
+    print("Otros revisores pueden sumarse ejecutando avp-reviewer con el mismo REVIEW_BOARD_PATH.")
+    logger.info(f"Shared review {session}: {len(df)} rows in {n_parts} partitions")
+
+    while True:
+        taken = board.partition_getter(reviewer_name, [session])
+
+        # No partitions left for this reviewer: wait for the ones under review by others
+        if taken is None:
+            progress = board.progress(session)
+            if not progress.get("pending") and not progress.get("leased"):
+                break
+            print(f"Esperando a los demás revisores: {progress.get('leased', 0)} partes en revisión.")
+            time.sleep(15)
+            continue
+
+        _, part, df_part = taken
+        print(f"Parte {part} de {n_parts}: {len(df_part)} direcciones.")
+        try:
+            list_wrong = geo_checker(
+                df=df.loc[df["id"].isin(df_part["id"]), :],
+                list_right=df_part["id"].tolist(),
+                list_wrong=[],
+                output_file=map_path / f"map_geo_{part}.html",
+            )
+        except BaseException:
+            board.partition_releaser(session, part)
+            raise
+        board.decisions_submitter(session, part, reviewer_name, list_wrong)
+
+    list_wrong = board.wrong_getter(session)
+    board.close()
+
+    logger.info(f"Shared review {session}: {len(list_wrong)} wrong")
+    return list_wrong
+
+
+def rows_checker(df, list_wrong, session):
+    """
+    This function reviews the observations, alone or with other reviewers if a shared review
+    board is set.
+
+    :df: Dataframe with geocoded observations to review.
+    :list_wrong: List of IDs already marked as wrongly geocoded.
+    :session: Name of the review session (month and stage).
+
+    :return: List of wrongly geocoded observations Ids.
+    """
+    if review_board_path:
+        return sorted(set(list_wrong) | set(shared_checker(df, session)))
+
+    return geo_checker(
+        df=df,
+        list_right=df["id"].tolist(),
+        list_wrong=list_wrong,
+        output_file=map_path / "map_geo.html",
+    )
+
+
+def sample_checker(df, mask_full, session):
+    """
+    This function reviews a large set of geocoded observations by sampling. The reviewer checks
+    a random sample of each stratum (service and type of address) and every high risk observation.
+    Then the error rate of each stratum is estimated, and the strata whose upper confidence bound
+    exceeds the accepted error are reviewed in full.
+
+    :df: Dataframe with geocoded observations to review.
+    :mask_full: Boolean Series, True for high risk observations (always reviewed).
+    :session: Name of the review session (month and stage).
+
+    :return: List of wrongly geocoded observations Ids.
+    """
+    index_sample = sample_selector(df, mask_full, review_sample_size)
+    df_sample = df.loc[index_sample, :]
+
+    print(f"Revisión por muestreo: {len(df_sample)} de {len(df)} direcciones.")
+    list_wrong = rows_checker(df_sample, [], f"{session} muestra")
+
+    report, index_rest = strata_evaluator(
+        df, mask_full, index_sample, df.index[df["id"].isin(list_wrong)], review_max_error
+    )
+    for row in report.itertuples():
+        print(
+            f"{row.provider} / {row.tipo_direccion}: {row.errors} errores en {row.sample} "
+            f"de {row.rows}, error estimado {row.error_rate:.1%} "
+            f"(IC 95%: {row.lower:.1%} - {row.upper:.1%})"
+            + (" -> revisión completa" if row.escalated else "")
+        )
+        logger.info(
+            f"Sampling review {row.provider}/{row.tipo_direccion}: {row.errors} errors in "
+            f"{row.sample} of {row.rows}, bounds {row.lower:.3f}-{row.upper:.3f}, "
+            f"escalated {row.escalated}"
+        )
+
+    if len(index_rest):
+        df_rest = df.loc[index_rest, :]
+        list_wrong = rows_checker(df_rest, list_wrong, f"{session} resto")
+
+    return list_wrong
+
+
+def quota_pauser(e):
+    """
+    This function stops the program when a geocoding service has no quota left, instead of
+    leaving the remaining addresses blank. Results already obtained are kept in the cache, and
+    the rows already accepted or reviewed are saved in the results file, so running the program
+    again (e.g. the next day) continues from where it stopped without reviewing them again.
+
+    :e: QuotaExhausted exception.
+    """
+    logger.info(f"Run paused: {e}")
+    print()
+    print("Cuota del servicio de geocodificación agotada. Los resultados obtenidos quedaron guardados.")
+
+    # Finished rows (and the unchanged ones of the previous run) are carried over by the next run
+    if e.partial is not None and not e.partial.empty:
+        df_partial = previous_rows_joiner(df_prev, e.partial.drop(columns="revisar"))
+        try:
+            df_partial.to_excel(dest_path / dest_filename, index=False)
+            print(f"{len(e.partial)} filas terminadas guardadas en {dest_filename}.")
+            logger.info(f"{len(e.partial)} finished rows saved before pausing")
+        except Exception as e_save:
+            logger.error(e_save, exc_info=True)
+            print("Error: No se pudieron guardar las filas terminadas (ver log).")
+
+    print("Ejecute nuevamente el programa cuando se renueve la cuota para continuar.")
+    cache.close()
+    corrections.close()
+    hotspots.close()
+    input("Presione enter para salir.")
+    sys.exit(0)
+
+
+def calls_planner(df, dict_queries, dict_esri):
+    """
+    This function prepares the calls to the paid services, before the pipeline starts them:
+    results of other months of the archive and of the workers of the shared queue are copied to
+    the cache, the missing queries can be sent to the queue (and the program ends), and the calls
+    needed are compared with the quota left.
+
+    :df: Working dataframe with the formatted queries.
+    :dict_queries: Dictionary with the name of each service as key and its queries as value.
+    :dict_esri: Dictionary with the formatted query as key and its structured address for ESRI.
+    """
+    # Results of the same queries in other months of the archive are not paid again
+    queries = df.loc[df["direccion_orig"].notnull(), "direccion_avp"].astype(str).tolist()
+    try:
+        n_warm = cache_warmer(archive_path, cache, queries)
+        logger.info(f"{n_warm} results added to the cache from the archive")
+    except Exception as e:
+        logger.warning(f"The archive can not be read, the cache is not filled from it: {e}")
+
+    # Results of the workers of the shared queue are copied to the cache, so they are not paid again
+    if queue_path:
+        queue = WorkQueue(queue_path, rules.version)
+        for provider in dict_queries:
+            for query, result in queue.results_getter(provider).items():
+                if cache.get(provider, query) is None:
+                    cache.set(provider, query, result)
+
+        # Jobs that failed in every attempt of the workers are geocoded in this computer
+        dict_failed = {provider: set(queue.failed_getter(provider)) for provider in dict_queries}
+        n_failed = sum(
+            len(set(queries) & dict_failed[provider]) for provider, queries in dict_queries.items()
+        )
+        if n_failed:
+            print(f"{n_failed} consultas fallaron en la cola, se geocodificarán en este equipo.")
+            logger.info(f"{n_failed} queries failed in the queue")
+
+        # Queries still missing can be sent to the queue, to be geocoded by the workers
+        dict_missing = {
+            provider: [
+                x
+                for x in queries
+                if cache.get(provider, x) is None and x not in dict_failed[provider]
+            ]
+            for provider, queries in dict_queries.items()
+        }
+        if any(dict_missing.values()):
+            print(f"{sum(len(set(x)) for x in dict_missing.values())} consultas sin geocodificar.")
+            response = pyip.inputYesNo(
+                prompt="Ingrese 'si' para enviarlas a la cola de los trabajadores y salir. "
+                "'no' para geocodificarlas en este equipo. ('si/no') \n",
+                yesVal="si",
+                noVal="no",
+            )
+            if response == "si":
+                for provider, queries in dict_missing.items():
+                    n_jobs = queue.jobs_adder(provider, queries, dict_esri)
+                    logger.info(f"{n_jobs} {provider} jobs added to the queue")
+                print("Consultas enviadas. Ejecute nuevamente el programa cuando los trabajadores terminen.")
+                logger.info(f"Queue progress: {queue.progress()}")
+                queue.close()
+                cache.close()
+                corrections.close()
+                hotspots.close()
+                input("Presione enter para salir.")
+                sys.exit(0)
+        queue.close()
+
+    # Estimate the calls needed (after cache and duplicates) against the quota left. OpenCage
+    # failures go to Esri, so Esri also counts the OpenCage queries without a result yet
+    dict_calls = {
+        "opencage": calls_estimator(dict_queries["opencage"], "opencage", cache),
+        "esri": calls_estimator(
+            dict_queries["esri"], "esri", cache, (dict_queries["opencage"], "opencage")
+        ),
+    }
+
+    # Samples of the results of each service are validated with the other one: OpenCage results
+    # (the ones already known) with Esri, and Esri results (except intersections) with OpenCage
+    queries_checked = df.loc[
+        df["direccion_avp"].isin(dict_queries["esri"]) & (df["tipo_direccion"] != "interseccion"),
+        "direccion_avp",
+    ].tolist()
+    dict_calls["opencage"] += checks_estimator(
+        queries_checked, "opencage", cache, settings["cross_check_sample"]
+    )
+    dict_calls["esri"] += checks_estimator(
+        [x for x in dict_queries["opencage"] if cache.get("opencage", x)],
+        "esri",
+        cache,
+        settings["cross_check_sample"],
+    )
+    for provider, n_calls in dict_calls.items():
+        remaining = quota.remaining(provider)
+        available = "sin límite" if remaining == float("inf") else int(remaining)
+        print(f"{provider}: {n_calls} consultas nuevas estimadas, {available} disponibles.")
+        logger.info(f"{provider}: {n_calls} estimated calls, {remaining} remaining")
+        if n_calls > remaining:
+            print(f"La cuota de {provider} no alcanza: el proceso se pausará al agotarse.")
+
+
+def stage_reviewer(df, mask_accepted, mask_hotspot, provider):
+    """
+    This function reviews the results of a service that were not accepted automatically: in
+    full, by sampling when there are many of them, or with other reviewers (see rows_checker).
+
+    :df: Working dataframe with the results of the service.
+    :mask_accepted: Boolean Series, True for the automatically accepted rows (index of the
+    geocoded rows).
+    :mask_hotspot: Boolean Series, True for the suspicious rows (same index).
+    :provider: Name of the geocoding service.
+
+    :return: List of wrongly geocoded observations Ids.
+    """
+    df_review = df.loc[mask_accepted.index[~mask_accepted], :]
+    name = {"opencage": "OpenCage", "esri": "ESRI"}[provider]
+    print(f"{name}: {mask_hotspot.sum()} direcciones en puntos sospechosos.")
+    print(f"{name}: {mask_accepted.sum()} direcciones aceptadas automáticamente, {len(df_review)} a revisar.")
+
+    ids_review = df_review["id"].tolist()
+    if review_sampling and len(ids_review) > review_sampling_min:
+        return sample_checker(
+            df_review,
+            mask_hotspot.reindex(df_review.index, fill_value=False),
+            f"{year}-{month} {provider}",
+        )
+    if ids_review:
+        return rows_checker(df_review, [], f"{year}-{month} {provider}")
+
+    return []
+
+
+# --- SET ENVIRONMENT ---
+# Get environment variables
+load_dotenv()
+oc_apikey = os.getenv("OC_APIKEY")
+esri_apikey = os.getenv("ESRI_APIKEY")
+esri_user = os.getenv("ESRI_USER")
+esri_pass = os.getenv("ESRI_PASS")
+
+# Settings of the pipeline: acceptance policy, routing, cross-check and retry of the addresses
+settings = settings_getter()
+
+# Limits of the services: calls per day, credits per month and credits per call (empty to disable)
+quota_limits = settings["quota_limits"]
+
+# Review by sampling when there are more than the minimum of rows to review: sample size of each
+# stratum and maximum error rate accepted for the rows not reviewed (upper 95% bound)
+review_sampling = os.getenv("REVIEW_SAMPLING", "0") not in ("", "0")
+review_sampling_min = int(os.getenv("REVIEW_SAMPLING_MIN_ROWS") or 200)
+review_sample_size = int(os.getenv("REVIEW_SAMPLE_SIZE") or 50)
+review_max_error = float(os.getenv("REVIEW_MAX_ERROR") or 0.10)
+
+# Shared review board to review with several people at once (empty to review alone), number of
+# partitions of each review and name of this reviewer
+review_board_path = os.getenv("REVIEW_BOARD_PATH")
+review_partitions = int(os.getenv("REVIEW_PARTITIONS") or 4)
+reviewer_name = os.getenv("REVIEWER_NAME") or socket.gethostname()
+
+# Geocode only the rows that are new or changed since the previous run of the same file
+incremental = os.getenv("INCREMENTAL", "1") not in ("", "0")
+
+# Shared queue of jobs for the workers of other machines (empty to geocode only here)
+queue_path = os.getenv("QUEUE_PATH")
+
+# Zoom levels of the tile pyramid of the map of every month, 'min-max' or a single level (empty
+# to disable)
+tiles_zooms = zooms_parser(os.getenv("TILES_ZOOMS", "10-16"))
+
+# Categorical columns counted by value in the aggregates, and side in degrees of their grid cells
+aggregates_columns = [x.strip() for x in (os.getenv("AGGREGATES_COLUMNS") or "genero").split(",")]
+aggregates_cell = float(os.getenv("AGGREGATES_CELL") or 0.005)
+
+# Format of the point layer saved with the results for GIS tools: gpkg or fgb (empty to disable)
+gis_format = os.getenv("GIS_FORMAT", "gpkg").lower()
+
+# Grid cell size in degrees and distinct queries in a cell to flag it as a fallback hotspot
+hotspot_cell = float(os.getenv("HOTSPOT_CELL") or 0.0003)
+hotspot_min_queries = int(os.getenv("HOTSPOT_MIN_QUERIES") or 5)
+
+# Region pack (rules, streets and boundaries precompiled for a region), if one is set
+region = region_getter()
+
+# Rules to format the queries (compiled once)
+rules = region.rules if region else rules_loader()
+
+# Avoid Pandas's warnings
+pd.options.mode.chained_assignment = None
+
+# Ask for starting variables
+while True:
+    year = input("Ingresa el año de los datos a geocodificar (aaaa):")
+    if len(year) != 4:
+        print(f"El año ingresado debe tener 4 caracteres numéricos")
+        continue
+    try:
+        int(year)
+    except Exception as e:
+        print("El año ingresado debe tener solo caracteres numéricos")
+        continue
+    break
+
+while True:
+    month = input("Ingresa el mes de los datos a geocodificar (mm):")
+    if len(month) != 2:
+        print(f"El mes ingresado debe tener 2 caracteres numéricos")
+        continue
+    try:
+        int(month)
+    except Exception as e:
+        print("El año ingresado debe tener solo caracteres numéricos")
+        continue
+    break
+
+# Set starting variables
+os.chdir(input("Ingrese la ruta del directorio en el cual trabajar:\n"))
+
+main_path = Path.cwd()  # / "../"
+orig_filename = f"Avp {month} del {year} con género.xlsx"
+dest_filename = f"{year}-{month}_AVP-geocoded.xlsx"
+log_filename = f"{year}-{month}_AVP-geocoded.log"
+
+orig_path = main_path / f"data/{year}"
+dest_path = main_path / f"results/{year}"
+log_path = main_path / f"logs/{year}"
+map_path = main_path / "graphs"
+cache_path = main_path / "cache"
+archive_path = Path(os.getenv("ARCHIVE_PATH") or main_path / "archive")
+tiles_path = Path(os.getenv("TILES_PATH") or main_path / "tiles")
+aggregates_path = Path(os.getenv("AGGREGATES_PATH") or main_path / "results/aggregates.sqlite")
+
+# Read main dataframe
+try:
+    df = pd.read_excel(orig_path / orig_filename)
+except Exception as e:
+    print("Error: Archivo no encontrado.")
+    print(f"Búsqueda de: {orig_filename}")
+    print(f"Búsqueda en: {orig_path}")
+    print()
+    input("Presione enter para salir.")
+    sys.exit(1)
+
+# Validate id column
+if df["id"].isnull().any():
+    print()
+    print("Error: La columna 'id' no debe tener celdas vacías.")
+    input("Presione enter para salir.")
+    sys.exit(1)
+
+try:
+    df["id"] = df["id"].astype("int64")
+except:
+    print()
+    print("Error: La columna 'id' debe tener sólo valores numéricos.")
+    input("Presione enter para salir.")
+    sys.exit(1)
+
+if df["id"].duplicated().any():
+    print()
+    print("Error: La columna 'id' no debe tener celdas repetidas.")
+    input("Presione enter para salir.")
+    sys.exit(1)
+
+# Digits of the row number in the unique ID (fixed, so that the IDs of a month do not change
+# when its file is delivered again with more rows)
+id_digits = 6
+
+if (df["id"] < 0).any() or (df["id"] >= 10**id_digits).any():
+    print()
+    print(f"Error: La columna 'id' debe tener valores positivos de hasta {id_digits} dígitos.")
+    input("Presione enter para salir.")
+    sys.exit(1)
+
+# Create destination folders
+if not os.path.isdir(dest_path):
+    os.makedirs(dest_path)
+if not os.path.isdir(log_path):
+    os.makedirs(log_path)
+if not os.path.isdir(map_path):
+    os.makedirs(map_path)
+if not os.path.isdir(cache_path):
+    os.makedirs(cache_path)
+
+# Set up configuration for logging to a file and to the console
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(message)s", "%Y-%m-%d")
+
+file_handler = logging.FileHandler(log_path / log_filename)
+file_handler.setLevel(logging.DEBUG)
+file_handler.setFormatter(formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+
+
+# --- TRANSFORM DATASET ---
+
+# Format column names
+df.columns = [x.lower() for x in df.columns]
+
+dict_rename = {"fecha de ingreso": "fecha_ingreso", "lugar del avp": "direccion_avp"}
+df.rename(columns=dict_rename, inplace=True)
+
+df.columns = df.columns.str.replace(" ", "_")
+
+# Compare the rows with the results of a previous run of the same file: unchanged rows keep their
+# coordinates and review decisions, and only new or edited rows are geocoded and reviewed.
+# The hash uses the ID and the address as delivered
+df["hash_fila"] = rows_hasher(df["id"], df["direccion_avp"])
+
+# Create unique ID for each row (stored as integer)
+df["id"] = (year + month + df["id"].astype(str).str.zfill(id_digits)).astype("int64")
+
+df_prev = pd.DataFrame()
+if incremental:
+    df_prev, mask_unchanged = previous_rows_getter(dest_path / dest_filename, df["hash_fila"])
+    df = df.loc[~mask_unchanged, :]
+
+    print(f"{mask_unchanged.sum()} filas sin cambios desde la ejecución anterior, {len(df)} nuevas o modificadas.")
+    logger.info(f"{mask_unchanged.sum()} unchanged rows carried over, {len(df)} new or changed")
+
+if df.empty:
+    print("No hay filas nuevas o modificadas para geocodificar.")
+    input("Presione enter para salir.")
+    sys.exit(0)
+
+
+# --- Open the stores of previous runs and the sessions of the services ---
+# Open the cache of already geocoded queries and the count of calls to the services
+cache = GeocodeCache(cache_path / "geocodes.sqlite", rules.version, settings["cache_miss_days"])
+quota = QuotaTracker(cache_path / "quota.json", quota_limits)
+
+# Corrections learned from previous manual reviews (hand-edited results are found with the cache)
+corrections = CorrectionStore(cache_path / "corrections.sqlite", rules.version)
+n_learned = corrections.results_learner(main_path / "results", cache)
+logger.info(f"{n_learned} new manual corrections learned from previous results")
+
+# Learn fallback hotspots of the services from previous results
+hotspots = HotspotStore(
+    cache_path / "hotspots.sqlite", cell_size=hotspot_cell, min_queries=hotspot_min_queries
+)
+hotspots.results_learner(main_path / "results")
+
+# Street centerlines (KD-trees built once) to flag results far from the streets of their address
+streets = region.streets if region else streets_getter(main_path)
+
+# Neighbourhood and district layers, joined to every geocoded observation
+boundaries = region.boundaries if region else boundaries_getter(main_path)
+
+# Set geocoder object using the corresponding apikey
+try:
+    geocoder = OpenCageGeocode(oc_apikey)
+except Exception as e:
+    logger.error(e, exc_info=True)
+    raise
+
+# Set gis object using the corresponding user, password, apikey
+try:
+    gis = GIS(username=esri_user, password=esri_pass, api_key=esri_apikey)
+except Exception as e:
+    logger.error(e, exc_info=True)
+    raise
+
+
+# --- Geocode: corrections, OpenStreetMap, OpenCage and Esri, with a review after each service ---
+# Queries are formatted, split into components and geocoded by the shared pipeline (the same as
+# avp-service). The original address is kept in 'direccion_orig' and the query in 'direccion_avp'
+print("- Comienzo de la geocodificación -")
+try:
+    df = geocode_dataframe(
+        df,
+        rules,
+        geocoder,
+        cache,
+        logger,
+        settings,
+        corrections,
+        hotspots,
+        quota,
+        boundaries,
+        streets,
+        planner=calls_planner,
+        reviewer=stage_reviewer,
+    )
+except QuotaExhausted as e:
+    quota_pauser(e)
+
+df = df.drop(columns="revisar")
+logger.info(f"Boundary layers joined: {list(boundaries)}")
+
+
+# --- Save the working dataframe: manual corrections, OpenCage, Esri and not geocoded ---
+# Add the unchanged rows of the previous run
+df = previous_rows_joiner(df_prev, df)
+
+while True:
+    try:
+        df.to_excel(dest_path / dest_filename, index=False)
+        print("- Archivo guardado correctamente")
+        break
+    except Exception as e:
+        print(e)
+    input("Press enter to try again")
+
+# Save also a point layer with spatial index, ready to open in QGIS/ArcGIS
+if gis_format in gis_formats:
+    try:
+        gis_writer(
+            df, (dest_path / dest_filename).with_suffix(f".{gis_format}"), gis_formats[gis_format]
+        )
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        print("Error: No se pudo guardar la capa geográfica de resultados (ver log).")
+
+# Add (or replace) the month in the archive of every year, for queries across months
+try:
+    archive_writer(df, archive_path, year, month, rules.version)
+except Exception as e:
+    logger.error(e, exc_info=True)
+    print("Error: No se pudo actualizar el archivo histórico (ver log).")
+
+# Add (or replace) the month in the tile pyramid (built from the whole archive the first time)
+if tiles_zooms:
+    try:
+        if os.path.isfile(tiles_path / "index.json"):
+            tiles_updater(df, tiles_path, f"{year}-{month}", *tiles_zooms)
+        else:
+            archive_tiler(archive_path, tiles_path, *tiles_zooms)
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        print("Error: No se pudo actualizar el mapa de todos los meses (ver log).")
+
+# Replace the counts of the month by area (boundaries and grid cells) and attribute. Columns of
+# the settings that are not in the results (e.g. spelled otherwise in the file) are not counted
+aggregates_missing = [x for x in aggregates_columns if x not in df.columns]
+if aggregates_missing:
+    print(f"Aviso: Columnas de AGGREGATES_COLUMNS que no están en los resultados: {aggregates_missing}")
+    logger.warning(f"Aggregate columns not in the results: {aggregates_missing}")
+
+try:
+    aggregates = AggregateStore(aggregates_path)
+    n_counts = aggregates.month_updater(
+        df.assign(celda=cells_labeler(df["lat"], df["lon"], aggregates_cell)),
+        f"{year}-{month}",
+        list(boundaries) + ["celda"],
+        aggregates_columns,
+    )
+    aggregates.close()
+    logger.info(f"{n_counts} aggregate counts stored")
+except Exception as e:
+    logger.error(e, exc_info=True)
+    print("Error: No se pudieron actualizar los totales por zona (ver log).")
+
+# Keep the list of learned hotspots for reference
+hotspots.hotspots().to_csv(cache_path / "hotspots.csv", index=False)
+
+cache.close()
+corrections.close()
+hotspots.close()
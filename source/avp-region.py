@@ -0,0 +1,47 @@
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from fun.enrich import layers
+from fun.formatqueries import default_rules_path, rules_loader
+from fun.regionpack import region_builder
+
+# --- Instrucciones para uso del programa ---
+instructions = """
+Armado de un paquete de región.
+Reúne el archivo de reglas de la región (RULES_PATH), las calles (STREETS_PATH) y los barrios y distritos
+(BARRIOS_PATH, DISTRITOS_PATH) en una carpeta con formatos binarios precompilados, que avp-geocode,
+avp-service y avp-worker cargan sin volver a procesarlos (REGION_PATH en el archivo '.env').
+"""
+
+print(instructions)
+
+# --- SET ENVIRONMENT ---
+# Get environment variables
+load_dotenv()
+main_path = Path.cwd()
+
+rules_path = os.getenv("RULES_PATH") or default_rules_path
+rules = rules_loader(rules_path)
+
+# Folder of the pack: the one used by the other programs, or regions/<main city> in the working directory
+region_path = os.getenv("REGION_PATH") or (
+    main_path / "regions" / rules.main_city["name"].lower().replace(" ", "_")
+)
+
+# Local files of the region (missing files are left out of the pack)
+streets_path = os.getenv("STREETS_PATH") or main_path / "data/streets/calles.geojson"
+if not os.path.isfile(streets_path):
+    streets_path = None
+
+boundaries = {}
+for column, (path_var, field_var, default) in layers.items():
+    path = os.getenv(path_var) or main_path / default
+    if os.path.isfile(path):
+        boundaries[column] = (path, os.getenv(field_var) or "nombre")
+
+files = region_builder(
+    region_path, rules_path, streets_path, os.getenv("STREETS_FIELD") or "nombre", boundaries
+)
+
+print(f"Paquete de región guardado en {region_path}: {', '.join(files)}.")
@@ -0,0 +1,67 @@
+import os
+import socket
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from fun.review import geo_checker
+from fun.reviewboard import ReviewBoard
+
+# --- Instrucciones para uso del programa ---
+instructions = """
+Revisor de la revisión compartida de geocodificación.
+Toma partes de las revisiones abiertas en el tablero compartido (REVIEW_BOARD_PATH en el archivo '.env'),
+muestra cada una en su propio mapa y guarda las direcciones marcadas como erróneas, hasta que no queden partes.
+Las revisiones se abren desde avp-geocode, con la misma variable REVIEW_BOARD_PATH.
+"""
+
+print(instructions)
+
+# --- SET ENVIRONMENT ---
+# Get environment variables
+load_dotenv()
+
+review_board_path = os.getenv("REVIEW_BOARD_PATH")
+if not review_board_path:
+    print("Error: Falta la variable REVIEW_BOARD_PATH con la ruta del tablero compartido.")
+    sys.exit(1)
+
+reviewer_name = os.getenv("REVIEWER_NAME") or socket.gethostname()
+
+map_path = Path.cwd() / "graphs"
+if not os.path.isdir(map_path):
+    os.makedirs(map_path)
+
+board = ReviewBoard(review_board_path)
+
+
+# --- Review partitions until the board is empty ---
+n_done = 0
+while True:
+    taken = board.partition_getter(reviewer_name)
+    if taken is None:
+        break
+
+    session, part, df_part = taken
+    print(f"Revisión '{session}', parte {part}: {len(df_part)} direcciones.")
+
+    try:
+        list_wrong = geo_checker(
+            df=df_part,
+            list_right=df_part["id"].tolist(),
+            list_wrong=[],
+            output_file=map_path / f"map_geo_{session.replace(' ', '_')}_{part}.html",
+        )
+    except BaseException:
+        # The partition goes back to the board for another reviewer
+        board.partition_releaser(session, part)
+        board.close()
+        raise
+
+    if not board.decisions_submitter(session, part, reviewer_name, list_wrong):
+        print("Esta parte ya había sido revisada por otra persona: se conservan sus decisiones.")
+    n_done += 1
+
+board.close()
+print(f"No quedan partes para revisar ({n_done} revisadas).")
+input("Presione enter para salir.")
@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+import pandas as pd
+from arcgis.gis import GIS
+from dotenv import load_dotenv
+from fun.corrections import CorrectionStore
+from fun.enrich import boundaries_getter
+from fun.formatqueries import rules_loader
+from fun.geocache import GeocodeCache
+from fun.hotspots import HotspotStore
+from fun.pipeline import geocode_dataframe, settings_getter
+from fun.quota import QuotaExhausted, QuotaTracker
+from fun.regionpack import region_getter
+from fun.streets import streets_getter
+from opencage.geocoder import OpenCageGeocode
+
+# --- Instrucciones para uso del programa ---
+instructions = """
+Servicio local de geocodificación.
+Mantiene abiertas las sesiones de los servicios, las reglas de formato y los resultados ya obtenidos,
+y geocodifica lotes de direcciones enviados por otras herramientas (POST /geocode con JSON).
+Los resultados que no cumplen la política de aceptación se devuelven con 'revisar' en verdadero.
+"""
+
+print(instructions)
+
+# --- SET ENVIRONMENT ---
+# Get environment variables
+load_dotenv()
+oc_apikey = os.getenv("OC_APIKEY")
+esri_apikey = os.getenv("ESRI_APIKEY")
+esri_user = os.getenv("ESRI_USER")
+esri_pass = os.getenv("ESRI_PASS")
+
+# Address of the service (local only by default)
+service_host = os.getenv("SERVICE_HOST") or "127.0.0.1"
+service_port = int(os.getenv("SERVICE_PORT") or 8765)
+
+settings = settings_getter()
+
+# Grid cell size in degrees and distinct queries in a cell to flag it as a fallback hotspot
+hotspot_cell = float(os.getenv("HOTSPOT_CELL") or 0.0003)
+hotspot_min_queries = int(os.getenv("HOTSPOT_MIN_QUERIES") or 5)
+
+# Region pack (rules, streets and boundaries precompiled for a region), if one is set
+region = region_getter()
+
+# Rules to format the queries, compiled once for every request
+rules = region.rules if region else rules_loader()
+
+# Avoid Pandas's warnings
+pd.options.mode.chained_assignment = None
+
+main_path = Path.cwd()
+cache_path = main_path / "cache"
+log_path = main_path / "logs"
+if not os.path.isdir(cache_path):
+    os.makedirs(cache_path)
+if not os.path.isdir(log_path):
+    os.makedirs(log_path)
+
+# Set up configuration for logging to a file and to the console
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(message)s", "%Y-%m-%d")
+
+file_handler = logging.FileHandler(log_path / "service.log")
+file_handler.setLevel(logging.DEBUG)
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+
+# Stores kept open (and warm) between requests
+cache = GeocodeCache(cache_path / "geocodes.sqlite", rules.version, settings["cache_miss_days"])
+quota = QuotaTracker(cache_path / "quota.json", settings["quota_limits"])
+
+corrections = CorrectionStore(cache_path / "corrections.sqlite", rules.version)
+corrections.results_learner(main_path / "results", cache)
+
+hotspots = HotspotStore(
+    cache_path / "hotspots.sqlite", cell_size=hotspot_cell, min_queries=hotspot_min_queries
+)
+hotspots.results_learner(main_path / "results")
+
+# Neighbourhood and district layers, with their spatial index built once
+boundaries = region.boundaries if region else boundaries_getter(main_path)
+
+# Street centerlines, with their KD-trees built once
+streets = region.streets if region else streets_getter(main_path)
+
+# Set geocoder object using the corresponding apikey
+try:
+    geocoder = OpenCageGeocode(oc_apikey)
+except Exception as e:
+    logger.error(e, exc_info=True)
+    raise
+
+# Set gis object using the corresponding user, password, apikey
+try:
+    gis = GIS(username=esri_user, password=esri_pass, api_key=esri_apikey)
+except Exception as e:
+    logger.error(e, exc_info=True)
+    raise
+
+# Columns returned for each address
+output_columns = [
+    "id",
+    "direccion_orig",
+    "direccion_avp",
+    "ciudad",
+    "tipo_direccion",
+    "lat",
+    "lon",
+    "provider",
+    "score",
+    "match_type",
+    "bbox_size",
+    "provider_distance",
+    "direccion_reformulada",
+    "revisar",
+]
+
+
+def request_geocoder(body):
+    """
+    This function geocodes the addresses of a request.
+
+    :body: Dictionary with an 'addresses' list and an optional 'ids' list of the same length.
+
+    :return: List of dictionaries with the output columns of each address, in the same order.
+    """
+    addresses = body["addresses"]
+    ids = body.get("ids") or list(range(1, len(addresses) + 1))
+    if len(ids) != len(addresses):
+        raise ValueError("'ids' and 'addresses' must have the same length")
+
+    df = pd.DataFrame({"id": ids, "direccion_avp": pd.Series(addresses, dtype=object)})
+
+    # Results of the service are not reviewed, so they are checked against the hotspots learned
+    # from the reviewed runs but not recorded in them
+    df = geocode_dataframe(
+        df,
+        rules,
+        geocoder,
+        cache,
+        logger,
+        settings,
+        corrections,
+        hotspots,
+        quota,
+        boundaries,
+        streets,
+        learn_hotspots=False,
+    )
+
+    return json.loads(
+        df[output_columns + list(boundaries)].to_json(orient="records", force_ascii=False)
+    )
+
+
+class GeocodeHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the requests to the service:
+        - GET /health: state of the service.
+        - POST /geocode: geocode a batch of addresses ({"addresses": [...], "ids": [...]}).
+    """
+
+    def response_sender(self, status, content):
+        data = json.dumps(content, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.response_sender(404, {"error": "not found"})
+            return
+
+        self.response_sender(
+            200,
+            {
+                "status": "ok",
+                "rules_version": rules.version,
+                "cached_queries": len(cache.memory),
+                "remaining": {
+                    provider: None if quota.remaining(provider) == float("inf")
+                    else quota.remaining(provider)
+                    for provider in ["opencage", "esri"]
+                },
+            },
+        )
+
+    def do_POST(self):
+        if self.path != "/geocode":
+            self.response_sender(404, {"error": "not found"})
+            return
+
+        start = time.perf_counter()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            results = request_geocoder(body)
+        except (KeyError, TypeError, ValueError) as e:
+            self.response_sender(400, {"error": f"invalid request: {e}"})
+            return
+        except QuotaExhausted as e:
+            logger.info(f"Request stopped: {e}")
+            self.response_sender(429, {"error": str(e)})
+            return
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            self.response_sender(500, {"error": str(e)})
+            return
+
+        seconds = time.perf_counter() - start
+        logger.info(f"{len(results)} addresses geocoded in {seconds:.3f} s")
+        self.response_sender(200, {"results": results, "seconds": seconds})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+# --- Serve requests until the process is stopped ---
+# Requests are served one at a time, since the stores are shared by all of them
+server = HTTPServer((service_host, service_port), GeocodeHandler)
+print(f"Servicio disponible en http://{service_host}:{service_port} (Ctrl+C para detener).")
+
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+    cache.close()
+    corrections.close()
+    hotspots.close()
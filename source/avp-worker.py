@@ -0,0 +1,158 @@
+import logging
+import os
+import socket
+import sys
+from pathlib import Path
+
+from arcgis.gis import GIS
+from dotenv import load_dotenv
+from fun.formatqueries import rules_loader
+from fun.geocache import GeocodeCache
+from fun.geocoders import esri_geocoder, oc_geocoder, query_geocoder
+from fun.pipeline import settings_getter
+from fun.quota import QuotaExhausted, QuotaTracker
+from fun.regionpack import region_getter
+from fun.workqueue import WorkQueue
+from opencage.geocoder import OpenCageGeocode
+
+# --- Instrucciones para uso del programa ---
+instructions = """
+Trabajador de la cola compartida de geocodificación.
+Toma lotes de consultas de la cola (QUEUE_PATH en el archivo '.env'), las geocodifica con las
+credenciales propias de este equipo y guarda los resultados en la cola, hasta que no queden consultas.
+Las consultas se agregan a la cola desde avp-geocode, con la misma variable QUEUE_PATH.
+"""
+
+print(instructions)
+
+# --- SET ENVIRONMENT ---
+# Get environment variables
+load_dotenv()
+oc_apikey = os.getenv("OC_APIKEY")
+esri_apikey = os.getenv("ESRI_APIKEY")
+esri_user = os.getenv("ESRI_USER")
+esri_pass = os.getenv("ESRI_PASS")
+
+queue_path = os.getenv("QUEUE_PATH")
+if not queue_path:
+    print("Error: Falta la variable QUEUE_PATH con la ruta de la cola compartida.")
+    sys.exit(1)
+
+# Name of this worker, services it can call and jobs taken in each lease
+worker = os.getenv("WORKER_NAME") or socket.gethostname()
+worker_providers = (os.getenv("WORKER_PROVIDERS") or "opencage,esri").split(",")
+lease_size = int(os.getenv("QUEUE_LEASE_SIZE") or 50)
+lease_seconds = int(os.getenv("QUEUE_LEASE_SECONDS") or 900)
+max_attempts = int(os.getenv("QUEUE_MAX_ATTEMPTS") or 3)
+
+# Settings shared with avp-geocode (limits of the services and expiry of the cached misses)
+settings = settings_getter()
+
+# Rules used to format the queries, their version must match the one of the queue
+region = region_getter()
+rules = region.rules if region else rules_loader()
+
+# Local cache and count of calls of this worker
+cache_path = Path.cwd() / "cache"
+log_path = Path.cwd() / "logs"
+if not os.path.isdir(cache_path):
+    os.makedirs(cache_path)
+if not os.path.isdir(log_path):
+    os.makedirs(log_path)
+
+# Set up configuration for logging to a file and to the console
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(message)s", "%Y-%m-%d")
+
+file_handler = logging.FileHandler(log_path / "worker.log")
+file_handler.setLevel(logging.DEBUG)
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+
+cache = GeocodeCache(cache_path / "geocodes.sqlite", rules.version, settings["cache_miss_days"])
+quota = QuotaTracker(cache_path / "quota.json", settings["quota_limits"])
+queue = WorkQueue(queue_path, rules.version, lease_seconds, max_attempts)
+
+# Set geocoder object using the corresponding apikey
+try:
+    geocoder = OpenCageGeocode(oc_apikey)
+except Exception as e:
+    logger.error(e, exc_info=True)
+    raise
+
+# Set gis object using the corresponding user, password, apikey
+if "esri" in worker_providers:
+    try:
+        gis = GIS(username=esri_user, password=esri_pass, api_key=esri_apikey)
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        raise
+
+
+def job_geocoder(provider, query, address):
+    """
+    This function geocodes a job of the queue through the local cache, restricted to the
+    bounding box and close to the center of the city of the query.
+
+    :provider: Name of the geocoding service.
+    :query: Formatted query.
+    :address: Structured address for ESRI or None to send the query as text.
+
+    :return: Result dictionary (empty if the query can not be geocoded) or None if the
+    service failed and the job must be retried.
+    """
+    hints = rules.city_hints(rules.query_city(query))
+
+    def function(x):
+        if provider == "opencage":
+            return oc_geocoder(geocoder, x, **hints)
+        return esri_geocoder(address or x, **hints)
+
+    result = query_geocoder(query, provider, function, cache, logger, quota)
+
+    # Errors of the service (not 'address not found') are not cached: retry the job later
+    if cache.get(provider, query) is None:
+        return None
+    return result
+
+
+# --- Take leases until the queue is empty ---
+n_done = 0
+while worker_providers:
+    lease, jobs = queue.lease_getter(worker, worker_providers, lease_size)
+    if not jobs:
+        break
+
+    results = []
+    exhausted = False
+    try:
+        for provider, query, address in jobs:
+            result = job_geocoder(provider, query, address)
+            if result is None:
+                continue
+            results.append((provider, query, result))
+
+            # As in avp-geocode, queries that OpenCage can not geocode are sent to ESRI
+            if provider == "opencage" and result.get("lat") is None:
+                queue.jobs_adder("esri", [query], {query: address} if address else None)
+    except QuotaExhausted as e:
+        logger.info(f"Worker {worker} stops using {provider}: {e}")
+        print(f"Cuota de {provider} agotada en este equipo.")
+        worker_providers.remove(provider)
+        exhausted = True
+
+    n_done += queue.results_submitter(worker, results)
+
+    # Return the rest of the lease to the queue, for the workers with quota left
+    if exhausted:
+        queue.lease_releaser(lease)
+    print(f"{n_done} consultas geocodificadas por {worker}.")
+
+logger.info(f"Worker {worker} finished: {n_done} queries, progress {queue.progress()}")
+print("No quedan consultas para este equipo.")
+
+queue.close()
+cache.close()
@@ -0,0 +1,117 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+def cells_labeler(lat, lon, cell_size):
+    """
+    This function labels each point with the square cell of a regular grid where it falls.
+
+    :lat: Series of Latitudes.
+    :lon: Series of Longitudes.
+    :cell_size: Side of the cells in degrees.
+
+    :return: Series with the center of the cell as 'lat,lon' text, null for points without
+    coordinates.
+    """
+    lat = pd.to_numeric(lat, errors="coerce")
+    lon = pd.to_numeric(lon, errors="coerce")
+    mask = lat.notnull() & lon.notnull()
+
+    center_lat = (np.floor(lat[mask] / cell_size) + 0.5) * cell_size
+    center_lon = (np.floor(lon[mask] / cell_size) + 0.5) * cell_size
+
+    labels = pd.Series(None, index=lat.index, dtype=object)
+    labels[mask] = [f"{y:.5f},{x:.5f}" for y, x in zip(center_lat, center_lon)]
+
+    return labels
+
+
+class AggregateStore:
+    """
+    Counts of observations by month, area and attribute, kept up to date with every run, so
+    that dashboards read the totals instead of computing them from the results of every month.
+    Areas are grouped in levels (e.g. 'barrio', 'distrito', 'celda', and 'total' for the whole
+    month), and each count is the total of an area (attribute and value empty) or the count of one
+    value of an attribute (e.g. genero = f). Observations without area are counted with area empty.
+    The store is a SQLite database.
+    """
+
+    def __init__(self, path):
+        """
+        :path: Path of the SQLite database file (created if it does not exist).
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS counts
+                (period TEXT, level TEXT, area TEXT, attribute TEXT, value TEXT, n INTEGER,
+                PRIMARY KEY (level, attribute, area, value, period));
+            CREATE INDEX IF NOT EXISTS counts_period ON counts (period);
+            """
+        )
+
+    def month_updater(self, df, period, levels, attributes):
+        """
+        This function replaces the counts of a month with the ones of its results. The counts of
+        the other months are not touched.
+
+        :df: Dataframe with the results of the month.
+        :period: Month of the results ('aaaa-mm').
+        :levels: List of columns of df with the area of each observation.
+        :attributes: List of categorical columns of df to count by value.
+
+        :return: Number of counts stored.
+        """
+        df = df.assign(total="")
+        rows = []
+        for level in ["total"] + [x for x in levels if x in df.columns]:
+            areas = df[level].astype(object).where(df[level].notnull(), "").astype(str)
+
+            for area, n in areas.value_counts(sort=False).items():
+                rows.append((period, level, area, "", "", int(n)))
+
+            for attribute in [x for x in attributes if x in df.columns]:
+                values = df[attribute].astype(object).where(df[attribute].notnull(), "")
+                counts = pd.DataFrame({"area": areas, "value": values.astype(str)}).value_counts(
+                    sort=False
+                )
+                for (area, value), n in counts.items():
+                    rows.append((period, level, area, attribute, value, int(n)))
+
+        with self.conn:
+            self.conn.execute("DELETE FROM counts WHERE period = ?", (period,))
+            self.conn.executemany(
+                "INSERT INTO counts (period, level, area, attribute, value, n) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+        return len(rows)
+
+    def totals_getter(self, level, attribute="", start=None, end=None):
+        """
+        This function reads the counts of the areas of a level by month.
+
+        :level: Level of the areas ('total', 'barrio', 'distrito', 'celda'...).
+        :attribute: Attribute to count by value (empty for the total of each area).
+        :start: Optional first month of the period ('aaaa-mm').
+        :end: Optional last month of the period ('aaaa-mm').
+
+        :return: Dataframe with period, area, value and n columns.
+        """
+        query = "SELECT period, area, value, n FROM counts WHERE level = ? AND attribute = ?"
+        params = [level, attribute]
+        if start is not None:
+            query += " AND period >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND period <= ?"
+            params.append(end)
+
+        return pd.read_sql_query(query + " ORDER BY period, area, value", self.conn, params=params)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,242 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Numeric columns of the results, stored as numbers even if a month has text in them
+numeric_columns = [
+    "lat",
+    "lon",
+    "score",
+    "bbox_size",
+    "provider_distance",
+    "altura",
+    "distancia_calle",
+    "distancia_calle_nombre",
+]
+
+# Date columns of the results, stored as timestamps even if a month has them as text
+date_columns = ["fecha_ingreso"]
+
+# Rows of each row group of the Parquet files (each one with its own column statistics)
+row_group_size = 10000
+
+
+def spatial_key(lat, lon):
+    """
+    This function computes a Z-order key of the coordinates (bits of the quantized longitude and
+    latitude interleaved), so that rows sorted by the key are close in space and the statistics
+    of each row group cover a small box.
+
+    :lat: Series of Latitudes.
+    :lon: Series of Longitudes.
+
+    :return: Series of keys (null for missing coordinates).
+    """
+    mask = lat.notnull() & lon.notnull()
+    x = ((lon[mask].astype(float) + 180) / 360 * 65535).round().astype(np.uint32).to_numpy()
+    y = ((lat[mask].astype(float) + 90) / 180 * 65535).round().astype(np.uint32).to_numpy()
+
+    def spread(v):
+        v = (v | (v << 8)) & 0x00FF00FF
+        v = (v | (v << 4)) & 0x0F0F0F0F
+        v = (v | (v << 2)) & 0x33333333
+        v = (v | (v << 1)) & 0x55555555
+        return v
+
+    key = pd.Series(pd.NA, index=lat.index, dtype="UInt32")
+    key[mask] = spread(x) | (spread(y) << 1)
+
+    return key
+
+
+def types_normalizer(df):
+    """
+    This function sets the same types for the columns of the results of every month: numbers
+    for the numeric columns and the IDs, timestamps for the dates, text for the rest (other numbers
+    and dates are kept as they are). Months with unchanged rows of a previous run have every column
+    as object, so the types of their values are inferred again first.
+
+    :df: Dataframe with the results of a month.
+
+    :return: Copy of the dataframe with normalized types.
+    """
+    df = df.infer_objects()
+
+    for column in df.columns:
+        if column in numeric_columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+        elif column in date_columns:
+            df[column] = pd.to_datetime(df[column], errors="coerce").astype("datetime64[ns]")
+        elif not (
+            pd.api.types.is_numeric_dtype(df[column])
+            or pd.api.types.is_datetime64_any_dtype(df[column])
+        ):
+            df[column] = df[column].astype("string")
+    df["id"] = pd.to_numeric(df["id"]).astype("Int64")
+
+    return df
+
+
+def archive_writer(df, path, year, month, version):
+    """
+    This function writes (or replaces) the results of a month in the archive, a Parquet dataset
+    partitioned by year and month ('<path>/year=<aaaa>/month=<m>/'). Rows are sorted by spatial key.
+
+    :df: Dataframe with the results of the month.
+    :path: Folder of the archive.
+    :year: Year of the results.
+    :month: Month of the results.
+    :version: Version of the rules used to build the queries (see RulePack).
+    """
+    df = types_normalizer(df)
+
+    df["clave_espacial"] = spatial_key(df["lat"], df["lon"])
+    df["version"] = version
+    df["year"] = int(year)
+    df["month"] = int(month)
+    df = df.sort_values("clave_espacial", na_position="last")
+
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        path,
+        format="parquet",
+        partitioning=ds.partitioning(
+            pa.schema([("year", pa.int32()), ("month", pa.int32())]), flavor="hive"
+        ),
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+        max_rows_per_group=row_group_size,
+        min_rows_per_group=min(row_group_size, len(df.index)),
+    )
+
+
+def schema_merger(schemas):
+    """
+    This function merges the schemas of the files of the archive. When a column has different
+    types in different months (e.g. dates saved as text by months with unchanged rows, before
+    types_normalizer inferred them), the first type that is not text is kept, and the values of
+    the other months are converted to it when read.
+
+    :schemas: List of pyarrow schemas.
+
+    :return: pyarrow schema with every column.
+    """
+    def rank(data_type):
+        if pa.types.is_null(data_type):
+            return 0
+        if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+            return 1
+        return 2
+
+    fields = {}
+    for schema in schemas:
+        for field in schema:
+            if field.name not in fields or rank(field.type) > rank(fields[field.name].type):
+                fields[field.name] = field
+
+    return pa.schema(list(fields.values()))
+
+
+def archive_dataset(path):
+    """
+    This function opens the archive with the columns of every month.
+
+    :path: Folder of the archive.
+
+    :return: pyarrow Dataset or None if the archive does not exist.
+    """
+    if not os.path.isdir(path):
+        return None
+
+    partitioning = ds.partitioning(
+        pa.schema([("year", pa.int32()), ("month", pa.int32())]), flavor="hive"
+    )
+    dataset = ds.dataset(path, format="parquet", partitioning=partitioning)
+    schemas = [dataset.schema] + [x.physical_schema for x in dataset.get_fragments()]
+    try:
+        schema = pa.unify_schemas(schemas)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        schema = schema_merger(schemas)
+
+    return ds.dataset(path, schema=schema, format="parquet", partitioning=partitioning)
+
+
+def archive_reader(path, start=None, end=None, bbox=None, columns=None):
+    """
+    This function reads the results of the archive in a period and a box. The filters are applied
+    to the partitions (only the months of the period are opened) and to the column statistics
+    of each row group (only the groups that can have points in the box are read).
+
+    :path: Folder of the archive.
+    :start: Optional first month of the period, as (year, month).
+    :end: Optional last month of the period, as (year, month).
+    :bbox: Optional box (min lon, min lat, max lon, max lat).
+    :columns: Optional list of columns to read.
+
+    :return: Dataframe with the results.
+    """
+    dataset = archive_dataset(path)
+    if dataset is None:
+        return pd.DataFrame(columns=columns)
+
+    period = ds.field("year") * 100 + ds.field("month")
+    expression = None
+    conditions = []
+    if start is not None:
+        conditions.append(period >= start[0] * 100 + start[1])
+    if end is not None:
+        conditions.append(period <= end[0] * 100 + end[1])
+    if bbox is not None:
+        conditions += [
+            ds.field("lon") >= bbox[0],
+            ds.field("lat") >= bbox[1],
+            ds.field("lon") <= bbox[2],
+            ds.field("lat") <= bbox[3],
+        ]
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def cache_warmer(path, cache, queries):
+    """
+    This function fills the cache with the results of the archive for the queries of a run
+    (only results obtained with the same rules version and not reformulated), so that
+    addresses already geocoded in other months are not sent again to the services.
+
+    :path: Folder of the archive.
+    :cache: GeocodeCache object.
+    :queries: List of formatted queries of the run.
+
+    :return: Number of results added to the cache.
+    """
+    dataset = archive_dataset(path)
+    if dataset is None or "direccion_avp" not in dataset.schema.names:
+        return 0
+
+    columns = ["direccion_avp", "provider", "lat", "lon", "score", "match_type", "bbox_size"]
+    expression = (
+        ds.field("direccion_avp").isin(list(set(queries)))
+        & (ds.field("version") == cache.version)
+        & ds.field("provider").isin(["osm", "opencage", "esri"])
+        & ds.field("lat").is_valid()
+    )
+    if "direccion_reformulada" in dataset.schema.names:
+        expression &= ~ds.field("direccion_reformulada").is_valid()
+
+    df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+    df = df.drop_duplicates(subset=["provider", "direccion_avp"], keep="last")
+
+    rows = [
+        (provider, query, {k: (None if pd.isnull(v) else v) for k, v in result.items()})
+        for provider, query, result in zip(
+            df["provider"],
+            df["direccion_avp"],
+            df[["lat", "lon", "score", "match_type", "bbox_size"]].to_dict("records"),
+        )
+    ]
+    return cache.missing_adder(rows)
@@ -0,0 +1,228 @@
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def query_normalizer(s):
+    """
+    This function normalizes address queries so that trivial differences (case, accents,
+    punctuation, spaces) do not prevent two equal addresses from matching.
+
+    :s: Series of address queries.
+
+    :return: Series of normalized queries.
+    """
+    return (
+        s.astype(str)
+        .str.lower()
+        .str.normalize("NFKD")
+        .str.encode("ascii", errors="ignore")
+        .str.decode("ascii")
+        .str.replace(r"[^\w\s/]", " ", regex=True)
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def edited_checker(df, lat, lon, cache, tolerance=1e-6):
+    """
+    This function finds the results of a geocoding service whose coordinates were edited by hand,
+    comparing them with the result of the service in the cache.
+
+    :df: Dataframe of a results file, with direccion_avp and provider columns (and
+    direccion_reformulada for the results of reformulated queries).
+    :lat: Series of latitudes of the file.
+    :lon: Series of longitudes of the file.
+    :cache: GeocodeCache object.
+    :tolerance: Maximum difference in degrees to consider the coordinates unchanged.
+
+    :return: Boolean Series, True for rows whose coordinates differ from the cached result (rows
+    without a cached result are False).
+    """
+    queries = df["direccion_avp"]
+    if "direccion_reformulada" in df.columns:
+        queries = df["direccion_reformulada"].where(df["direccion_reformulada"].notnull(), queries)
+
+    mask = pd.Series(False, index=df.index)
+    for i in df.index[df["provider"].notnull() & queries.notnull()]:
+        result = cache.get(df.at[i, "provider"], queries[i]) or {}
+        if result.get("lat") is None or result.get("lon") is None:
+            continue
+        mask[i] = (
+            abs(result["lat"] - lat[i]) > tolerance or abs(result["lon"] - lon[i]) > tolerance
+        )
+
+    return mask
+
+
+class CorrectionStore:
+    """
+    Persistent memory of the manual reviews: coordinates filled by hand in previous results
+    and geocoding services whose result was rejected by the reviewer, keyed by normalized query.
+    Rejections are kept for the version of the rules they were made with: with other rules the
+    query sent to the service changes, and so may its result.
+    The whole store is loaded into dictionaries when opened, so lookups do not touch the database.
+    """
+
+    def __init__(self, path, version=""):
+        """
+        :path: Path of the SQLite database file (created if it does not exist).
+        :version: Version of the rules used to build the queries (see RulePack).
+        """
+        self.version = version
+        self.conn = sqlite3.connect(path)
+
+        # Rejections stored before they were versioned are kept aside
+        columns = [x[1] for x in self.conn.execute("PRAGMA table_info(rejections)")]
+        if columns and "version" not in columns:
+            self.conn.execute("ALTER TABLE rejections RENAME TO rejections_unversioned")
+
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS corrections
+                (query TEXT PRIMARY KEY, lat REAL, lon REAL, source TEXT);
+            CREATE TABLE IF NOT EXISTS rejections
+                (query TEXT, provider TEXT, version TEXT, PRIMARY KEY (query, provider, version));
+            CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, mtime REAL);
+            """
+        )
+        self.conn.commit()
+
+        self.corrections = {
+            query: (lat, lon)
+            for query, lat, lon in self.conn.execute(
+                "SELECT query, lat, lon FROM corrections"
+            )
+        }
+        self.rejections = set(
+            self.conn.execute(
+                "SELECT query, provider FROM rejections WHERE version = ?", (version,)
+            )
+        )
+
+    def corrections_adder(self, queries, lats, lons, source):
+        """
+        This function stores manually corrected coordinates.
+
+        :queries: Normalized queries.
+        :lats: Latitudes filled by the reviewer.
+        :lons: Longitudes filled by the reviewer.
+        :source: Name of the file the corrections come from.
+        """
+        rows = [
+            (query, float(lat), float(lon), source)
+            for query, lat, lon in zip(queries, lats, lons)
+        ]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO corrections (query, lat, lon, source) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        self.conn.commit()
+
+        for query, lat, lon, _ in rows:
+            self.corrections[query] = (lat, lon)
+
+    def rejections_adder(self, queries, provider):
+        """
+        This function stores the queries whose result from a service was rejected by the reviewer.
+
+        :queries: Normalized queries.
+        :provider: Name of the geocoding service.
+        """
+        rows = [(query, provider) for query in set(queries)]
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO rejections (query, provider, version) VALUES (?, ?, ?)",
+            [(query, provider, self.version) for query, provider in rows],
+        )
+        self.conn.commit()
+
+        self.rejections.update(rows)
+
+    def rejected(self, queries, provider):
+        """
+        This function checks which queries were rejected in the past for a service, with the
+        current version of the rules.
+
+        :queries: Series of normalized queries.
+        :provider: Name of the geocoding service.
+
+        :return: Boolean Series, True for rejected queries.
+        """
+        return queries.map(lambda q: (q, provider) in self.rejections).astype(bool)
+
+    def corrections_getter(self, queries):
+        """
+        This function looks for manually corrected coordinates.
+
+        :queries: Series of normalized queries.
+
+        :return: Dataframe with lat and lon columns (null when there is no correction).
+        """
+        coords = [self.corrections.get(query, (np.nan, np.nan)) for query in queries]
+        return pd.DataFrame(
+            coords, index=queries.index, columns=["lat", "lon"], dtype="float64"
+        )
+
+    def results_learner(self, results_path, cache=None):
+        """
+        This function reads previous result files and learns the coordinates filled by hand,
+        identified as rows with Latitude and Longitude but without a geocoding service, with
+        a geocoding service but other coordinates than its cached result, or filled with a
+        correction ('manual') but other coordinates than the stored one (edited by the reviewer).
+        Files already read are skipped unless they changed since then.
+
+        :results_path: Folder with the results of every year ('results/<year>/*.xlsx').
+        :cache: Optional GeocodeCache object, to find the results edited by hand.
+
+        :return: Number of corrections learned.
+        """
+        sources = dict(self.conn.execute("SELECT path, mtime FROM sources"))
+        n_learned = 0
+
+        for file in sorted(Path(results_path).glob("*/*.xlsx")):
+            mtime = os.path.getmtime(file)
+            if sources.get(str(file)) == mtime:
+                continue
+
+            df = pd.read_excel(file)
+            if {"direccion_orig", "lat", "lon", "provider"}.issubset(df.columns):
+                lat = pd.to_numeric(df["lat"], errors="coerce")
+                lon = pd.to_numeric(df["lon"], errors="coerce")
+                mask_edited = pd.Series(False, index=df.index)
+                if cache is not None and "direccion_avp" in df.columns:
+                    mask_edited = edited_checker(df, lat, lon, cache)
+
+                # Corrections edited again
+                df_stored = self.corrections_getter(query_normalizer(df["direccion_orig"]))
+                mask_edited |= (df["provider"] == "manual") & (
+                    ~((df_stored["lat"] - lat).abs() <= 1e-6)
+                    | ~((df_stored["lon"] - lon).abs() <= 1e-6)
+                )
+
+                mask = (
+                    (df["provider"].isnull() | mask_edited)
+                    & lat.notnull()
+                    & lon.notnull()
+                    & df["direccion_orig"].notnull()
+                )
+                self.corrections_adder(
+                    query_normalizer(df.loc[mask, "direccion_orig"]),
+                    lat[mask],
+                    lon[mask],
+                    file.name,
+                )
+                n_learned += mask.sum()
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (path, mtime) VALUES (?, ?)",
+                (str(file), mtime),
+            )
+            self.conn.commit()
+
+        return n_learned
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,88 @@
+import os
+
+import geopandas as gpd
+import pandas as pd
+
+# Boundary layers added to the results: column name, environment variables with the path and
+# the name field of the layer, and default path inside the working directory
+layers = {
+    "barrio": ("BARRIOS_PATH", "BARRIOS_FIELD", "data/boundaries/barrios.geojson"),
+    "distrito": ("DISTRITOS_PATH", "DISTRITOS_FIELD", "data/boundaries/distritos.geojson"),
+}
+
+
+def boundaries_loader(path, field):
+    """
+    This function reads a boundary file (GeoJSON, Shapefile, GeoPackage...) and builds its
+    spatial index, so that it can be joined with many points at once.
+
+    :path: Path of the boundary file.
+    :field: Column with the name of each polygon.
+
+    :return: GeoDataFrame with name and geometry columns in WGS84 (EPSG:4326).
+    """
+    gdf = gpd.read_file(path)
+    if gdf.crs is not None:
+        gdf = gdf.to_crs(epsg=4326)
+
+    gdf = gdf.loc[:, [field, "geometry"]].rename(columns={field: "name"})
+
+    # Build the spatial index now, once for every join
+    gdf.sindex
+
+    return gdf
+
+
+def boundaries_getter(main_path):
+    """
+    This function loads the boundary layers configured in the environment variables. Layers
+    whose file does not exist are skipped.
+
+    :main_path: Working directory, base of the default paths.
+
+    :return: Dictionary with the output column as key and the loaded layer as value.
+    """
+    boundaries = {}
+    for column, (path_var, field_var, default) in layers.items():
+        path = os.getenv(path_var) or main_path / default
+        if os.path.isfile(path):
+            boundaries[column] = boundaries_loader(path, os.getenv(field_var) or "nombre")
+
+    return boundaries
+
+
+def polygon_finder(lat, lon, boundaries):
+    """
+    This function finds the polygon where each point falls, with a vectorized spatial join over
+    the spatial index of the layer. Points on the border of two polygons get the first one.
+
+    :lat: Series of Latitudes.
+    :lon: Series of Longitudes.
+    :boundaries: GeoDataFrame returned by boundaries_loader.
+
+    :return: Series with the name of the polygon, null for points outside every polygon
+    or without coordinates.
+    """
+    mask = lat.notnull() & lon.notnull()
+
+    points = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(lon[mask].astype(float), lat[mask].astype(float)),
+        index=lat.index[mask],
+        crs="EPSG:4326",
+    )
+    joined = gpd.sjoin(points, boundaries, how="left", predicate="intersects")
+    joined = joined.loc[~joined.index.duplicated(keep="first"), "name"]
+
+    return joined.reindex(lat.index)
+
+
+def boundaries_joiner(df, boundaries):
+    """
+    This function adds in place a column for each boundary layer with the name of the polygon
+    where each geocoded observation falls.
+
+    :df: Working dataframe with lat and lon columns.
+    :boundaries: Dictionary returned by boundaries_getter.
+    """
+    for column, gdf in boundaries.items():
+        df[column] = pd.Categorical(polygon_finder(df["lat"], df["lon"], gdf))
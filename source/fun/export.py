@@ -0,0 +1,33 @@
+import os
+
+import geopandas as gpd
+
+from fun.archive import types_normalizer
+
+# GIS formats of the results: file extension and driver
+gis_formats = {"gpkg": "GPKG", "fgb": "FlatGeobuf"}
+
+
+def gis_writer(df, path, driver="GPKG"):
+    """
+    This function writes the results of a month as a point layer with a spatial index, so that
+    GIS tools open and filter it without building the points from the coordinate columns.
+    Rows without coordinates are kept with an empty geometry, except in FlatGeobuf (its spatial
+    index does not support them), where they are left out.
+
+    :df: Dataframe with the results of the month (lat and lon columns).
+    :path: Path of the output file (replaced if it exists).
+    :driver: OGR driver of the format ('GPKG' or 'FlatGeobuf').
+    """
+    df = types_normalizer(df)
+
+    mask = df["lat"].notnull() & df["lon"].notnull()
+    geometry = gpd.GeoSeries([None] * len(df.index), index=df.index, crs="EPSG:4326")
+    geometry[mask] = gpd.points_from_xy(df.loc[mask, "lon"], df.loc[mask, "lat"])
+
+    gdf = gpd.GeoDataFrame(df, geometry=geometry, crs="EPSG:4326")
+    if driver == "FlatGeobuf":
+        gdf = gdf.loc[mask, :]
+    if os.path.isfile(path):
+        os.remove(path)
+    gdf.to_file(path, driver=driver, layer=path.stem, SPATIAL_INDEX="YES")
@@ -1,122 +1,311 @@
-import pandas as pd
-import re
-
-def queries_formatter(df):
-    """
-    This function completes the addresses queries with information about city, prov, country
-
-    :df: Original dataframe with an address column.
-
-    :return: Dataframe with new information in the address column.
-    """
-    def city_filler(df, city, fill, ids_list):
-        """
-        This function completes the addresses queries with information about city, prov, country
-        of observations with any hint about that (except for observations located in Rosario)
-
-        :df: Original dataframe with an address column.
-        :city: Some kind of pattern or string referring to a city of Gran Rosario.
-        :fill: Desired name of the corresponding city.
-
-        :return: Dataframe with new information in the address column + IDs of corrected observations.
-        """
-        mask = df.apply(lambda r: bool(re.search(city, r["direccion_avp"])), axis=1)
-        df.loc[mask, "direccion_avp"] = (
-            df.loc[mask, "direccion_avp"]
-            .str.replace("-", "")
-            .str.replace(city, "")
-            .str.strip()
-        ) + f", {fill}, Santa Fe, Argentina"
-
-        ids_no_rosario = df.loc[mask, "id"].tolist()
-
-        ids_list = ids_list + ids_no_rosario
-
-        return df, ids_list
-
-    # Format queries, adding city of location as suffix and changing some streets names
-    dict_cities = {
-        "vgg": "Villa Gobernador Galvez",
-        "luis palacios": "Luis Palacios",
-        "casilda": "Casilda",
-        "funes": "Funes",
-        "roldan": "Roldan",
-        "soldini": "Soldini",
-    }
-
-    # Add city info for adresses not located in Rosario
-    ids_rosario_no = []
-    for k, v in dict_cities.items():
-        df, ids_rosario_no = city_filler(df, k, v, ids_rosario_no)
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace("ref ", "")
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace("/", " y ")
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"circun\w*\s?", "Avenida de Circunvalación 25 de Mayo ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(av\w*\s)?27 de feb\w*\s?", "Bulevar 27 de Febrero ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(bulevar\w*\s)?(bv)?(av\w*\s)?oroño\s?",
-        "Bulevar Nicasio Oroño ",
-        regex=True,
-        case=False,
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(bulevar\w*\s)?(bv)?(av\w*\s)?rond\w*\s?",
-        "Bulevar General José Rondeau ",
-        regex=True,
-        case=False,
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(av\w*\s)?uriburu\s?", "Avenida José Uriburu ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(av\w*\s)?san mart\w*\s?", "Avenida José de San Martín ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(ovidio\s)?lagos\s?", "Avenida Ovidio Lagos ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(av\w*\s)?pel(l)?egrini\s?", "Avenida Carlos Pellegrini ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(av\w*\s)?francia\s?", "Avenida Francia ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"(av\w*\s)?godoy\s?", "Avenida Presidente Perón ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"colectora\s?", "Colectora Juan Pablo II ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"a(0)?(o)?(\s)?12", "Ruta Nacional A012 ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"b(\w*)?\s*(y)?\s*ordoñez", "Avenida Battle y Ordoñez ", regex=True, case=False
-    )
-
-    df["direccion_avp"] = df["direccion_avp"].str.replace(
-        r"\s+", " ", regex=True, case=False
-    )
-
-    # Add city info for adresses located in Rosario
-    mask = ~df["id"].isin(ids_rosario_no)
-    df.loc[mask, "direccion_avp"] = (
-        df.loc[mask, "direccion_avp"].str.strip() + ", Rosario, Santa Fe, Argentina"
-    )
\ No newline at end of file
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Folder of the programs (the .exe unpacks its bundled files in sys._MEIPASS, see the README)
+bundle_path = Path(getattr(sys, "_MEIPASS", Path(__file__).resolve().parent.parent))
+
+# Rule pack used when no other is configured (RULES_PATH environment variable)
+default_rules_path = bundle_path / "rules" / "rosario.json"
+
+# Smallest number of queries formatted with several processes (below it, starting the
+# processes takes longer than formatting the queries in one)
+shard_min_rows = 50000
+
+# Rule pack of each formatting process (see shard_initializer)
+shard_rules = None
+
+
+class RulePack:
+    """
+    Compiled version of a rule file used to format the queries: cities to detect in the
+    addresses, cleaning replacements and street aliases, plus a table with the bounding box
+    and center of each city to guide the geocoding services.
+    Patterns are compiled once when the pack is created. The object can be pickled, so
+    it can be sent to worker processes.
+    """
+
+    def __init__(self, rules):
+        """
+        :rules: Dictionary read from a rule file (see 'rules/rosario.json').
+        """
+        self.rules = rules
+
+        # Cached results are keyed on the version plus a digest of the rules, so editing the
+        # rules without bumping the version does not serve results built with the old ones
+        digest = hashlib.sha1(json.dumps(rules, sort_keys=True).encode("utf-8")).hexdigest()
+        self.version = f"{rules['version']}-{digest[:12]}"
+        self.suffix = f", {rules['province']}, {rules['country']}"
+        self.country_code = rules["country_code"]
+
+        # Cities of the region: pattern to detect the city in the address, name to complete the
+        # query and maximum distance in meters between the results of two services to agree
+        self.main_city = rules["main_city"]
+        self.cities = [
+            (re.compile(re.escape(k)), v) for k, v in rules["cities"].items()
+        ]
+
+        self.cleaning = [(pattern, repl) for pattern, repl in rules["cleaning"]]
+        self.aliases = [
+            (re.compile(pattern, re.IGNORECASE), repl) for pattern, repl in rules["aliases"]
+        ]
+
+        # Generic coordinates returned by the services for addresses they can not locate
+        # (centroid of the main city)
+        self.fallback_points = [tuple(x) for x in rules.get("fallback_points", [])]
+
+        # Table of cities by name and pattern to find the city of a formatted query
+        self.city_table = {v["name"]: v for _, v in self.cities}
+        self.city_table[self.main_city["name"]] = self.main_city
+        self.query_city_pattern = re.compile(rf", ([^,]+){re.escape(self.suffix)}$")
+
+    def neighbours(self, city):
+        """
+        This function gets the neighbouring cities of a city of the pack.
+
+        :city: Name of the city.
+
+        :return: List of names of the neighbouring cities.
+        """
+        return self.city_table.get(city, {}).get("neighbours", [])
+
+    def query_city(self, query):
+        """
+        This function finds the city of a formatted query.
+
+        :query: Formatted query ('<address>, <city>, <province>, <country>').
+
+        :return: Name of the city or None if the query has no city suffix.
+        """
+        match = self.query_city_pattern.search(query) if isinstance(query, str) else None
+        return match.group(1) if match else None
+
+    def city_hints(self, city):
+        """
+        This function gets the spatial hints of a city for the geocoding services.
+
+        :city: Name of the city.
+
+        :return: Dictionary with bounds (min lon, min lat, max lon, max lat) and
+        proximity (lat, lon), None when the city has no hints.
+        """
+        v = self.city_table.get(city, {})
+        return {
+            "bounds": tuple(v["bounds"]) if v.get("bounds") else None,
+            "proximity": tuple(v["proximity"]) if v.get("proximity") else None,
+        }
+
+    def tolerances(self):
+        """
+        This function gets the agreement tolerance of every city of the pack.
+
+        :return: Dictionary with the name of the city as key and the tolerance in meters as value.
+        """
+        return {k: v["tolerance"] for k, v in self.city_table.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def rules_loader(path=None):
+    """
+    This function reads and compiles a rule file. Packs are cached, so each file is compiled once.
+
+    :path: Path of the rule file. If None, RULES_PATH environment variable or the default pack is used.
+
+    :return: RulePack object.
+    """
+    if path is None:
+        path = os.getenv("RULES_PATH") or default_rules_path
+
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+
+    return RulePack(rules)
+
+
+def shard_initializer(rules):
+    """
+    This function keeps the rule pack in a formatting process, so it is sent (and compiled) once
+    per process instead of once per shard.
+
+    :rules: RulePack object.
+    """
+    global shard_rules
+    shard_rules = rules
+
+
+def shard_formatter(name, start, stop):
+    """
+    This function formats a shard of the queries in a formatting process. The addresses are read
+    from the shared memory block written by the parent process (an Arrow stream), so they are not
+    copied through the pool.
+
+    :name: Name of the shared memory block.
+    :start: Position of the first address of the shard.
+    :stop: Position after the last address of the shard.
+
+    :return: Arrow table with the formatted queries (direccion_avp) and their city (ciudad).
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        addresses = (
+            pa.ipc.open_stream(pa.py_buffer(block.buf))
+            .read_all()
+            .column("direccion_avp")
+            .slice(start, stop - start)
+            .to_numpy()
+        )
+    finally:
+        # The addresses were copied to Python strings, so no buffer points to the block anymore
+        block.close()
+
+    df = queries_formatter(pd.DataFrame({"direccion_avp": addresses}), shard_rules)
+
+    return pa.table(
+        {
+            "direccion_avp": pa.array(df["direccion_avp"], type=pa.string()),
+            "ciudad": pa.array(df["ciudad"], type=pa.string()),
+        }
+    )
+
+
+def block_writer(table):
+    """
+    This function writes an Arrow table to a new shared memory block, as an Arrow stream.
+
+    :table: Arrow table.
+
+    :return: SharedMemory object (to be closed and unlinked by the caller).
+    """
+    # Size of the stream, to write it directly to the block
+    sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    block = shared_memory.SharedMemory(create=True, size=sink.size())
+
+    stream = pa.FixedSizeBufferWriter(pa.py_buffer(block.buf))
+    with pa.ipc.new_stream(stream, table.schema) as writer:
+        writer.write_table(table)
+    stream.close()
+
+    return block
+
+
+def shards_formatter(df, rules, workers):
+    """
+    This function formats the queries with a pool of processes, each one with a contiguous shard
+    of the addresses. The addresses are written once to shared memory as an Arrow stream, and the
+    results are joined back in the original order, the same as the ones of queries_formatter.
+
+    :df: Original dataframe with an address column.
+    :rules: RulePack object with the rules to apply.
+    :workers: Number of processes.
+
+    :return: Dataframe with new information in the address column and the city of each
+    observation in the 'ciudad' column.
+    """
+    block = block_writer(
+        pa.table({"direccion_avp": pa.array(df["direccion_avp"], type=pa.string())})
+    )
+
+    try:
+        # Forked processes where possible, so the main script is not run again in each one
+        context = multiprocessing.get_context(
+            "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        bounds = np.linspace(0, len(df.index), workers + 1).astype(int)
+        with ProcessPoolExecutor(
+            workers, mp_context=context, initializer=shard_initializer, initargs=(rules,)
+        ) as executor:
+            shards = list(
+                executor.map(shard_formatter, [block.name] * workers, bounds[:-1], bounds[1:])
+            )
+    finally:
+        block.close()
+        block.unlink()
+
+    results = pa.concat_tables(shards)
+    df["direccion_avp"] = results.column("direccion_avp").to_numpy()
+    df["ciudad"] = results.column("ciudad").to_numpy()
+
+    return df
+
+
+def queries_formatter(df, rules=None, workers=1):
+    """
+    This function completes the addresses queries with information about city, prov, country
+
+    :df: Original dataframe with an address column.
+    :rules: RulePack object with the rules to apply. If None, the default pack is used.
+    :workers: Number of processes to format large dataframes (see shards_formatter).
+
+    :return: Dataframe with new information in the address column and the city of each
+    observation in the 'ciudad' column.
+    """
+    if rules is None:
+        rules = rules_loader()
+
+    # Spawned processes run the main script again unless it is a frozen build
+    if "fork" not in multiprocessing.get_all_start_methods() and not getattr(sys, "frozen", False):
+        workers = 1
+
+    if workers > 1 and len(df.index) >= shard_min_rows:
+        return shards_formatter(df, rules, workers)
+
+    def city_filler(df, city, fill, mask_cities):
+        """
+        This function completes the addresses queries with information about city, prov, country
+        of observations with any hint about that (except for observations located in the main city)
+
+        :df: Original dataframe with an address column.
+        :city: Compiled pattern referring to a city of the region.
+        :fill: Desired name of the corresponding city.
+        :mask_cities: Boolean Series of observations already located in a city.
+
+        :return: Dataframe with new information in the address column + updated mask of
+        observations located in a city.
+        """
+        mask = df["direccion_avp"].str.contains(city)
+        df.loc[mask, "direccion_avp"] = (
+            df.loc[mask, "direccion_avp"]
+            .str.replace("-", "", regex=False)
+            .str.replace(city, "", regex=True)
+            .str.strip()
+        ) + f", {fill}{rules.suffix}"
+        df.loc[mask, "ciudad"] = fill
+
+        return df, mask_cities | mask
+
+    # Format queries, adding city of location as suffix and changing some streets names
+    # Add city info for adresses not located in the main city
+    mask_cities = pd.Series(False, index=df.index)
+    for city, v in rules.cities:
+        df, mask_cities = city_filler(df, city, v["name"], mask_cities)
+
+    for pattern, repl in rules.cleaning:
+        df["direccion_avp"] = df["direccion_avp"].str.replace(pattern, repl, regex=False)
+
+    for pattern, repl in rules.aliases:
+        df["direccion_avp"] = df["direccion_avp"].str.replace(pattern, repl, regex=True)
+
+    df["direccion_avp"] = df["direccion_avp"].str.replace(r"\s+", " ", regex=True)
+
+    # Add city info for adresses located in the main city
+    mask = ~mask_cities
+    df.loc[mask, "direccion_avp"] = (
+        df.loc[mask, "direccion_avp"].str.strip()
+        + f", {rules.main_city['name']}{rules.suffix}"
+    )
+    df.loc[mask, "ciudad"] = rules.main_city["name"]
+
+    return df
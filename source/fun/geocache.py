@@ -0,0 +1,146 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class GeocodeCache:
+    """
+    Persistent store of geocoding results, keyed by provider, rules version and query, so that
+    the same address is never paid twice to a geocoding service. Entries cached with another
+    version of the formatting rules are ignored.
+    Results are saved as JSON in a SQLite database. An empty result means that the provider
+    was asked and did not find the address. Empty results expire after some days, so that an
+    address that the provider could not find is asked again once the provider data changes.
+    The cache can be shared between threads (e.g. background geocoding during a review).
+    Results read or written are also kept in memory, so a long-running process (see avp-service)
+    answers repeated queries without touching the database.
+    """
+
+    def __init__(self, path, version="", miss_days=30):
+        """
+        :path: Path of the SQLite database file (created if it does not exist).
+        :version: Version of the rules used to build the queries (see RulePack).
+        :miss_days: Days after which an empty result is ignored (0 never keeps them).
+        """
+        self.path = path
+        self.version = version
+        self.miss_seconds = miss_days * 86400
+        self.lock = threading.Lock()
+        self.memory = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+        # Caches written before the rules were versioned have no version column: their table
+        # is kept aside, since its results were built with other rules
+        columns = [x[1] for x in self.conn.execute("PRAGMA table_info(geocodes)")]
+        if columns and "version" not in columns:
+            self.conn.execute("ALTER TABLE geocodes RENAME TO geocodes_unversioned")
+
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocodes (provider TEXT, version TEXT, query TEXT, "
+            "result TEXT, created REAL, PRIMARY KEY (provider, version, query))"
+        )
+
+        # Caches written before the misses expired have no creation time: their empty results
+        # are asked again, the rest are kept
+        columns = [x[1] for x in self.conn.execute("PRAGMA table_info(geocodes)")]
+        if "created" not in columns:
+            self.conn.execute("ALTER TABLE geocodes ADD COLUMN created REAL")
+        self.conn.commit()
+
+    def expired(self, result, created):
+        """
+        This function checks if a cached result has to be asked again.
+
+        :result: Dictionary with the result.
+        :created: Time (seconds since the epoch) when the result was stored, or None.
+
+        :return: True if the result is empty and older than the expiry of the misses.
+        """
+        if result:
+            return False
+
+        return created is None or time.time() - created >= self.miss_seconds
+
+    def get(self, provider, query):
+        """
+        This function looks for a cached result.
+
+        :provider: Name of the geocoding service.
+        :query: Address query.
+
+        :return: Dictionary with the result or None if the query is not cached (or is an
+        expired miss).
+        """
+        with self.lock:
+            if (provider, query) in self.memory:
+                result, created = self.memory[(provider, query)]
+            else:
+                row = self.conn.execute(
+                    "SELECT result, created FROM geocodes "
+                    "WHERE provider = ? AND version = ? AND query = ?",
+                    (provider, self.version, query),
+                ).fetchone()
+
+                if row is None:
+                    return None
+                result, created = json.loads(row[0]), row[1]
+                self.memory[(provider, query)] = (result, created)
+
+            return None if self.expired(result, created) else result
+
+    def set(self, provider, query, result):
+        """
+        This function stores (or replaces) the result of a query.
+
+        :provider: Name of the geocoding service.
+        :query: Address query.
+        :result: Dictionary with the result.
+        """
+        with self.lock:
+            created = time.time()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geocodes (provider, version, query, result, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (provider, self.version, query, json.dumps(result), created),
+            )
+            self.conn.commit()
+            self.memory[(provider, query)] = (result, created)
+
+    def missing_adder(self, rows):
+        """
+        This function stores many results at once, without replacing the cached ones (expired
+        misses are replaced).
+
+        :rows: List of (provider, query, result dictionary) tuples.
+
+        :return: Number of results added.
+        """
+        with self.lock:
+            created = time.time()
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "DELETE FROM geocodes WHERE provider = ? AND version = ? AND query = ? "
+                "AND result = '{}' AND (created IS NULL OR created <= ?)",
+                [
+                    (provider, self.version, query, created - self.miss_seconds)
+                    for provider, query, _ in rows
+                ],
+            )
+            deleted = self.conn.total_changes - before
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO geocodes (provider, version, query, result, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (provider, self.version, query, json.dumps(result), created)
+                    for provider, query, result in rows
+                ],
+            )
+            self.conn.commit()
+            for provider, query, _ in rows:
+                self.memory.pop((provider, query), None)
+
+            return self.conn.total_changes - before - deleted
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,370 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from arcgis.geocoding import geocode
+from opencage.geocoder import RateLimitExceededError
+
+from fun.quota import QuotaExhausted
+from fun.spatial import haversine
+
+# Sources of the coordinates of an observation and columns filled by every geocoding service
+providers = ["manual", "osm", "opencage", "esri"]
+result_columns = ["lat", "lon", "score", "match_type", "bbox_size"]
+
+# Parts of the messages of the ESRI errors raised when the credits or the rate limit of the
+# account are used up
+esri_quota_errors = ["credit", "quota", "rate limit", "too many requests", "error code: 429"]
+
+
+def oc_geocoder(geocoder, x, bounds=None, proximity=None):
+    """
+    This function geocodes observations with OpenCage service and returns the best match
+    with its Latitude, Longitude and quality information.
+
+    :geocoder: OpenCageGeocode object.
+    :x: Address query.
+    :bounds: Optional box (min lon, min lat, max lon, max lat) to restrict the results.
+    :proximity: Optional point (lat, lon) to favour the closest results.
+
+    :return: Dictionary with lat, lon, score (OpenCage confidence, 0-10), match_type
+    (OpenCage component type) and bbox_size (diagonal of the result bounds in meters).
+    """
+    params = {}
+    if bounds:
+        params["bounds"] = ",".join(str(v) for v in bounds)
+    if proximity:
+        params["proximity"] = ",".join(str(v) for v in proximity)
+
+    try:
+        results = geocoder.geocode(x, **params)
+    except RateLimitExceededError as e:
+        raise QuotaExhausted(str(e))
+    best = results[0]
+
+    bbox_size = np.nan
+    bounds = best.get("bounds")
+    if bounds:
+        bbox_size = float(
+            haversine(
+                bounds["southwest"]["lat"],
+                bounds["southwest"]["lng"],
+                bounds["northeast"]["lat"],
+                bounds["northeast"]["lng"],
+            )
+        )
+
+    return {
+        "lat": best["geometry"]["lat"],
+        "lon": best["geometry"]["lng"],
+        "score": best.get("confidence", np.nan),
+        "match_type": best.get("components", {}).get("_type"),
+        "bbox_size": bbox_size,
+    }
+
+
+def esri_geocoder(x, bounds=None, proximity=None):
+    """
+    This function geocodes observations with ESRI service and returns the best match
+    with its Latitude, Longitude and quality information.
+
+    :x: Address query, as single line text or as a structured address dictionary
+    (Address, City, Region, CountryCode...).
+    :bounds: Optional box (min lon, min lat, max lon, max lat) to restrict the results.
+    :proximity: Optional point (lat, lon) to favour the closest results.
+
+    :return: Dictionary with lat, lon, score (ESRI score, 0-100), match_type
+    (ESRI Addr_type attribute) and bbox_size (diagonal of the result extent in meters).
+    """
+    params = {}
+    if bounds:
+        params["search_extent"] = {
+            "xmin": bounds[0],
+            "ymin": bounds[1],
+            "xmax": bounds[2],
+            "ymax": bounds[3],
+            "spatialReference": {"wkid": 4326},
+        }
+    if proximity:
+        params["location"] = {
+            "x": proximity[1],
+            "y": proximity[0],
+            "spatialReference": {"wkid": 4326},
+        }
+
+    try:
+        results = geocode(x, **params)
+    except Exception as e:
+        if any(v in str(e).lower() for v in esri_quota_errors):
+            raise QuotaExhausted(str(e))
+        raise
+    best = results[0]
+
+    bbox_size = np.nan
+    extent = best.get("extent")
+    if extent:
+        bbox_size = float(
+            haversine(extent["ymin"], extent["xmin"], extent["ymax"], extent["xmax"])
+        )
+
+    return {
+        "lat": float(best["location"]["y"]),
+        "lon": float(best["location"]["x"]),
+        "score": best.get("score", np.nan),
+        "match_type": best.get("attributes", {}).get("Addr_type"),
+        "bbox_size": bbox_size,
+    }
+
+
+def osm_geocoder(session, url, x, engine="nominatim", bounds=None, proximity=None):
+    """
+    This function geocodes observations with a self-hosted Nominatim or Photon server (loaded
+    with an OpenStreetMap extract) and returns the best match with its Latitude, Longitude and
+    quality information.
+
+    :session: requests Session object, shared by every call to reuse the connections.
+    :url: Base URL of the server (e.g. http://localhost:8080).
+    :x: Address query.
+    :engine: 'nominatim' or 'photon', the API spoken by the server.
+    :bounds: Optional box (min lon, min lat, max lon, max lat) to restrict the results.
+    :proximity: Optional point (lat, lon) to favour the closest results (only Photon).
+
+    :return: Dictionary with lat, lon, score (Nominatim importance, 0-1, null for Photon),
+    match_type ('house' for results with house number, else the OSM type of the result)
+    and bbox_size (diagonal of the result bounds in meters).
+    """
+    if engine == "photon":
+        params = {"q": x, "limit": 1}
+        if bounds:
+            params["bbox"] = ",".join(str(v) for v in bounds)
+        if proximity:
+            params["lat"], params["lon"] = proximity
+
+        response = session.get(url.rstrip("/") + "/api", params=params, timeout=30)
+        response.raise_for_status()
+        best = response.json()["features"][0]
+        properties = best.get("properties", {})
+
+        bbox_size = np.nan
+        extent = properties.get("extent")
+        if extent:
+            bbox_size = float(haversine(extent[3], extent[0], extent[1], extent[2]))
+
+        return {
+            "lat": float(best["geometry"]["coordinates"][1]),
+            "lon": float(best["geometry"]["coordinates"][0]),
+            "score": np.nan,
+            "match_type": "house" if properties.get("housenumber") else properties.get("type"),
+            "bbox_size": bbox_size,
+        }
+
+    params = {"q": x, "format": "jsonv2", "limit": 1, "addressdetails": 1}
+    if bounds:
+        params["viewbox"] = ",".join(str(v) for v in bounds)
+        params["bounded"] = 1
+
+    response = session.get(url.rstrip("/") + "/search", params=params, timeout=30)
+    response.raise_for_status()
+    best = response.json()[0]
+
+    bbox_size = np.nan
+    bbox = best.get("boundingbox")
+    if bbox:
+        bbox = [float(v) for v in bbox]
+        bbox_size = float(haversine(bbox[0], bbox[2], bbox[1], bbox[3]))
+
+    return {
+        "lat": float(best["lat"]),
+        "lon": float(best["lon"]),
+        "score": float(best.get("importance") or np.nan),
+        "match_type": (
+            "house" if best.get("address", {}).get("house_number") else best.get("addresstype")
+        ),
+        "bbox_size": bbox_size,
+    }
+
+
+def confidence_checker(df, policy):
+    """
+    This function decides which geocoded observations can be accepted without manual review.
+    An observation is accepted when its score reaches the minimum of the policy, its bounding box
+    is not larger than the maximum of the policy and its match type is one of the allowed ones.
+    Any rule set to None in the policy is not applied.
+
+    :df: Dataframe with score, match_type and bbox_size columns.
+    :policy: Dictionary with min_score, max_bbox and match_types keys.
+
+    :return: Boolean Series, True for automatically accepted observations.
+    """
+    mask = pd.Series(True, index=df.index)
+
+    if policy.get("min_score") is not None:
+        mask &= df["score"] >= policy["min_score"]
+
+    if policy.get("max_bbox") is not None:
+        mask &= df["bbox_size"] <= policy["max_bbox"]
+
+    if policy.get("match_types"):
+        mask &= df["match_type"].isin(policy["match_types"])
+
+    return mask
+
+
+def query_geocoder(query, provider, function, cache, logger, quota=None):
+    """
+    This function geocodes one query through the cache, calling the provider only if the
+    query is not already cached.
+
+    :query: Address query.
+    :provider: Name of the geocoding service, used as part of the cache key.
+    :function: Function that receives a query and returns a result dictionary.
+    :cache: GeocodeCache object.
+    :logger: Logger for the queries that can not be geocoded.
+    :quota: Optional QuotaTracker object to count the calls to the provider.
+
+    :return: Result dictionary (empty if the query can not be geocoded).
+    Raise QuotaExhausted if the provider can not be called anymore.
+    """
+    result = cache.get(provider, query)
+    if result is not None:
+        return result
+
+    if quota is not None:
+        quota.consume(provider)
+
+    result = {}
+    try:
+        result = function(query)
+        cache.set(provider, query, result)
+    except QuotaExhausted:
+        if quota is not None:
+            quota.exhaust(provider)
+        raise
+    except IndexError:
+        # The provider answered without matches, remember it
+        cache.set(provider, query, result)
+        logger.debug("Can not geocode address: " + query)
+    except Exception as e:
+        logger.debug("Can not geocode address: " + query)
+        logger.debug(e)
+
+    return result
+
+
+def calls_estimator(queries, provider, cache, fallback=None):
+    """
+    This function estimates the calls to a provider needed to geocode a list of queries.
+
+    :queries: List of address queries (may contain duplicates).
+    :provider: Name of the geocoding service.
+    :cache: GeocodeCache object.
+    :fallback: Optional tuple (queries, provider) of another service whose failures are sent to
+    this one. Its queries are counted too, unless the other service already has a result for them.
+
+    :return: Number of distinct queries not found in the cache.
+    """
+    queries = set(queries)
+    if fallback is not None:
+        fallback_queries, fallback_provider = fallback
+        queries |= {x for x in set(fallback_queries) if not cache.get(fallback_provider, x)}
+
+    return sum(cache.get(provider, query) is None for query in queries)
+
+
+def checks_estimator(queries, provider, cache, sample):
+    """
+    This function estimates the calls to a provider needed to validate a sample of the results
+    of another service (see cross_checker in fun/pipeline.py).
+
+    :queries: List of address queries whose results are validated (may contain duplicates).
+    :provider: Name of the geocoding service used to validate them.
+    :cache: GeocodeCache object.
+    :sample: Fraction of the results validated (0 to 1).
+
+    :return: Number of calls expected, the sampled fraction of the distinct queries not found
+    in the cache (rounded up).
+    """
+    if sample <= 0:
+        return 0
+
+    return int(np.ceil(min(sample, 1) * calls_estimator(queries, provider, cache)))
+
+
+def queries_geocoder(queries, provider, function, cache, logger, quota=None, workers=1):
+    """
+    This function geocodes a list of queries through the cache. Each distinct query is sent
+    at most once to the provider, and only if it is not already cached. The most frequent
+    queries are geocoded first, so they are the ones done if the quota runs out.
+    Providers without quota (self-hosted servers) can be called with many concurrent requests.
+
+    :queries: List of address queries (may contain duplicates).
+    :provider: Name of the geocoding service, used as part of the cache key.
+    :function: Function that receives a query and returns a result dictionary.
+    :cache: GeocodeCache object.
+    :logger: Logger for the queries that can not be geocoded.
+    :quota: Optional QuotaTracker object to count the calls to the provider.
+    :workers: Number of concurrent requests (1 geocodes the queries one by one).
+
+    :return: List of result dictionaries in the same order as the queries
+    (empty dictionary for queries without result).
+    Raise QuotaExhausted if the provider can not be called anymore.
+    """
+    counts = Counter(queries)
+    ordered = sorted(counts, key=counts.get, reverse=True)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = dict(
+                zip(
+                    ordered,
+                    executor.map(
+                        lambda x: query_geocoder(x, provider, function, cache, logger, quota),
+                        ordered,
+                    ),
+                )
+            )
+    else:
+        results = {
+            query: query_geocoder(query, provider, function, cache, logger, quota)
+            for query in ordered
+        }
+
+    return [results[query] for query in queries]
+
+
+def results_writer(df, mask, results, provider):
+    """
+    This function writes in place the results of a geocoding service into the rows of the
+    dataframe selected by the mask. The provider is only set for rows with coordinates.
+
+    :df: Working dataframe with the result columns.
+    :mask: Boolean Series selecting the geocoded rows (same order as results).
+    :results: List of result dictionaries.
+    :provider: Name of the geocoding service.
+    """
+    df_result = pd.DataFrame(results, index=df.index[mask], columns=result_columns)
+
+    for column in result_columns:
+        values = df_result[column]
+        if df[column].dtype != object:
+            values = values.astype(df[column].dtype)
+        df.loc[mask, column] = values
+
+    df.loc[mask & df["lat"].notnull(), "provider"] = provider
+
+
+def results_remover(df, mask):
+    """
+    This function removes in place the coordinates and quality info of the rows selected by the mask,
+    e.g. observations marked as wrongly geocoded.
+
+    :df: Working dataframe with the result columns.
+    :mask: Boolean Series selecting the rows to clear.
+    """
+    for column in result_columns + ["provider"]:
+        df.loc[mask, column] = None if df[column].dtype == object else np.nan
+
+    # The distance to the result of the other service is meaningless without a result
+    if "provider_distance" in df.columns:
+        df.loc[mask, "provider_distance"] = np.nan
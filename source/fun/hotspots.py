@@ -0,0 +1,189 @@
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fun.corrections import query_normalizer
+
+
+def cell_snapper(lat, lon, cell_size):
+    """
+    This function snaps coordinates to a regular grid, so that results falling on the
+    same spot share the same cell.
+
+    :lat: Series of Latitudes.
+    :lon: Series of Longitudes.
+    :cell_size: Size of the cells in degrees.
+
+    :return: Series of cell keys ('<row>:<col>'), null for missing coordinates.
+    """
+    row = np.floor(lat.astype("float64") / cell_size)
+    col = np.floor(lon.astype("float64") / cell_size)
+
+    cells = row.astype("Int64").astype(str) + ":" + col.astype("Int64").astype(str)
+    cells[row.isnull() | col.isnull()] = None
+
+    return cells
+
+
+class HotspotStore:
+    """
+    Persistent record of the distinct queries that fell in each grid cell, in the current and in
+    previous runs. Cells where many unrelated queries collapse are fallback points of the services
+    (city, street or postcode centroids) rather than real locations.
+    Points are stored with the size of their grid: when the size changes, the stored points are
+    snapped again to the new grid. The count of queries of each cell is kept in memory.
+    """
+
+    def __init__(self, path, cell_size=0.0003, min_queries=5):
+        """
+        :path: Path of the SQLite database file (created if it does not exist).
+        :cell_size: Size of the grid cells in degrees (0.0003 is about 30 meters).
+        :min_queries: Distinct queries in a cell to consider it a hotspot.
+        """
+        self.cell_size = cell_size
+        self.min_queries = min_queries
+        self.conn = sqlite3.connect(path)
+
+        # Stores created before the points had a grid size are snapped again to the current grid
+        columns = [x[1] for x in self.conn.execute("PRAGMA table_info(points)")]
+        if columns and "cell_size" not in columns:
+            self.conn.execute("ALTER TABLE points RENAME TO points_unsized")
+
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS points
+                (cell_size REAL, cell TEXT, query TEXT, lat REAL, lon REAL,
+                PRIMARY KEY (cell_size, cell, query));
+            CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, mtime REAL);
+            """
+        )
+        self.conn.commit()
+
+        if columns and "cell_size" not in columns:
+            self.points_snapper("points_unsized")
+            self.conn.execute("DROP TABLE points_unsized")
+            self.conn.commit()
+        elif not self.conn.execute(
+            "SELECT 1 FROM points WHERE cell_size = ? LIMIT 1", (cell_size,)
+        ).fetchone():
+            self.points_snapper("points")
+
+        # Distinct queries of each cell and cells that are hotspots, updated by points_adder
+        self.counts = dict(
+            self.conn.execute(
+                "SELECT cell, COUNT(*) FROM points WHERE cell_size = ? GROUP BY cell",
+                (cell_size,),
+            )
+        )
+        self.hotspot_cells = {cell for cell, n in self.counts.items() if n >= min_queries}
+
+    def points_snapper(self, table):
+        """
+        This function snaps the points stored with another grid (or without grid) to the
+        current grid.
+
+        :table: Name of the table with the points.
+        """
+        df = pd.read_sql_query(f"SELECT DISTINCT query, lat, lon FROM {table}", self.conn)
+        if df.empty:
+            return
+
+        df["cell"] = cell_snapper(df["lat"], df["lon"], self.cell_size)
+        df = df.loc[df["cell"].notnull(), :]
+
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO points (cell_size, cell, query, lat, lon) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (self.cell_size, cell, query, lat, lon)
+                for cell, query, lat, lon in zip(df["cell"], df["query"], df["lat"], df["lon"])
+            ],
+        )
+        self.conn.commit()
+
+    def points_adder(self, queries, lat, lon):
+        """
+        This function records the cells where the queries were geocoded.
+
+        :queries: Series of normalized queries.
+        :lat: Series of Latitudes.
+        :lon: Series of Longitudes.
+        """
+        cells = cell_snapper(lat, lon, self.cell_size)
+        mask = cells.notnull() & queries.notnull()
+
+        rows = zip(
+            cells[mask], queries[mask], lat[mask].astype(float), lon[mask].astype(float)
+        )
+        for cell, query, lat_point, lon_point in rows:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO points (cell_size, cell, query, lat, lon) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.cell_size, cell, query, lat_point, lon_point),
+            )
+            if cursor.rowcount == 1:
+                self.counts[cell] = self.counts.get(cell, 0) + 1
+                if self.counts[cell] >= self.min_queries:
+                    self.hotspot_cells.add(cell)
+        self.conn.commit()
+
+    def results_learner(self, results_path):
+        """
+        This function records the geocoded points of previous result files (not the ones
+        filled by hand). Files already read are skipped unless they changed since then.
+
+        :results_path: Folder with the results of every year ('results/<year>/*.xlsx').
+        """
+        sources = dict(self.conn.execute("SELECT path, mtime FROM sources"))
+
+        for file in sorted(Path(results_path).glob("*/*.xlsx")):
+            mtime = os.path.getmtime(file)
+            if sources.get(str(file)) == mtime:
+                continue
+
+            df = pd.read_excel(file)
+            if {"direccion_orig", "lat", "lon"}.issubset(df.columns):
+                if "provider" in df.columns:
+                    df = df.loc[df["provider"].notnull() & (df["provider"] != "manual"), :]
+                self.points_adder(
+                    query_normalizer(df["direccion_orig"]).where(df["direccion_orig"].notnull()),
+                    pd.to_numeric(df["lat"], errors="coerce"),
+                    pd.to_numeric(df["lon"], errors="coerce"),
+                )
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (path, mtime) VALUES (?, ?)",
+                (str(file), mtime),
+            )
+            self.conn.commit()
+
+    def hotspots(self):
+        """
+        This function gets the current list of hotspots.
+
+        :return: Dataframe with cell, lat, lon (mean of the points) and n_queries columns.
+        """
+        return pd.read_sql_query(
+            "SELECT cell, AVG(lat) AS lat, AVG(lon) AS lon, COUNT(*) AS n_queries FROM points "
+            "WHERE cell_size = ? GROUP BY cell HAVING COUNT(*) >= ?",
+            self.conn,
+            params=(self.cell_size, self.min_queries),
+        )
+
+    def hotspot_flagger(self, lat, lon):
+        """
+        This function checks which coordinates fall in a hotspot.
+
+        :lat: Series of Latitudes.
+        :lon: Series of Longitudes.
+
+        :return: Boolean Series, True for coordinates in a hotspot.
+        """
+        cells = cell_snapper(lat, lon, self.cell_size)
+        return cells.isin(self.hotspot_cells)
+
+    def close(self):
+        self.conn.close()
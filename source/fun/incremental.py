@@ -0,0 +1,68 @@
+import hashlib
+import os
+
+import pandas as pd
+
+
+def rows_hasher(ids, addresses):
+    """
+    This function computes a content hash of each row from its ID and its original address,
+    so that rows of a re-delivered file can be compared with the ones of the previous run.
+
+    :ids: Series of row IDs (as delivered, before building the unique ID of the month).
+    :addresses: Series of original addresses (as delivered, before formatting).
+
+    :return: Series of hashes (16 hexadecimal characters), same index as ids.
+    """
+    return pd.Series(
+        [
+            hashlib.sha1(f"{i}\x1f{'' if pd.isnull(x) else x}".encode("utf-8")).hexdigest()[:16]
+            for i, x in zip(ids, addresses)
+        ],
+        index=ids.index,
+    )
+
+
+def previous_rows_getter(path, hashes):
+    """
+    This function reads the results of a previous run of the same file and keeps the rows that
+    did not change since then, with their coordinates and review decisions.
+
+    :path: Path of the results file of the previous run.
+    :hashes: Series of hashes of the rows of the current file (see rows_hasher).
+
+    :return: Dataframe with the unchanged rows of the previous results (empty if there is no
+    previous run or it has no hashes) + Boolean Series, True for the unchanged rows of the
+    current file.
+    """
+    df_prev = pd.DataFrame()
+    if os.path.isfile(path):
+        df_prev = pd.read_excel(path)
+
+    if "hash_fila" not in df_prev.columns:
+        return pd.DataFrame(), pd.Series(False, index=hashes.index)
+
+    df_prev = df_prev.loc[df_prev["hash_fila"].isin(hashes), :]
+    df_prev = df_prev.drop_duplicates(subset="hash_fila")
+
+    return df_prev, hashes.isin(df_prev["hash_fila"])
+
+
+def previous_rows_joiner(df_prev, df):
+    """
+    This function joins the unchanged rows of the previous run with the rows geocoded in this one,
+    sorted by ID (the rows are kept as they are if there are no previous rows).
+
+    :df_prev: Dataframe with the unchanged rows of the previous results (see previous_rows_getter).
+    :df: Dataframe with the rows geocoded in this run.
+
+    :return: Dataframe with every row of the month.
+    """
+    if df_prev.empty:
+        return df
+
+    # Columns of the previous results are read from Excel: the new rows are joined as objects (so
+    # categories and text are not mixed up) and the types are inferred again afterwards
+    df = pd.concat([df_prev, df.astype(object)], ignore_index=True).infer_objects()
+
+    return df.sort_values("id")
@@ -0,0 +1,132 @@
+import re
+
+import pandas as pd
+
+# Words that identify a place (landmark) instead of a street
+landmarks = [
+    "hospital", "sanatorio", "centro de salud", "escuela", "colegio", "facultad",
+    "universidad", "plaza", "parque", "monumento", "club", "estadio", "terminal",
+    "estacion", "estación", "shopping", "cementerio", "comisaria", "comisaría",
+    "iglesia", "barrio", "bº", "b°", "hipermercado", "supermercado", "autodromo",
+    "autódromo", "aeropuerto", "puerto", "costanera", "balneario", "playa",
+]
+
+# Street names with a date (e.g. '9 de Julio'), whose number is not a house number
+months = [
+    "enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre",
+    "setiembre", "octubre", "noviembre", "diciembre",
+]
+date_names = re.compile(r"\b\d{1,2}°?\s+de\s+(?:" + "|".join(months) + r")\b", re.IGNORECASE)
+
+# Private characters that stand for the digits of protected street names while splitting
+digits_protected = str.maketrans("0123456789", "".join(chr(0xE000 + i) for i in range(10)))
+digits_unprotected = {v: k for k, v in digits_protected.items()}
+
+# Components of an address: street, house number, cross street (intersections) or place
+address_parts = re.compile(
+    r"^(?:(?P<calle_i>.+?)\s+y\s+(?P<calle_cruce>.+)"
+    r"|(?P<calle_n>.+?)\s+(?P<altura>\d{1,5})\b.*"
+    r"|(?P<nombre>.+))$"
+)
+
+
+def address_parser(queries, cities, rules):
+    """
+    This function splits the formatted queries into typed components in a single vectorized pass.
+    Street names that contain ' y ' (e.g. 'Avenida Battle y Ordoñez') are not taken as intersections,
+    and numbers of street names (e.g. 'Bulevar 27 de Febrero') are not taken as house numbers.
+
+    :queries: Series of formatted queries ('<address>, <city>, <province>, <country>').
+    :cities: Series with the city of each query.
+    :rules: RulePack object used to format the queries.
+
+    :return: Dataframe with calle, altura, calle_cruce, lugar, ciudad and tipo_direccion
+    ('interseccion', 'altura', 'lugar' or 'calle') columns, with the same index as queries.
+    """
+    # Address part of the query (before the first city suffix)
+    address = queries.str.replace(
+        rf",[^,]+{re.escape(rules.suffix)}.*$", "", regex=True
+    ).str.strip()
+
+    def protect(name):
+        return name.replace(" y ", " \x00 ").translate(digits_protected)
+
+    def unprotect(s):
+        return (
+            s.str.replace(" \x00 ", " y ", regex=False).str.translate(digits_unprotected).str.strip()
+        )
+
+    # Protect street names with ' y ' or numbers so that they are not split as intersections
+    # nor as house numbers
+    protected = {
+        repl.strip(): protect(repl.strip())
+        for _, repl in rules.aliases
+        if " y " in repl or re.search(r"\d", repl)
+    }
+    for name, placeholder in protected.items():
+        address = address.str.replace(name, placeholder, regex=False)
+    address = address.str.replace(date_names, lambda m: protect(m.group(0)), regex=True)
+
+    parts = address.str.extract(address_parts)
+
+    df_parts = pd.DataFrame(index=queries.index)
+    df_parts["calle"] = unprotect(parts["calle_i"].fillna(parts["calle_n"]))
+    df_parts["altura"] = pd.to_numeric(parts["altura"], errors="coerce").astype("Int32")
+    df_parts["calle_cruce"] = unprotect(parts["calle_cruce"])
+    df_parts["lugar"] = None
+    df_parts["ciudad"] = cities
+
+    # Addresses without number nor cross street are places if they have a landmark word
+    nombre = unprotect(parts["nombre"])
+    mask_lugar = nombre.str.contains(
+        r"\b(?:" + "|".join(landmarks) + r")\b", case=False, regex=True, na=False
+    )
+    df_parts.loc[mask_lugar, "lugar"] = nombre[mask_lugar]
+    df_parts["calle"] = df_parts["calle"].fillna(nombre.where(~mask_lugar))
+
+    df_parts["tipo_direccion"] = "calle"
+    df_parts.loc[df_parts["altura"].notnull(), "tipo_direccion"] = "altura"
+    df_parts.loc[df_parts["calle_cruce"].notnull(), "tipo_direccion"] = "interseccion"
+    df_parts.loc[mask_lugar, "tipo_direccion"] = "lugar"
+
+    return df_parts
+
+
+def esri_address_builder(df_parts, rules):
+    """
+    This function builds the structured addresses accepted by ESRI geocoding service from
+    the components of the queries. Places are sent as single line text.
+
+    :df_parts: Dataframe returned by address_parser.
+    :rules: RulePack object used to format the queries.
+
+    :return: Series of dictionaries with the structured address, same index as df_parts.
+    """
+    region = rules.rules["province"]
+    country = rules.rules["country"]
+    country_code = rules.country_code
+
+    addresses = []
+    for calle, altura, cruce, lugar, ciudad, tipo in zip(
+        df_parts["calle"],
+        df_parts["altura"],
+        df_parts["calle_cruce"],
+        df_parts["lugar"],
+        df_parts["ciudad"],
+        df_parts["tipo_direccion"],
+    ):
+        if tipo == "interseccion":
+            address = {"Address": f"{calle} & {cruce}"}
+        elif tipo == "altura":
+            address = {"Address": f"{calle} {altura}"}
+        elif tipo == "lugar":
+            address = {"SingleLine": f"{lugar}, {ciudad}, {region}, {country}"}
+        else:
+            address = {"Address": calle}
+
+        if "Address" in address:
+            address.update({"City": ciudad, "Region": region, "CountryCode": country_code})
+
+        addresses.append(address)
+
+    return pd.Series(addresses, index=df_parts.index, dtype=object)
@@ -0,0 +1,703 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+from fun.corrections import query_normalizer
+from fun.enrich import boundaries_joiner
+from fun.formatqueries import queries_formatter
+from fun.geocoders import (
+    confidence_checker,
+    esri_geocoder,
+    oc_geocoder,
+    osm_geocoder,
+    providers,
+    queries_geocoder,
+    results_remover,
+    results_writer,
+)
+from fun.parseaddress import address_parser, esri_address_builder
+from fun.quota import QuotaExhausted
+from fun.reformulate import leftovers_stripper, retry_geocoder
+from fun.streets import streets_checker
+from fun.validation import agreement_checker
+
+
+def policy_value(name, default):
+    """
+    This function reads a numeric rule of the acceptance policy (or a quota limit) from the
+    environment variables.
+
+    :name: Name of the environment variable.
+    :default: Value used when the variable is not set.
+
+    :return: Float value or None if the rule is disabled (empty value).
+    """
+    value = os.getenv(name, default)
+    return float(value) if value else None
+
+
+def settings_getter():
+    """
+    This function reads the settings of the pipeline from the environment variables.
+
+    :return: Dictionary with acceptance_policy (rules to accept results without review for each
+    service), esri_speculative, cross_check_sample, oc_address_types, retry_budget, street_limits
+    osm, format_workers, cache_miss_days and quota_limits (limits of each service, as expected by
+    QuotaTracker) keys.
+    """
+    return {
+        # Policy to accept geocoded observations without manual review (disable a rule leaving it empty)
+        "acceptance_policy": {
+            "osm": {
+                "min_score": policy_value("OSM_MIN_SCORE", ""),
+                "max_bbox": policy_value("OSM_MAX_BBOX", "100"),
+                "match_types": (os.getenv("OSM_MATCH_TYPES") or "house").split(","),
+            },
+            "opencage": {
+                "min_score": policy_value("OC_MIN_CONFIDENCE", "9"),
+                "max_bbox": policy_value("OC_MAX_BBOX", "500"),
+                "match_types": None,
+            },
+            "esri": {
+                "min_score": policy_value("ESRI_MIN_SCORE", "95"),
+                "max_bbox": policy_value("ESRI_MAX_BBOX", ""),
+                "match_types": ["PointAddress", "StreetAddress", "StreetInt", "POI"],
+            },
+        },
+        # Geocode with Esri, during the OpenCage review, the results that will probably be rejected
+        # (suspicious or below the score of the policy)
+        "esri_speculative": os.getenv("ESRI_SPECULATIVE", "1") not in ("", "0"),
+        # Fraction of OpenCage results to validate against Esri, and of Esri results to validate
+        # against OpenCage (0 disables the check, 1 checks all)
+        "cross_check_sample": float(os.getenv("CROSS_CHECK_SAMPLE") or 0),
+        # Types of address (from the parsed components) sent first to OpenCage. The rest goes to Esri
+        "oc_address_types": (os.getenv("OC_ADDRESS_TYPES") or "lugar,calle,altura").split(","),
+        # Maximum calls to the services to recover each failed address with reformulated queries
+        "retry_budget": int(os.getenv("RETRY_BUDGET") or 3),
+        # Maximum distance in meters of a result to the nearest street and to the streets of its address
+        "street_limits": {
+            "max_distance": float(os.getenv("STREETS_MAX_DISTANCE") or 60),
+            "max_named": float(os.getenv("STREETS_MAX_NAMED_DISTANCE") or 150),
+        },
+        # Self-hosted Nominatim or Photon server, tried before the paid services (disabled without URL)
+        "osm": {
+            "url": os.getenv("OSM_URL") or None,
+            "engine": (os.getenv("OSM_ENGINE") or "nominatim").lower(),
+            "workers": int(os.getenv("OSM_WORKERS") or 8),
+        },
+        # Processes to format the queries of large inputs (1 formats them in the main process)
+        "format_workers": int(os.getenv("FORMAT_WORKERS") or 1),
+        # Days after which the addresses that a service did not find are asked again
+        "cache_miss_days": float(os.getenv("CACHE_MISS_DAYS") or 30),
+        # Daily calls of each service and monthly Esri credits (a limit left empty is not applied)
+        "quota_limits": {
+            "opencage": {"daily": policy_value("OC_DAILY_QUOTA", "2500")},
+            "esri": {
+                "daily": policy_value("ESRI_DAILY_QUOTA", ""),
+                "credits": policy_value("ESRI_CREDITS", ""),
+                "cost": policy_value("ESRI_CREDITS_PER_CALL", "0.04"),
+            },
+        },
+    }
+
+
+def dataframe_preparer(df, rules, workers=1):
+    """
+    This function adds to a dataframe of addresses the formatted queries, their components and
+    empty columns for the results of the geocoding services.
+
+    :df: Dataframe with id and direccion_avp (original address) columns.
+    :rules: RulePack object with the rules to format the queries.
+    :workers: Number of processes to format the queries (see queries_formatter).
+
+    :return: Dataframe with the new columns (the original address is kept in 'direccion_orig')
+    + dictionary with the formatted query as key and its structured address for ESRI as value.
+    """
+    n_rows = len(df.index)
+
+    # The original address is kept as categorical (repeated addresses share memory) and the
+    # formatted query is written in 'direccion_avp'
+    df["direccion_orig"] = df["direccion_avp"].str.lower().astype("category")
+
+    # Create column for Latitude, Longitude and quality of the geocoding
+    df.insert(len(df.columns), "lat", np.nan)
+    df.insert(len(df.columns), "lon", np.nan)
+    df.insert(len(df.columns), "provider", pd.Categorical([None] * n_rows, categories=providers))
+    df.insert(len(df.columns), "score", np.float32(np.nan))
+    df.insert(len(df.columns), "match_type", None)
+    df.insert(len(df.columns), "bbox_size", np.float32(np.nan))
+    df.insert(len(df.columns), "provider_distance", np.float32(np.nan))
+    df.insert(len(df.columns), "direccion_reformulada", None)
+
+    # Format queries of rows with address (null addresses are left blank)
+    mask_valid = df["direccion_orig"].notnull()
+
+    df_queries = queries_formatter(
+        pd.DataFrame(
+            {
+                "id": df.loc[mask_valid, "id"],
+                "direccion_avp": df.loc[mask_valid, "direccion_orig"].astype(str),
+            }
+        ),
+        rules,
+        workers,
+    )
+    df["direccion_avp"] = df_queries["direccion_avp"].astype("category")
+    df["ciudad"] = df_queries["ciudad"].astype("category")
+
+    # Split the queries into components (street, number, cross street, place, city)
+    df_parts = address_parser(df_queries["direccion_avp"], df_queries["ciudad"], rules)
+    for column in ["calle", "calle_cruce", "lugar", "tipo_direccion"]:
+        df[column] = df_parts[column].astype("category")
+    df["altura"] = df_parts["altura"]
+
+    # Structured addresses for Esri, used instead of the free text query
+    addresses = dict(zip(df_queries["direccion_avp"], esri_address_builder(df_parts, rules)))
+
+    return df, addresses
+
+
+def geocoders_builder(geocoder, rules, addresses, osm=None):
+    """
+    This function builds the geocoding functions used by the pipeline, restricted to the
+    bounding box and close to the center of the city of each query.
+
+    :geocoder: OpenCageGeocode object.
+    :rules: RulePack object used to format the queries.
+    :addresses: Dictionary with the formatted query as key and its structured address for ESRI as value.
+    :osm: Optional dictionary with url and engine of a self-hosted OpenStreetMap server.
+
+    :return: Dictionary with opencage, esri (query as text) and esri_structured functions, and
+    osm if the server is configured.
+    """
+    def oc_city_geocoder(x):
+        return oc_geocoder(geocoder, x, **rules.city_hints(rules.query_city(x)))
+
+    def esri_city_geocoder(x):
+        return esri_geocoder(x, **rules.city_hints(rules.query_city(x)))
+
+    def esri_structured_geocoder(x):
+        return esri_geocoder(addresses.get(x, x), **rules.city_hints(rules.query_city(x)))
+
+    functions = {
+        "opencage": oc_city_geocoder,
+        "esri": esri_city_geocoder,
+        "esri_structured": esri_structured_geocoder,
+    }
+
+    if osm and osm.get("url"):
+        # One session for every call, so the connections to the server are reused
+        session = requests.Session()
+
+        def osm_city_geocoder(x):
+            return osm_geocoder(
+                session, osm["url"], x, osm["engine"], **rules.city_hints(rules.query_city(x))
+            )
+
+        functions["osm"] = osm_city_geocoder
+
+    return functions
+
+
+def corrections_applier(df, keys, corrections):
+    """
+    This function fills in place the coordinates of the addresses corrected by hand in previous reviews.
+
+    :df: Working dataframe with the result columns.
+    :keys: Series of normalized original addresses.
+    :corrections: CorrectionStore object.
+
+    :return: Boolean Series, True for the corrected rows.
+    """
+    df_fix = corrections.corrections_getter(keys)
+    mask = df["direccion_orig"].notnull() & df_fix["lat"].notnull()
+    df.loc[mask, "lat"] = df_fix.loc[mask, "lat"]
+    df.loc[mask, "lon"] = df_fix.loc[mask, "lon"]
+    df.loc[mask, "provider"] = "manual"
+
+    return mask
+
+
+def stage_geocoder(df, mask, provider, function, cache, logger, quota=None, workers=1):
+    """
+    This function geocodes the rows selected by the mask with one service and writes the
+    results in place.
+
+    :df: Working dataframe with the result columns.
+    :mask: Boolean Series selecting the rows to geocode.
+    :provider: Name of the geocoding service.
+    :function: Function that receives a query and returns a result dictionary.
+    :cache: GeocodeCache object.
+    :logger: Logger for the queries that can not be geocoded.
+    :quota: Optional QuotaTracker object to count the calls to the service.
+    :workers: Number of concurrent requests to the service.
+
+    :return: Boolean Series, True for the selected rows that got coordinates.
+    Raise QuotaExhausted if the service can not be called anymore.
+    """
+    results = queries_geocoder(
+        df.loc[mask, "direccion_avp"].tolist(), provider, function, cache, logger, quota, workers
+    )
+    results_writer(df, mask, results, provider)
+
+    return mask & df["lat"].notnull() & df["lon"].notnull()
+
+
+def osm_applier(
+    df, mask, keys, function, cache, logger, settings, hotspots=None, streets=None, learn=True
+):
+    """
+    This function geocodes the rows selected by the mask with the self-hosted OpenStreetMap
+    server (no quota, many concurrent requests) and keeps in place only the results that meet its
+    acceptance policy and are not suspicious. The rest is cleared, to be geocoded by the paid services.
+
+    :df: Working dataframe with the result columns.
+    :mask: Boolean Series selecting the rows to geocode.
+    :keys: Series of normalized original addresses.
+    :function: OpenStreetMap geocoding function (see geocoders_builder).
+    :cache: GeocodeCache object.
+    :logger: Logger for the queries that can not be geocoded.
+    :settings: Dictionary with the settings of the pipeline (see settings_getter).
+    :hotspots: Optional HotspotStore object.
+    :streets: Optional StreetIndex object.
+    :learn: Record the results in the hotspots store (False to only check them).
+
+    :return: Boolean Series, True for the accepted rows.
+    """
+    mask = stage_geocoder(
+        df, mask, "osm", function, cache, logger, workers=settings["osm"]["workers"]
+    )
+
+    mask_accepted, _ = review_selector(
+        df,
+        mask,
+        keys,
+        settings["acceptance_policy"]["osm"],
+        hotspots,
+        streets,
+        settings["street_limits"],
+        learn,
+    )
+    mask_rejected = df.index.isin(mask_accepted.index[~mask_accepted])
+    results_remover(df, mask_rejected)
+    for column in ["distancia_calle", "distancia_calle_nombre"]:
+        if column in df.columns:
+            df.loc[mask_rejected, column] = np.nan
+
+    return mask & ~mask_rejected
+
+
+def centroids_remover(df, mask, points):
+    """
+    This function discards in place the results with generic coords (wrongly geocoded addresses).
+
+    :df: Working dataframe with the result columns.
+    :mask: Boolean Series selecting the rows to check.
+    :points: List of generic points (lat, lon) of the region (see RulePack.fallback_points).
+
+    :return: Boolean Series, True for the selected rows that still have coordinates.
+    """
+    mask_generic = pd.Series(False, index=df.index)
+    for lat, lon in points:
+        mask_generic |= (df["lat"] == lat) | (df["lon"] == lon)
+    results_remover(df, mask & mask_generic)
+
+    return mask & df["lat"].notnull() & df["lon"].notnull()
+
+
+def review_selector(
+    df, mask, keys, policy, hotspots=None, streets=None, street_limits=None, learn=True
+):
+    """
+    This function decides which geocoded rows can be accepted without manual review: results
+    that meet the acceptance policy and are not suspicious, i.e. do not fall in a fallback hotspot
+    of the services nor far from the streets of their address.
+
+    :df: Working dataframe with the result columns.
+    :mask: Boolean Series selecting the geocoded rows.
+    :keys: Series of normalized original addresses.
+    :policy: Acceptance policy of the service (see confidence_checker).
+    :hotspots: Optional HotspotStore object. The results are recorded in it before checking.
+    :streets: Optional StreetIndex object.
+    :street_limits: Dictionary with max_distance and max_named distances (see streets_checker).
+    :learn: Record the results in the hotspots store (False to only check them).
+
+    :return: Boolean Series, True for accepted rows + Boolean Series, True for suspicious rows
+    (both with the index of the selected rows).
+    """
+    mask_hotspot = pd.Series(False, index=df.index[mask])
+    if hotspots is not None:
+        if learn:
+            hotspots.points_adder(keys[mask], df.loc[mask, "lat"], df.loc[mask, "lon"])
+        mask_hotspot = hotspots.hotspot_flagger(df.loc[mask, "lat"], df.loc[mask, "lon"])
+
+    if streets is not None:
+        mask_hotspot |= streets_checker(df, mask, streets, **street_limits)
+
+    mask_accepted = confidence_checker(df.loc[mask, :], policy)
+    mask_accepted &= ~mask_hotspot
+
+    return mask_accepted, mask_hotspot
+
+
+def cross_checker(df, index, provider, function, cache, logger, tolerance, quota=None):
+    """
+    This function validates a sample of the results of a service against another service and
+    writes in place the distance between both services.
+
+    :df: Working dataframe with the result columns.
+    :index: Index of the rows to validate.
+    :provider: Name of the other geocoding service.
+    :function: Geocoding function of the other service.
+    :cache: GeocodeCache object.
+    :logger: Logger for the queries that can not be geocoded.
+    :tolerance: Dictionary with the maximum distance in meters between services for each city.
+    :quota: Optional QuotaTracker object to count the calls to the other service.
+
+    :return: Boolean Series, True for rows where both services agree + Boolean Series, True for
+    rows where the other service has a result (both with the index of the sample).
+    Raise QuotaExhausted if the other service can not be called anymore.
+    """
+    results = queries_geocoder(
+        df.loc[index, "direccion_avp"].tolist(), provider, function, cache, logger, quota
+    )
+    df_check = pd.DataFrame(results, index=index, columns=["lat", "lon"])
+
+    mask_agree, distance = agreement_checker(
+        df.loc[index, ["lat", "lon"]],
+        df_check,
+        df.loc[index, "ciudad"].map(tolerance).astype("float64"),
+    )
+    df.loc[index, "provider_distance"] = distance.astype("float32")
+
+    return mask_agree, df_check["lat"].notnull() & df_check["lon"].notnull()
+
+
+def retry_applier(df, mask, functions, rules, cache, budget, logger, quota=None):
+    """
+    This function retries in place the rows that could not be geocoded with reformulated queries
+    (cheapest first) and saves the query used in 'direccion_reformulada'.
+
+    :df: Working dataframe with the result columns.
+    :mask: Boolean Series selecting the rows without coordinates.
+    :functions: Dictionary with the geocoding functions (see geocoders_builder).
+    :rules: RulePack object used to format the queries.
+    :cache: GeocodeCache object.
+    :budget: Maximum number of calls to the services for each distinct query.
+    :logger: Logger for the queries that can not be geocoded.
+    :quota: Optional QuotaTracker object to count the calls to the services.
+
+    :return: Boolean Series, True for the recovered rows.
+    Raise QuotaExhausted if a service can not be called anymore.
+    """
+    df_retry = queries_formatter(
+        pd.DataFrame(
+            {
+                "id": df.loc[mask, "id"],
+                "direccion_avp": leftovers_stripper(df.loc[mask, "direccion_orig"].astype(str)),
+            }
+        ),
+        rules,
+    )
+    results = retry_geocoder(
+        df.loc[mask, "direccion_avp"].tolist(),
+        df_retry["direccion_avp"].tolist(),
+        df_retry["ciudad"].tolist(),
+        {"esri": functions["esri"], "opencage": functions["opencage"]},
+        rules,
+        cache,
+        budget,
+        logger,
+        quota,
+    )
+
+    index_retry = df.index[mask]
+    for provider in ["esri", "opencage"]:
+        results_provider = [x for x in results if x[1] == provider]
+        mask_provider = df.index.isin([i for i, x in zip(index_retry, results) if x[1] == provider])
+        results_writer(df, mask_provider, [x[0] for x in results_provider], provider)
+        df.loc[mask_provider, "direccion_reformulada"] = [x[2] for x in results_provider]
+
+    return mask & df["lat"].notnull()
+
+
+def rejections_applier(df, mask, keys, corrections=None):
+    """
+    This function removes in place the results rejected by the reviewer and remembers, for
+    each service, the rejected queries.
+
+    :df: Working dataframe with the result columns.
+    :mask: Boolean Series selecting the rejected rows.
+    :keys: Series of normalized original addresses.
+    :corrections: Optional CorrectionStore object.
+    """
+    if corrections is not None:
+        for provider in ["esri", "opencage"]:
+            corrections.rejections_adder(keys[mask & (df["provider"] == provider)], provider)
+    results_remover(df, mask)
+
+
+def geocode_dataframe(
+    df,
+    rules,
+    geocoder,
+    cache,
+    logger,
+    settings,
+    corrections=None,
+    hotspots=None,
+    quota=None,
+    boundaries=None,
+    streets=None,
+    planner=None,
+    reviewer=None,
+    learn_hotspots=True,
+):
+    """
+    This function runs the whole geocoding pipeline: corrections of previous reviews, the
+    self-hosted OpenStreetMap server (if configured), OpenCage, ESRI for intersections and failures,
+    and reformulated queries for what is left.
+    Results that do not meet the acceptance policy are sent to the reviewer, or kept and flagged
+    for review if there is no reviewer.
+
+    :df: Dataframe with id and direccion_avp (original address) columns.
+    :rules: RulePack object with the rules to format the queries.
+    :geocoder: OpenCageGeocode object (ESRI uses the active GIS session).
+    :cache: GeocodeCache object.
+    :logger: Logger for the queries that can not be geocoded.
+    :settings: Dictionary with the settings of the pipeline (see settings_getter).
+    :corrections: Optional CorrectionStore object.
+    :hotspots: Optional HotspotStore object.
+    :quota: Optional QuotaTracker object to count the calls to the services.
+    :boundaries: Optional dictionary of boundary layers (see boundaries_getter) to add the
+    polygon of each result as a column.
+    :streets: Optional StreetIndex object to flag results far from the streets of their address.
+    :planner: Optional function called before the paid services with the working dataframe, a
+    dictionary with the queries of each service and the structured addresses for ESRI (e.g. to
+    estimate the calls or send them to a queue).
+    :reviewer: Optional function called after each paid service with the working dataframe,
+    the accepted and the suspicious rows (Boolean Series with the index of the geocoded rows)
+    and the name of the service. It returns the IDs of the wrongly geocoded rows, which are
+    remembered as rejected and cleared.
+    :learn_hotspots: Record the results in the hotspots store (False to only read it).
+
+    :return: Dataframe with the results and a 'revisar' column, True for rows to review.
+    Raise QuotaExhausted if a service can not be called anymore (results obtained until
+    then are kept in the cache, and the finished rows are set in its 'partial' attribute).
+    """
+    df, addresses = dataframe_preparer(df, rules, settings["format_workers"])
+    functions = geocoders_builder(geocoder, rules, addresses, settings["osm"])
+    policy = settings["acceptance_policy"]
+
+    mask_valid = df["direccion_orig"].notnull()
+    keys = query_normalizer(df["direccion_orig"])
+    df["revisar"] = False
+
+    def not_rejected(provider):
+        if corrections is None:
+            return pd.Series(True, index=df.index)
+        return ~corrections.rejected(keys, provider)
+
+    def selector(mask, provider):
+        return review_selector(
+            df,
+            mask,
+            keys,
+            policy[provider],
+            hotspots,
+            streets,
+            settings["street_limits"],
+            learn_hotspots,
+        )
+
+    def applier(mask, mask_accepted, mask_hotspot, provider):
+        # Rows not accepted go to the reviewer (its rejections are cleared) or are flagged
+        if reviewer is None:
+            df.loc[mask_accepted.index[~mask_accepted], "revisar"] = True
+        else:
+            ids_wrong = reviewer(df, mask_accepted, mask_hotspot, provider)
+            rejections_applier(df, mask & df["id"].isin(ids_wrong), keys, corrections)
+        logger.info(
+            f"{provider}: {mask_accepted.sum()} auto-accepted, {(~mask_accepted).sum()} to review"
+        )
+
+    # Rows with final results (accepted or reviewed), returned with the exception if a service
+    # runs out of quota, so they are not geocoded and reviewed again
+    mask_done = ~mask_valid
+
+    try:
+        if corrections is not None:
+            mask = corrections_applier(df, keys, corrections)
+            logger.info(f"{mask.sum()} addresses filled with previous manual corrections")
+            mask_done |= mask
+
+        # Free OpenStreetMap server first: only its confident results are kept
+        if "osm" in functions:
+            mask_osm = osm_applier(
+                df,
+                mask_valid & df["provider"].isnull(),
+                keys,
+                functions["osm"],
+                cache,
+                logger,
+                settings,
+                hotspots,
+                streets,
+                learn_hotspots,
+            )
+            logger.info(f"OSM: {mask_osm.sum()} auto-accepted")
+            mask_done |= mask_osm
+
+        # OpenCage for the types of address routed to it (never intersections), ESRI for the rest
+        mask_oc = (
+            mask_valid
+            & df["provider"].isnull()
+            & df["tipo_direccion"].isin(settings["oc_address_types"])
+            & (df["tipo_direccion"] != "interseccion")
+            & not_rejected("opencage")
+        )
+        if planner is not None:
+            mask = mask_valid & df["provider"].isnull() & ~mask_oc & not_rejected("esri")
+            planner(
+                df,
+                {
+                    "opencage": df.loc[mask_oc, "direccion_avp"].tolist(),
+                    "esri": df.loc[mask, "direccion_avp"].tolist(),
+                },
+                addresses,
+            )
+
+        mask_oc = stage_geocoder(
+            df, mask_oc, "opencage", functions["opencage"], cache, logger, quota
+        )
+        mask_oc = centroids_remover(df, mask_oc, rules.fallback_points)
+        mask_accepted, mask_hotspot = selector(mask_oc, "opencage")
+
+        # Validate a sample against ESRI: accept the results where both services agree and
+        # send to review the ones where they disagree (results in hotspots are always reviewed)
+        if settings["cross_check_sample"] > 0 and mask_oc.any():
+            index_sample = (
+                df.loc[mask_oc, :]
+                .sample(frac=min(settings["cross_check_sample"], 1), random_state=0)
+                .index
+            )
+            mask_agree, mask_checked = cross_checker(
+                df,
+                index_sample,
+                "esri",
+                functions["esri_structured"],
+                cache,
+                logger,
+                rules.tolerances(),
+                quota,
+            )
+            # Where ESRI has no result the decision of the policy is kept
+            index_checked = index_sample[mask_checked]
+            mask_accepted.loc[index_checked] = (
+                mask_agree[mask_checked] & ~mask_hotspot.loc[index_checked]
+            )
+            logger.info(
+                f"OpenCage: {mask_agree.sum()} of {mask_checked.sum()} validated with ESRI"
+            )
+
+        # While the reviewer checks the OpenCage results, geocode in the background with ESRI
+        # the addresses that will surely need it (intersections and OpenCage failures) and,
+        # speculatively, the ones under review that will probably be rejected: suspicious ones
+        # and ones below the score of the policy. Results are stored in the cache, where the
+        # ESRI stage finds them
+        executor = ThreadPoolExecutor(max_workers=1)
+        future_prefetch = None
+        if reviewer is not None:
+            mask_prefetch = mask_valid & df["provider"].isnull() & not_rejected("esri")
+            if settings["esri_speculative"]:
+                mask_likely = mask_hotspot.copy()
+                if policy["opencage"]["min_score"] is not None:
+                    mask_likely |= df.loc[mask_oc, "score"] < policy["opencage"]["min_score"]
+                mask_likely &= ~mask_accepted
+                mask_prefetch |= df.index.isin(mask_likely.index[mask_likely])
+            future_prefetch = executor.submit(
+                queries_geocoder,
+                df.loc[mask_prefetch, "direccion_avp"].tolist(),
+                "esri",
+                functions["esri_structured"],
+                cache,
+                logger,
+                quota,
+            )
+
+        try:
+            applier(mask_oc, mask_accepted, mask_hotspot, "opencage")
+        finally:
+            # If the quota ran out in the background, the ESRI stage raises it below
+            if future_prefetch is not None:
+                try:
+                    future_prefetch.result()
+                except QuotaExhausted:
+                    pass
+            executor.shutdown()
+        mask_done |= mask_oc & df["provider"].notnull()
+
+        # ESRI for the rest, and reformulated queries for what is still missing
+        mask_esri = mask_valid & df["provider"].isnull() & not_rejected("esri")
+        stage_geocoder(df, mask_esri, "esri", functions["esri_structured"], cache, logger, quota)
+
+        mask_retry = mask_esri & df["lat"].isnull()
+        if settings["retry_budget"] > 0 and mask_retry.any():
+            mask_retry = retry_applier(
+                df, mask_retry, functions, rules, cache, settings["retry_budget"], logger, quota
+            )
+            logger.info(f"{mask_retry.sum()} addresses recovered with reformulated queries")
+
+        mask_esri &= df["lat"].notnull() & df["lon"].notnull()
+        mask_accepted, mask_hotspot = selector(mask_esri, "esri")
+
+        # Results of reformulated queries are always reviewed
+        mask_accepted &= ~mask_retry[mask_esri]
+
+        # Validate a sample against OpenCage the same way, where OpenCage has a result (results
+        # of reformulated queries, queries whose OpenCage result was rejected and intersections,
+        # which are never sent to OpenCage, are left out)
+        mask_check = (
+            mask_esri
+            & ~mask_retry
+            & not_rejected("opencage")
+            & (df["tipo_direccion"] != "interseccion")
+        )
+        if settings["cross_check_sample"] > 0 and mask_check.any():
+            index_sample = (
+                df.loc[mask_check, :]
+                .sample(frac=min(settings["cross_check_sample"], 1), random_state=0)
+                .index
+            )
+            mask_agree, mask_checked = cross_checker(
+                df,
+                index_sample,
+                "opencage",
+                functions["opencage"],
+                cache,
+                logger,
+                rules.tolerances(),
+                quota,
+            )
+            index_checked = index_sample[mask_checked]
+            mask_accepted.loc[index_checked] = (
+                mask_agree[mask_checked] & ~mask_hotspot.loc[index_checked]
+            )
+            logger.info(
+                f"ESRI: {mask_agree.sum()} of {mask_checked.sum()} validated with OpenCage"
+            )
+
+        applier(mask_esri, mask_accepted, mask_hotspot, "esri")
+    except QuotaExhausted as e:
+        if boundaries:
+            boundaries_joiner(df, boundaries)
+        e.partial = df.loc[mask_done, :]
+        raise
+
+    if boundaries:
+        boundaries_joiner(df, boundaries)
+
+    return df
@@ -0,0 +1,115 @@
+import datetime
+import json
+import os
+import threading
+
+
+class QuotaExhausted(Exception):
+    """
+    Raised when a geocoding service can not be called anymore: the daily quota or the credit
+    budget is used up, or the service itself answered that the limit was reached.
+    The pipeline sets 'partial' to the rows already finished (accepted or reviewed) when it stops.
+    """
+
+    partial = None
+
+
+class QuotaTracker:
+    """
+    Persistent count of the calls made to each geocoding service, per day, and of the credits
+    spent, per month. It is saved as JSON after every call, so the count survives between runs.
+    """
+
+    def __init__(self, path, limits):
+        """
+        :path: Path of the JSON file (created if it does not exist).
+        :limits: Dictionary with the name of each service as key and a dictionary with
+        'daily' (maximum calls per day), 'credits' (credits available per month) and 'cost'
+        (credits per call) as value. A None limit is not applied.
+        """
+        self.path = path
+        self.limits = limits
+        self.lock = threading.Lock()
+
+        self.usage = {}
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                self.usage = json.load(f)
+
+    def usage_getter(self, provider):
+        """
+        This function gets the usage of a service, restarting the counters when the day or
+        the month changed since the last call.
+
+        :provider: Name of the geocoding service.
+
+        :return: Dictionary with day, calls, month and credits keys.
+        """
+        today = datetime.date.today()
+        usage = self.usage.setdefault(provider, {})
+
+        if usage.get("day") != today.isoformat():
+            usage.update({"day": today.isoformat(), "calls": 0})
+        if usage.get("month") != today.strftime("%Y-%m"):
+            usage.update({"month": today.strftime("%Y-%m"), "credits": 0})
+
+        return usage
+
+    def remaining(self, provider):
+        """
+        This function computes how many calls can still be made today to a service.
+
+        :provider: Name of the geocoding service.
+
+        :return: Number of calls (infinite if the service has no limits).
+        """
+        limits = self.limits.get(provider, {})
+        usage = self.usage_getter(provider)
+        remaining = float("inf")
+
+        if usage.get("exhausted") == usage["day"]:
+            return 0
+
+        if limits.get("daily") is not None:
+            remaining = min(remaining, limits["daily"] - usage["calls"])
+
+        if limits.get("credits") is not None and limits.get("cost"):
+            remaining = min(
+                remaining, (limits["credits"] - usage["credits"]) // limits["cost"]
+            )
+
+        return max(remaining, 0)
+
+    def consume(self, provider):
+        """
+        This function registers a call to a service, if there is quota left for it.
+
+        :provider: Name of the geocoding service.
+
+        :return: Raise QuotaExhausted or pass.
+        """
+        with self.lock:
+            if self.remaining(provider) < 1:
+                raise QuotaExhausted(f"Quota of {provider} exhausted")
+
+            usage = self.usage_getter(provider)
+            usage["calls"] += 1
+            usage["credits"] += self.limits.get(provider, {}).get("cost") or 0
+
+            self.saver()
+
+    def exhaust(self, provider):
+        """
+        This function marks a service as exhausted for today, e.g. when the service itself
+        answered that its limit was reached.
+
+        :provider: Name of the geocoding service.
+        """
+        with self.lock:
+            usage = self.usage_getter(provider)
+            usage["exhausted"] = usage["day"]
+            self.saver()
+
+    def saver(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.usage, f, indent=4)
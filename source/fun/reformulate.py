@@ -0,0 +1,118 @@
+import re
+
+from fun.geocoders import query_geocoder
+
+# Leftover tokens that do not help the services: references, separators and hints
+# about the position of the place ('frente a', 'esquina', 'al lado de'...)
+leftovers = re.compile(
+    r"\b(ref|frente( a)?|esq(uina)?|al lado( de)?|altura|nro)\b|[-.,;:#()\"]",
+    re.IGNORECASE,
+)
+house_number = re.compile(r"\s\d+\b")
+street_type = re.compile(r"\b(avenida|bulevar|calle|pasaje)\s", re.IGNORECASE)
+
+
+def leftovers_stripper(s):
+    """
+    This function removes from the original addresses the tokens that do not help the services.
+
+    :s: Series of original addresses.
+
+    :return: Series of stripped addresses, to be formatted with queries_formatter.
+    """
+    return (
+        s.str.replace(leftovers, " ", regex=True)
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def query_reformulator(query, canonical, city, rules):
+    """
+    This function generates alternative versions of a query that could not be geocoded,
+    ranked from the most to the least similar to the original one.
+
+    :query: Formatted query ('<address>, <city>, <province>, <country>').
+    :canonical: Formatted query of the address without leftover tokens.
+    :city: Name of the city of the canonical query.
+    :rules: RulePack object used to format the queries.
+
+    :return: List of alternative queries, without duplicates nor the original query.
+    """
+    def clean(x):
+        # Collapse spaces and drop connectors left alone at the ends ('cordoba y')
+        return re.sub(r"^y\s|\sy$", "", re.sub(r"\s+", " ", x).strip()).strip()
+
+    suffix = f", {city}{rules.suffix}"
+    address = clean(canonical[: -len(suffix)] if canonical.endswith(suffix) else canonical)
+
+    candidates = [address]
+
+    parts = [clean(x) for x in address.split(" y ")]
+    if len(parts) == 2 and all(parts):
+        # Swap the order of the streets of the intersection
+        candidates.append(f"{parts[1]} y {parts[0]}")
+    else:
+        # Drop the house number and the street type
+        candidates.append(clean(house_number.sub(" ", address)))
+        candidates.append(clean(street_type.sub(" ", address)))
+
+    queries = [x + suffix for x in candidates if x]
+
+    # Same address in the neighbouring cities
+    queries += [f"{address}, {x}{rules.suffix}" for x in rules.neighbours(city)]
+
+    return [x for x in dict.fromkeys(queries) if x != query]
+
+
+def retry_geocoder(
+    queries, canonicals, cities, functions, rules, cache, budget, logger, quota=None
+):
+    """
+    This function tries to geocode queries that failed using reformulated versions of them.
+    Reformulations already in the cache are tried first, since they are free, and then the rest
+    in order of rank. Each distinct query can make at most 'budget' calls to the services.
+
+    :queries: List of formatted queries that could not be geocoded.
+    :canonicals: List of formatted queries of the addresses without leftover tokens.
+    :cities: List of the cities of the canonical queries.
+    :functions: Dictionary with the name of each service as key and its geocoding function
+    as value, in order of preference. OpenCage is not used for intersections.
+    :rules: RulePack object used to format the queries.
+    :cache: GeocodeCache object.
+    :budget: Maximum number of calls to the services for each distinct query.
+    :logger: Logger for the queries that can not be geocoded.
+    :quota: Optional QuotaTracker object to count the calls to the services.
+
+    :return: List of tuples (result dictionary, service, reformulated query), in the same order
+    as the queries. Result is empty, and service and query are None, if nothing worked.
+    """
+    keys = list(zip(queries, canonicals, cities))
+    results = {}
+
+    for key in dict.fromkeys(keys):
+        attempts = []
+        for candidate in query_reformulator(*key, rules):
+            for provider, function in functions.items():
+                if provider == "opencage" and " y " in candidate:
+                    continue
+                attempts.append((provider, function, candidate))
+
+        # Cheapest first: cached attempts do not cost any call (the sort keeps the rank order)
+        attempts.sort(key=lambda x: cache.get(x[0], x[2]) is None)
+
+        results[key] = ({}, None, None)
+        calls = 0
+        for provider, function, candidate in attempts:
+            if cache.get(provider, candidate) is None:
+                if calls >= budget:
+                    break
+                calls += 1
+
+            result = query_geocoder(candidate, provider, function, cache, logger, quota)
+            if result.get("lat") is not None:
+                logger.debug(f"Address recovered: {key[0]} -> {candidate} ({provider})")
+                results[key] = (result, provider, candidate)
+                break
+
+    return [results[key] for key in keys]
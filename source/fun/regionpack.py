@@ -0,0 +1,127 @@
+import functools
+import json
+import os
+import shutil
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+from pyproj import CRS
+
+from fun.enrich import boundaries_loader, layers
+from fun.formatqueries import rules_loader
+from fun.streets import StreetIndex, street_vertices
+
+
+def region_builder(path, rules_path, streets_path=None, streets_field="nombre", boundaries=None):
+    """
+    This function builds a region pack: a folder with the rule file of the region and its local
+    files precompiled to binary formats (street vertices as NumPy arrays, boundary layers as
+    GeoParquet), so that loading the region does not parse nor project them again.
+
+    :path: Folder of the pack (created if it does not exist).
+    :rules_path: Path of the rule file of the region (cities, aliases, bounds, fallback points).
+    :streets_path: Optional path of the street centerline file.
+    :streets_field: Column with the name of each street.
+    :boundaries: Optional dictionary with the output column as key and (path, name field) as value.
+
+    :return: List of the files written.
+    """
+    path = Path(path)
+    os.makedirs(path, exist_ok=True)
+
+    shutil.copyfile(rules_path, path / "rules.json")
+    files = ["rules.json"]
+
+    if streets_path:
+        coords, names, offsets, crs = street_vertices(streets_path, streets_field)
+        np.save(path / "streets_coords.npy", np.ascontiguousarray(coords, dtype=np.float64))
+        np.save(path / "streets_offsets.npy", offsets)
+        with open(path / "streets.json", "w", encoding="utf-8") as f:
+            json.dump({"crs": crs.to_wkt(), "names": names}, f, ensure_ascii=False)
+        files += ["streets_coords.npy", "streets_offsets.npy", "streets.json"]
+
+    for column, (layer_path, field) in (boundaries or {}).items():
+        boundaries_loader(layer_path, field).to_parquet(path / f"{column}.parquet")
+        files.append(f"{column}.parquet")
+
+    return files
+
+
+class RegionPack:
+    """
+    Region pack built by region_builder. Each part (rules, streets, boundaries) is loaded the
+    first time it is used, and the street vertices are memory mapped: only the pages of the
+    streets that are queried are read from disk.
+    """
+
+    def __init__(self, path):
+        """
+        :path: Folder of the pack.
+        """
+        self.path = Path(path)
+        if not os.path.isfile(self.path / "rules.json"):
+            raise FileNotFoundError(f"Not a region pack: {self.path}")
+
+    @functools.cached_property
+    def rules(self):
+        """
+        RulePack object of the region.
+        """
+        return rules_loader(str(self.path / "rules.json"))
+
+    @functools.cached_property
+    def streets(self):
+        """
+        StreetIndex object of the region, None if the pack has no streets.
+        """
+        if not os.path.isfile(self.path / "streets.json"):
+            return None
+
+        with open(self.path / "streets.json", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        return StreetIndex(
+            np.load(self.path / "streets_coords.npy", mmap_mode="r"),
+            meta["names"],
+            np.load(self.path / "streets_offsets.npy"),
+            CRS.from_wkt(meta["crs"]),
+        )
+
+    @functools.cached_property
+    def boundaries(self):
+        """
+        Dictionary of boundary layers of the region (see boundaries_getter).
+        """
+        boundaries = {}
+        for column in layers:
+            if os.path.isfile(self.path / f"{column}.parquet"):
+                gdf = gpd.read_parquet(self.path / f"{column}.parquet")
+                # Build the spatial index now, once for every join
+                gdf.sindex
+                boundaries[column] = gdf
+
+        return boundaries
+
+
+@functools.lru_cache(maxsize=None)
+def region_loader(path):
+    """
+    This function opens a region pack. Packs are cached, so several regions can be used in the
+    same process and each one is opened once.
+
+    :path: Folder of the pack.
+
+    :return: RegionPack object.
+    """
+    return RegionPack(path)
+
+
+def region_getter():
+    """
+    This function opens the region pack set in the REGION_PATH environment variable.
+
+    :return: RegionPack object or None if no pack is set.
+    """
+    path = os.getenv("REGION_PATH")
+    return region_loader(str(Path(path).resolve())) if path else None
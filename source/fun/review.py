@@ -0,0 +1,209 @@
+import functools
+import webbrowser
+
+import folium
+import pyinputplus as pyip
+
+
+def map_plotter(df, ids_wrong):
+    """
+    This function plots every observation in passed dataframe into a Folium Map (interactive).
+    It prints in green every observation except for those that the user marks as wrongly geocoded.
+
+    :df: Dataframe with Latitude and Longitude column.
+    :ids_wrong: List of IDs of wrongly geocoded addresses.
+
+    :return: Folium Map (interactive).
+    """
+    # Create the map, centered on the observations (any region of the rule file)
+    map_geo = folium.Map(location=[df["lat"].mean(), df["lon"].mean()], zoom_start=12)
+
+    for index, row in df.iterrows():
+        popup = f"{row['id']}: {row['direccion_orig']}"
+
+        if not row["id"] in (ids_wrong):
+            color = "green"
+        elif row["id"] in (ids_wrong):
+            color = "red"
+        try:
+            folium.Marker(
+                location=[row["lat"], row["lon"]],
+                popup=popup,
+                icon=folium.Icon(color=color, icon_color="white"),
+            ).add_to(map_geo)
+        except Exception as e:
+            exception_text = f"Problema encontrado con {row['id']}"
+            raise Exception(exception_text)
+
+    return map_geo
+
+
+def ids_validator(id, len_id=None):
+    """
+    This function checks format of ID inputted by the user.
+
+    :id: String ID to check.
+    :len_id: Number of digits of the IDs (None to skip the check).
+
+    :return: Raise Exception or pass.
+    """
+    if id == "t":
+        return
+    elif len_id is not None and len(id) != len_id:
+        raise Exception(f"El id ingresado debe tener {len_id} caracteres numéricos")
+    try:
+        int(id)
+    except Exception as e:
+        raise Exception("El id ingresado debe tener solo caracteres numéricos")
+
+    return
+
+
+def ids_adder(list_ok, list_wrong):
+    """
+    This function ask the user to enter IDs of wrongly geocoded observations.
+
+    :list_ok: List of IDs present in plotted dataframe.
+    :list_wrong: List of wrongly geocoded observation's IDs into which append new ones.
+
+    :return: List of wrongly geocoded observation's Ids with new ones.
+    """
+    validator = functools.partial(ids_validator, len_id=len(str(list_ok[0])) if list_ok else None)
+
+    print()
+
+    response = ""
+
+    while response != "t":
+        print(
+            "Ingrese un ID para agregar a las direcciones erroneamente geocodificadas ('t' para terminar): "
+        )
+        while True:
+            try:
+                response = pyip.inputCustom(validator)
+                break
+            except KeyboardInterrupt:
+                continue
+        if response == "t":
+            break
+        response = int(response)
+        if response not in list_ok:
+            print(
+                "ID no presente entre las direcciones geocodificadas. Intente nuevamente. \n"
+            )
+            continue
+        elif response in list_ok:
+            if not response in list_wrong:
+                list_wrong.append(response)
+            print("ID aceptado \n")
+
+    return list_wrong
+
+
+def ids_remover(list_wrong):
+    """
+    This function ask the user to enter IDs of rightly geocoded observations present in wrong ones list.
+
+    :list_wrong: List of wrongly geocoded observation's IDs from which remove some.
+
+    :return: List of wrongly geocoded observation's Ids without removed ones.
+    """
+    validator = functools.partial(
+        ids_validator, len_id=len(str(list_wrong[0])) if list_wrong else None
+    )
+
+    response = ""
+
+    while response != "t":
+        print(
+            "Ingrese un ID a eliminar de las direcciones erroneamente geocodificadas ('t' para terminar): "
+        )
+        while True:
+            try:
+                response = pyip.inputCustom(validator)
+                break
+            except KeyboardInterrupt:
+                continue
+        if response == "t":
+            break
+        response = int(response)
+        if response not in list_wrong:
+            print(
+                "ID no presente entre las direcciones erroneamente geocodificadas. Intente nuevamente.\n"
+            )
+            continue
+        elif response in list_wrong:
+            list_wrong.remove(response)
+            print("ID aceptado \n")
+
+    return list_wrong
+
+
+def geo_checker(df, list_right, list_wrong, output_file):
+    """
+    This function provides some options to add or remove IDs to/from
+    the list of wrongly geocoded observation's IDs.
+    It acts as some kind of organizer of the three main functions to complete the task:
+        - map_plotter()
+        - ids_adder()
+        - ids_remover()
+    It displays interactive maps in the browser so that user can check if addresses were
+    rightly geocoded.
+
+    :df: Dataframe with geocoded observations with Latitude and Longitude columns.
+    :list_right: List of IDs present in the geocoded dataframe.
+    :list_wrong: List into which add or remove wrongly geocoded observation's IDs.
+    :output_file: Path of the HTML file of the map.
+
+    :return: List of wrongly geocoded observations Ids.
+    """
+
+    map_geo = map_plotter(df, list_wrong)
+    map_geo.save(output_file)
+    webbrowser.open(output_file, new=1)
+
+    list_wrong = ids_adder(list_right, list_wrong)
+
+    while True:
+        map_geo = map_plotter(df, list_wrong)
+        map_geo.save(output_file)
+        webbrowser.open(output_file, new=1)
+
+        response = pyip.inputYesNo(
+            prompt="¿Desea confirmar los cambios y continuar? ('si/no') \n",
+            yesVal="si",
+            noVal="no",
+        )
+
+        if response == "si":
+            print("Cambios confirmados. \n")
+            print()
+            break
+        elif response == "no":
+            response = pyip.inputMenu(
+                [
+                    "Agregar a las observaciones erroneamente geocodificadas un nuevo ID.",
+                    "Eliminar de las observaciones erroneamente geocodificadas un ID.",
+                    "Confirmar los cambios y continuar.",
+                ],
+                prompt="¿Qué modificaciones desea realizar? \n",
+                lettered=True,
+            )
+
+            print()
+
+            if (
+                response
+                == "Agregar a las observaciones erroneamente geocodificadas un nuevo ID."
+            ):
+                list_wrong = ids_adder(list_right, list_wrong)
+                continue
+            elif (
+                response
+                == "Eliminar de las observaciones erroneamente geocodificadas un ID."
+            ):
+                list_wrong = ids_remover(list_wrong)
+            elif response == "Confirmar los cambios y continuar.":
+                break
+
+    return list_wrong
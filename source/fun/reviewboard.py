@@ -0,0 +1,194 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from fun.archive import spatial_key
+
+# Columns of the rows sent to the reviewers (the ones shown on the map)
+review_columns = ["id", "direccion_orig", "lat", "lon"]
+
+
+def partitions_splitter(df, n_parts):
+    """
+    This function splits the rows to review into geographic partitions: rows are sorted by
+    spatial key (see spatial_key) and cut into chunks of similar size, so each reviewer gets a
+    compact area of the map.
+
+    :df: Dataframe with the rows to review (lat and lon columns).
+    :n_parts: Number of partitions.
+
+    :return: List of Index of the rows of each partition (without empty partitions).
+    """
+    order = spatial_key(df["lat"], df["lon"]).sort_values(na_position="last").index
+    return [x for x in np.array_split(order, max(n_parts, 1)) if len(x)]
+
+
+class ReviewBoard:
+    """
+    Shared board of review sessions, so that several reviewers (on the same or other machines)
+    can review the results of a stage at the same time. Each session is split into disjoint
+    partitions that reviewers take one at a time (for some time: a partition not finished in
+    time can be taken by another reviewer). The wrong IDs of the session are the union of the
+    decisions of every partition, so the merge has no conflicts.
+    The board is a SQLite database, which can live in a shared folder of the network.
+    """
+
+    def __init__(self, path, lease_seconds=3600):
+        """
+        :path: Path of the SQLite database file (created if it does not exist).
+        :lease_seconds: Time a reviewer has to finish a partition before it can be taken again.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (session TEXT PRIMARY KEY, digest TEXT);
+            CREATE TABLE IF NOT EXISTS partitions
+                (session TEXT, part INTEGER, rows TEXT, status TEXT, reviewer TEXT,
+                expires REAL, wrong TEXT, PRIMARY KEY (session, part));
+            """
+        )
+
+    def session_opener(self, session, df, n_parts):
+        """
+        This function opens a review session with the rows to review split into partitions.
+        A session already open with the same rows is kept as it is, so the decisions taken
+        before an interruption are not lost.
+
+        :session: Name of the session (e.g. '2023-01 opencage').
+        :df: Dataframe with the rows to review (review_columns).
+        :n_parts: Number of partitions.
+
+        :return: Number of partitions of the session.
+        """
+        digest = hashlib.sha1(
+            json.dumps(sorted(int(x) for x in df["id"])).encode("utf-8")
+        ).hexdigest()
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        row = self.conn.execute(
+            "SELECT digest FROM sessions WHERE session = ?", (session,)
+        ).fetchone()
+        if row is None or row[0] != digest:
+            self.conn.execute("DELETE FROM partitions WHERE session = ?", (session,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sessions (session, digest) VALUES (?, ?)",
+                (session, digest),
+            )
+            self.conn.executemany(
+                "INSERT INTO partitions (session, part, rows, status) VALUES (?, ?, ?, 'pending')",
+                [
+                    (session, part, df.loc[index, review_columns].to_json(orient="records"))
+                    for part, index in enumerate(partitions_splitter(df, n_parts), start=1)
+                ],
+            )
+        n_parts = self.conn.execute(
+            "SELECT COUNT(*) FROM partitions WHERE session = ?", (session,)
+        ).fetchone()[0]
+        self.conn.execute("COMMIT")
+
+        return n_parts
+
+    def partition_getter(self, reviewer, sessions=None):
+        """
+        This function reserves a partition for a reviewer: a pending partition or one whose
+        reviewer did not finish in time.
+
+        :reviewer: Name of the reviewer.
+        :sessions: Optional list of sessions to take partitions from (all if None).
+
+        :return: Tuple (session, part, dataframe with the rows of the partition) or None if there
+        are no partitions left.
+        """
+        now = time.time()
+        query = (
+            "SELECT session, part, rows FROM partitions "
+            "WHERE (status = 'pending' OR (status = 'leased' AND expires < ?))"
+        )
+        params = [now]
+        if sessions is not None:
+            query += f" AND session IN ({','.join('?' * len(sessions))})"
+            params += list(sessions)
+
+        # Take the write lock first, so two reviewers can not reserve the same partition
+        self.conn.execute("BEGIN IMMEDIATE")
+        row = self.conn.execute(query + " ORDER BY session, part LIMIT 1", params).fetchone()
+        if row is not None:
+            self.conn.execute(
+                "UPDATE partitions SET status = 'leased', reviewer = ?, expires = ? "
+                "WHERE session = ? AND part = ?",
+                (reviewer, now + self.lease_seconds, row[0], row[1]),
+            )
+        self.conn.execute("COMMIT")
+
+        if row is None:
+            return None
+        return row[0], row[1], pd.DataFrame(json.loads(row[2]), columns=review_columns)
+
+    def decisions_submitter(self, session, part, reviewer, ids_wrong):
+        """
+        This function stores the wrong IDs marked by a reviewer in a partition and marks it as
+        done. Decisions of a partition already done by another reviewer are discarded.
+
+        :session: Name of the session.
+        :part: Number of the partition.
+        :reviewer: Name of the reviewer.
+        :ids_wrong: List of IDs of the wrongly geocoded rows of the partition.
+
+        :return: True if the decisions were stored.
+        """
+        cursor = self.conn.execute(
+            "UPDATE partitions SET status = 'done', reviewer = ?, wrong = ? "
+            "WHERE session = ? AND part = ? AND status != 'done'",
+            (reviewer, json.dumps([int(x) for x in ids_wrong]), session, part),
+        )
+        return cursor.rowcount == 1
+
+    def partition_releaser(self, session, part):
+        """
+        This function returns an unfinished partition to the board (e.g. when the reviewer
+        leaves), so other reviewers can take it without waiting for it to expire.
+
+        :session: Name of the session.
+        :part: Number of the partition.
+        """
+        self.conn.execute(
+            "UPDATE partitions SET status = 'pending', reviewer = NULL, expires = NULL "
+            "WHERE session = ? AND part = ? AND status = 'leased'",
+            (session, part),
+        )
+
+    def progress(self, session):
+        """
+        This function counts the partitions of a session by status.
+
+        :session: Name of the session.
+
+        :return: Dictionary with the status as key and the number of partitions as value.
+        """
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*) FROM partitions WHERE session = ? GROUP BY status",
+            (session,),
+        )
+        return dict(rows.fetchall())
+
+    def wrong_getter(self, session):
+        """
+        This function merges the decisions of the partitions of a session.
+
+        :session: Name of the session.
+
+        :return: Sorted list of the wrong IDs of every partition done.
+        """
+        rows = self.conn.execute(
+            "SELECT wrong FROM partitions WHERE session = ? AND status = 'done'", (session,)
+        )
+        return sorted(set().union(*(json.loads(wrong) for wrong, in rows)))
+
+    def close(self):
+        self.conn.close()
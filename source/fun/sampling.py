@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# Columns that define the strata of the review: rows of the same service and type of address
+# are expected to have a similar error rate
+strata_columns = ["provider", "tipo_direccion"]
+
+
+def wilson_interval(errors, n, z=1.96):
+    """
+    This function computes the Wilson score interval of an error rate estimated from a sample.
+
+    :errors: Number of wrong rows in the sample.
+    :n: Size of the sample.
+    :z: Quantile of the normal distribution for the confidence level (1.96 for 95%).
+
+    :return: Tuple (lower bound, upper bound). (0, 1) if the sample is empty.
+    """
+    if n == 0:
+        return 0.0, 1.0
+
+    p = errors / n
+    center = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+    margin = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+
+    return max(float(center - margin), 0.0), min(float(center + margin), 1.0)
+
+
+def sample_selector(df, mask_full, sample_size, seed=0):
+    """
+    This function selects the rows to review in sampling mode: a random sample of each stratum,
+    plus every row of the strata smaller than the sample and every high risk row.
+
+    :df: Dataframe with the rows to review and the strata columns.
+    :mask_full: Boolean Series, True for high risk rows that are always reviewed (e.g. hotspots).
+    :sample_size: Rows to sample from each stratum.
+    :seed: Seed of the random sample, so that a review can be repeated.
+
+    :return: Index of the rows to review.
+    """
+    df_sampled = df.loc[~mask_full, strata_columns].astype(str)
+
+    index_sample = [df.index[mask_full]]
+    for _, df_stratum in df_sampled.groupby(strata_columns):
+        index_sample.append(
+            df_stratum.sample(n=min(sample_size, len(df_stratum.index)), random_state=seed).index
+        )
+
+    return df.index[df.index.isin(np.concatenate(index_sample))]
+
+
+def strata_evaluator(df, mask_full, index_sample, index_wrong, max_error):
+    """
+    This function estimates the error rate of each stratum from the reviewed sample and decides
+    which strata need a full review: the ones whose upper confidence bound exceeds the threshold.
+
+    :df: Dataframe with the rows to review and the strata columns.
+    :mask_full: Boolean Series, True for the high risk rows (reviewed in full, not estimated).
+    :index_sample: Index of the reviewed rows.
+    :index_wrong: Index of the rows marked as wrong by the reviewer.
+    :max_error: Maximum error rate accepted for the rows not reviewed.
+
+    :return: Dataframe with one row per stratum (rows, sample, errors, error rate and bounds,
+    escalated) + Index of the rows not reviewed of the escalated strata.
+    """
+    df_strata = df.loc[~mask_full, strata_columns].astype(str)
+    df_strata["sampled"] = df_strata.index.isin(index_sample)
+    df_strata["wrong"] = df_strata.index.isin(index_wrong)
+
+    report = df_strata.groupby(strata_columns).agg(
+        rows=("sampled", "size"), sample=("sampled", "sum"), errors=("wrong", "sum")
+    )
+    report["error_rate"] = report["errors"] / report["sample"]
+    bounds = [wilson_interval(e, n) for e, n in zip(report["errors"], report["sample"])]
+    report["lower"] = [x[0] for x in bounds]
+    report["upper"] = [x[1] for x in bounds]
+
+    # Strata reviewed in full are never escalated
+    report["escalated"] = (report["upper"] > max_error) & (report["sample"] < report["rows"])
+
+    escalated = report.index[report["escalated"]]
+    mask = ~df_strata["sampled"] & pd.MultiIndex.from_frame(df_strata[strata_columns]).isin(
+        escalated
+    )
+
+    return report.reset_index(), df_strata.index[mask]
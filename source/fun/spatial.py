@@ -0,0 +1,27 @@
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # Mean Earth radius in meters
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    This function computes the great circle distance in meters between pairs of points.
+    It works element-wise, so it accepts scalars as well as NumPy arrays or Pandas Series.
+
+    :lat1: Latitude of the first point(s) in degrees.
+    :lon1: Longitude of the first point(s) in degrees.
+    :lat2: Latitude of the second point(s) in degrees.
+    :lon2: Longitude of the second point(s) in degrees.
+
+    :return: Distance(s) in meters.
+    """
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(x, dtype="float64")) for x in (lat1, lon1, lat2, lon2)
+    )
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
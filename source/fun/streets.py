@@ -0,0 +1,217 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+
+from fun.corrections import query_normalizer
+
+# Street types removed from the names before matching them ('Bulevar Nicasio Oroño' ~ 'BV OROÑO')
+street_types = r"^(avenida|av|bulevar|boulevard|bv|calle|pasaje|pje|ruta nacional|ruta)\s+"
+
+
+def street_normalizer(s):
+    """
+    This function normalizes street names so that the names of the queries and the names of
+    the street file can be compared.
+
+    :s: Series of street names.
+
+    :return: Series of normalized names (without accents, punctuation nor street type).
+    """
+    return query_normalizer(s).str.replace(street_types, "", regex=True).str.strip()
+
+
+def street_vertices(path, field, spacing=10):
+    """
+    This function reads a street centerline file and densifies its streets, so that the distance
+    to the nearest vertex is close to the distance to the street. Vertices are sorted by street
+    name, so the vertices of each street are contiguous.
+
+    :path: Path of the street centerline file (GeoJSON, Shapefile, GeoPackage...).
+    :field: Column with the name of each street.
+    :spacing: Maximum distance in meters between the vertices of the densified streets.
+
+    :return: Array of (x, y) coordinates in meters + list of normalized street names + array of
+    offsets (vertices of names[i] are coords[offsets[i]:offsets[i + 1]]) + CRS of the coordinates
+    (UTM zone of the streets).
+    """
+    gdf = gpd.read_file(path)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=4326)
+
+    crs = gdf.estimate_utm_crs()
+    gdf = gdf.to_crs(crs)
+
+    coords, index = shapely.get_coordinates(
+        shapely.segmentize(gdf.geometry.values, spacing), return_index=True
+    )
+    names = street_normalizer(gdf[field].fillna("")).to_numpy()[index]
+
+    order = np.argsort(names, kind="stable")
+    names, positions = np.unique(names[order], return_index=True)
+    offsets = np.append(positions, len(order)).astype(np.int64)
+
+    return coords[order], names.tolist(), offsets, crs
+
+
+class StreetIndex:
+    """
+    KD-trees over the densified vertices of a street centerline file (see street_vertices). There
+    is a tree with every street and one tree for each street name, to check that a result is close
+    to the street of its address. Trees are built the first time they are needed, so vertices
+    mapped from a region pack are only read when used.
+    Distances are computed in meters, in the UTM zone of the streets.
+    """
+
+    def __init__(self, coords, names, offsets, crs):
+        """
+        :coords: Array of (x, y) coordinates in meters, sorted by street name (may be memory mapped).
+        :names: List of normalized street names.
+        :offsets: Array of offsets of the vertices of each name in coords.
+        :crs: CRS of the coordinates.
+        """
+        self.coords = coords
+        self.crs = crs
+        self.offsets = {
+            name: (int(offsets[i]), int(offsets[i + 1])) for i, name in enumerate(names) if name
+        }
+        self.tree = None
+        self.trees = {}
+        self.matches = {}
+
+    def name_tree(self, name):
+        """
+        This function gets the KD-tree of the vertices of a street name.
+
+        :name: Normalized street name of the file.
+
+        :return: cKDTree object.
+        """
+        if name not in self.trees:
+            start, end = self.offsets[name]
+            self.trees[name] = cKDTree(self.coords[start:end])
+
+        return self.trees[name]
+
+    def name_matcher(self, name):
+        """
+        This function finds the streets of the file that match a normalized street name: the same
+        name or, if there is none, names that end with it or that it ends with ('orono' and
+        'nicasio orono').
+
+        :name: Normalized street name.
+
+        :return: List of names of the file.
+        """
+        if name not in self.matches:
+            if name in self.offsets:
+                self.matches[name] = [name]
+            else:
+                self.matches[name] = [
+                    x for x in self.offsets if x.endswith(" " + name) or name.endswith(" " + x)
+                ]
+
+        return self.matches[name]
+
+    def points_projector(self, lat, lon):
+        """
+        This function projects coordinates to the CRS of the streets.
+
+        :lat: Series of Latitudes.
+        :lon: Series of Longitudes.
+
+        :return: Array of (x, y) coordinates in meters.
+        """
+        points = gpd.GeoSeries(
+            gpd.points_from_xy(lon.astype(float), lat.astype(float)), crs="EPSG:4326"
+        )
+        return shapely.get_coordinates(points.to_crs(self.crs).values)
+
+    def nearest_distance(self, lat, lon):
+        """
+        This function computes the distance of each point to the nearest street.
+
+        :lat: Series of Latitudes (without nulls).
+        :lon: Series of Longitudes (without nulls).
+
+        :return: Series of distances in meters.
+        """
+        if self.tree is None:
+            self.tree = cKDTree(self.coords)
+
+        distance, _ = self.tree.query(self.points_projector(lat, lon))
+        return pd.Series(distance, index=lat.index)
+
+    def named_distance(self, lat, lon, names):
+        """
+        This function computes the distance of each point to the nearest vertex of its street.
+
+        :lat: Series of Latitudes (without nulls).
+        :lon: Series of Longitudes (without nulls).
+        :names: Series of street names of each point.
+
+        :return: Series of distances in meters, null for streets not found in the file.
+        """
+        coords = self.points_projector(lat, lon)
+        names = street_normalizer(names.astype(str)).where(names.notnull())
+        distance = pd.Series(np.nan, index=lat.index)
+
+        # Points of the same street are queried together
+        for name, positions in pd.Series(range(len(names)), index=names.values).groupby(level=0):
+            matches = self.name_matcher(name)
+            if not matches:
+                continue
+            distance.iloc[positions.values] = np.min(
+                [self.name_tree(x).query(coords[positions.values])[0] for x in matches], axis=0
+            )
+
+        return distance
+
+
+def streets_getter(main_path):
+    """
+    This function loads the street centerline file configured in the environment variables.
+
+    :main_path: Working directory, base of the default path.
+
+    :return: StreetIndex object or None if the file does not exist.
+    """
+    path = os.getenv("STREETS_PATH") or main_path / "data/streets/calles.geojson"
+    if not os.path.isfile(path):
+        return None
+
+    return StreetIndex(*street_vertices(path, os.getenv("STREETS_FIELD") or "nombre"))
+
+
+def streets_checker(df, mask, streets, max_distance, max_named):
+    """
+    This function checks that the geocoded rows fall near a street and, for addresses with street
+    names, near the streets of the address (both of them for intersections). Places are not checked.
+    The distances are written in place in 'distancia_calle' and 'distancia_calle_nombre'.
+
+    :df: Working dataframe with lat, lon, calle, calle_cruce and tipo_direccion columns.
+    :mask: Boolean Series selecting the geocoded rows.
+    :streets: StreetIndex object.
+    :max_distance: Maximum distance in meters to the nearest street.
+    :max_named: Maximum distance in meters to the streets of the address.
+
+    :return: Boolean Series, True for suspicious rows (index of the selected rows).
+    """
+    mask_checked = mask & (df["tipo_direccion"] != "lugar")
+    lat, lon = df.loc[mask_checked, "lat"], df.loc[mask_checked, "lon"]
+
+    nearest = streets.nearest_distance(lat, lon)
+
+    named = streets.named_distance(lat, lon, df.loc[mask_checked, "calle"])
+    cross = df.loc[mask_checked, "calle_cruce"]
+    if cross.notnull().any():
+        named = np.fmax(named, streets.named_distance(lat, lon, cross))
+
+    df.loc[mask_checked, "distancia_calle"] = nearest.astype("float32")
+    df.loc[mask_checked, "distancia_calle_nombre"] = named.astype("float32")
+
+    flagged = (nearest > max_distance) | (named > max_named)
+    return flagged.reindex(df.index[mask], fill_value=False)
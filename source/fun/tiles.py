@@ -0,0 +1,284 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from fun.archive import archive_dataset, archive_reader
+
+# Pixels of a tile and of a cell of the grid of each tile (32 x 32 cells per tile)
+tile_size = 256
+cell_size = 8
+
+# Static page that shows the pyramid with Leaflet (tiles are read from the same folder)
+page = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>AVP geocodificados</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map { height: 100%; margin: 0; }
+#filter { position: absolute; top: 10px; right: 10px; z-index: 1000; background: white; padding: 6px; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="filter">Desde <select id="start"></select> hasta <select id="end"></select></div>
+<script>
+fetch("index.json").then(r => r.json()).then(index => {
+  const start = document.getElementById("start"), end = document.getElementById("end");
+  index.months.forEach(m => { start.add(new Option(m, m)); end.add(new Option(m, m)); });
+  end.selectedIndex = index.months.length - 1;
+
+  const map = L.map("map").setView(index.center, index.min_zoom + 2);
+  L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+    attribution: "&copy; OpenStreetMap", maxZoom: 19
+  }).addTo(map);
+
+  const Bins = L.GridLayer.extend({
+    createTile: function (coords, done) {
+      const tile = document.createElement("canvas");
+      tile.width = tile.height = index.tile_size;
+      fetch(`${coords.z}/${coords.x}/${coords.y}.json`)
+        .then(r => r.ok ? r.json() : {months: {}})
+        .then(data => {
+          const counts = {};
+          for (const [month, cells] of Object.entries(data.months)) {
+            if (month < start.value || month > end.value) continue;
+            for (const [i, j, n] of cells) counts[i + "," + j] = (counts[i + "," + j] || 0) + n;
+          }
+          const ctx = tile.getContext("2d"), top = Math.log(1 + index.max_count[coords.z]);
+          for (const [key, n] of Object.entries(counts)) {
+            const [i, j] = key.split(",").map(Number), v = Math.min(Math.log(1 + n) / top, 1);
+            ctx.fillStyle = `hsla(${60 - 60 * v}, 100%, 50%, ${0.35 + 0.5 * v})`;
+            ctx.fillRect(i * index.cell_size, j * index.cell_size, index.cell_size, index.cell_size);
+          }
+          done(null, tile);
+        });
+      return tile;
+    }
+  });
+  const bins = new Bins({minZoom: index.min_zoom, maxNativeZoom: index.max_zoom, maxZoom: 19});
+  bins.addTo(map);
+  [start, end].forEach(x => x.addEventListener("change", () => bins.redraw()));
+});
+</script>
+</body>
+</html>
+"""
+
+
+def zooms_parser(value):
+    """
+    This function reads the zoom levels of the pyramid from a setting.
+
+    :value: Text with the first and the last zoom level ('10-16'), a single level ('12') or empty.
+
+    :return: List with the first and the last zoom level (empty if the setting is empty).
+    """
+    zooms = [int(x) for x in value.split("-") if x.strip()]
+    if len(zooms) == 1:
+        return zooms * 2
+
+    return zooms[:2]
+
+
+def month_max_reader(path, period):
+    """
+    This function finds the largest count of a cell of a month at each zoom level, from the tiles
+    where the month has points (for pyramids built before the maximum of each month was kept).
+
+    :path: Folder of the pyramid.
+    :period: Month ('aaaa-mm').
+
+    :return: Dictionary with the zoom level (as text) as key and the largest count as value.
+    """
+    month_file = os.path.join(path, "months", f"{period}.json")
+    if not os.path.isfile(month_file):
+        return {}
+    with open(month_file, encoding="utf-8") as f:
+        keys = [tuple(x) for x in json.load(f)]
+
+    month_max = {}
+    for key in keys:
+        tile_file = os.path.join(path, *(str(v) for v in key)) + ".json"
+        if not os.path.isfile(tile_file):
+            continue
+        with open(tile_file, encoding="utf-8") as f:
+            cells = json.load(f)["months"].get(period, [])
+        if cells:
+            zoom = str(key[0])
+            month_max[zoom] = max(month_max.get(zoom, 0), max(n for _, _, n in cells))
+
+    return month_max
+
+
+def cells_counter(lat, lon, zoom):
+    """
+    This function counts the points of each cell of the tile grid of a zoom level (Web Mercator
+    tiles, as the ones of the base map, each one split into 32 x 32 cells).
+
+    :lat: Series of Latitudes (without nulls).
+    :lon: Series of Longitudes (without nulls).
+    :zoom: Zoom level.
+
+    :return: Dataframe with tile (x, y), cell of the tile (i, j) and n (number of points) columns.
+    """
+    lat = np.clip(lat.to_numpy(dtype=float), -85.0511, 85.0511)
+    lon = lon.to_numpy(dtype=float)
+    scale = tile_size * 2**zoom
+
+    # Global pixel coordinates of the points, and global cell of each one
+    px = (lon + 180) / 360 * scale
+    py = (1 - np.log(np.tan(np.radians(lat)) + 1 / np.cos(np.radians(lat))) / np.pi) / 2 * scale
+    cx = (px // cell_size).astype(np.int64)
+    cy = (py // cell_size).astype(np.int64)
+
+    cells, n = np.unique(np.stack([cx, cy], axis=1), axis=0, return_counts=True)
+    per_tile = tile_size // cell_size
+
+    return pd.DataFrame(
+        {
+            "x": cells[:, 0] // per_tile,
+            "y": cells[:, 1] // per_tile,
+            "i": cells[:, 0] % per_tile,
+            "j": cells[:, 1] % per_tile,
+            "n": n,
+        }
+    )
+
+
+def tiles_updater(df, path, period, min_zoom=10, max_zoom=16):
+    """
+    This function adds (or replaces) the points of a month in the tile pyramid: a JSON file for
+    each tile and zoom level ('<path>/<z>/<x>/<y>.json') with the count of points of each cell
+    of the tile by month. Only the tiles of the month (the new ones and the ones it had before)
+    are rewritten, so adding a month does not rebuild the pyramid.
+
+    :df: Dataframe with the results of the month (lat and lon columns).
+    :path: Folder of the pyramid.
+    :period: Month of the results ('aaaa-mm').
+    :min_zoom: First zoom level of the pyramid.
+    :max_zoom: Last zoom level of the pyramid.
+
+    :return: Number of tiles written.
+    """
+    lat = pd.to_numeric(df["lat"], errors="coerce")
+    lon = pd.to_numeric(df["lon"], errors="coerce")
+    mask = lat.notnull() & lon.notnull()
+    lat, lon = lat[mask], lon[mask]
+
+    # Tiles where the month had points in a previous run
+    months_path = os.path.join(path, "months")
+    os.makedirs(months_path, exist_ok=True)
+    month_file = os.path.join(months_path, f"{period}.json")
+    previous = set()
+    if os.path.isfile(month_file):
+        with open(month_file, encoding="utf-8") as f:
+            previous = {tuple(x) for x in json.load(f)}
+
+    index = {"months": [], "max_count": {}, "month_max": {}}
+    if os.path.isfile(os.path.join(path, "index.json")):
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as f:
+            index = json.load(f)
+
+    # Largest counts of the other months, read from their tiles if the index does not have them
+    month_max = index.get("month_max", {})
+    for other in index["months"]:
+        if other != period and other not in month_max:
+            month_max[other] = month_max_reader(path, other)
+    month_max[period] = {}
+
+    current = set()
+    n_written = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        df_cells = cells_counter(lat, lon, zoom)
+
+        tiles = {
+            (zoom, int(x), int(y)): group[["i", "j", "n"]].to_numpy().tolist()
+            for (x, y), group in df_cells.groupby(["x", "y"])
+        }
+        current |= set(tiles)
+
+        for key in set(tiles) | {x for x in previous if x[0] == zoom}:
+            tile_file = os.path.join(path, *(str(v) for v in key)) + ".json"
+            data = {"months": {}}
+            if os.path.isfile(tile_file):
+                with open(tile_file, encoding="utf-8") as f:
+                    data = json.load(f)
+
+            data["months"].pop(period, None)
+            if key in tiles:
+                data["months"][period] = tiles[key]
+
+            if data["months"]:
+                os.makedirs(os.path.dirname(tile_file), exist_ok=True)
+                with open(tile_file, "w", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+            elif os.path.isfile(tile_file):
+                os.remove(tile_file)
+            n_written += 1
+
+        if len(df_cells.index):
+            month_max[period][str(zoom)] = int(df_cells["n"].max())
+
+    with open(month_file, "w", encoding="utf-8") as f:
+        json.dump(sorted(current), f)
+
+    # Largest count of a cell of one month at each zoom level, to scale the colors (computed
+    # again from every month, so a month replaced with fewer points lowers it)
+    index["month_max"] = month_max
+    index["max_count"] = {}
+    for counts in month_max.values():
+        for zoom, n in counts.items():
+            index["max_count"][zoom] = max(index["max_count"].get(zoom, 0), n)
+
+    index["months"] = sorted(set(index["months"]) | {period})
+    index["min_zoom"] = min_zoom
+    index["max_zoom"] = max_zoom
+    index["tile_size"] = tile_size
+    index["cell_size"] = cell_size
+    if len(lat.index):
+        index["center"] = [float(lat.median()), float(lon.median())]
+    with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    with open(os.path.join(path, "index.html"), "w", encoding="utf-8") as f:
+        f.write(page)
+
+    return n_written
+
+
+def archive_tiler(archive_path, path, min_zoom=10, max_zoom=16):
+    """
+    This function builds the tile pyramid with every month of the archive, e.g. to start it
+    with the months geocoded before it existed.
+
+    :archive_path: Folder of the archive (see archive_writer).
+    :path: Folder of the pyramid.
+    :min_zoom: First zoom level of the pyramid.
+    :max_zoom: Last zoom level of the pyramid.
+
+    :return: List of the months added.
+    """
+    dataset = archive_dataset(archive_path)
+    if dataset is None:
+        return []
+
+    periods = (
+        dataset.to_table(columns=["year", "month"])
+        .to_pandas()
+        .drop_duplicates()
+        .sort_values(["year", "month"])
+    )
+
+    months = []
+    for year, month in zip(periods["year"], periods["month"]):
+        df = archive_reader(archive_path, (year, month), (year, month), columns=["lat", "lon"])
+        period = f"{year}-{month:02d}"
+        tiles_updater(df, path, period, min_zoom, max_zoom)
+        months.append(period)
+
+    return months
@@ -0,0 +1,30 @@
+import pandas as pd
+
+from fun.spatial import haversine
+
+
+def agreement_checker(df_1, df_2, tolerance):
+    """
+    This function compares the coordinates that two geocoding services returned for the same
+    observations. When both results are close enough, the observation is considered rightly
+    geocoded without manual review.
+
+    :df_1: Dataframe with lat and lon columns from the first service.
+    :df_2: Dataframe with lat and lon columns from the second service (same index as df_1).
+    :tolerance: Maximum distance in meters to consider that both services agree.
+    Either a number or a Series aligned with df_1 (e.g. tolerance of the city of each observation).
+
+    :return: Boolean Series, True for observations where both services agree + Series with the
+    distance in meters between both results (null if any of them is missing).
+    """
+    df_2 = df_2.reindex(df_1.index)
+
+    distance = pd.Series(
+        haversine(df_1["lat"], df_1["lon"], df_2["lat"], df_2["lon"]),
+        index=df_1.index,
+        name="provider_distance",
+    )
+
+    mask = distance <= tolerance
+
+    return mask, distance
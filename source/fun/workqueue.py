@@ -0,0 +1,221 @@
+import json
+import sqlite3
+import time
+import uuid
+
+
+class WorkQueue:
+    """
+    Shared queue of geocoding jobs, so that workers on several machines (each one with its
+    own credentials and quotas) can geocode the distinct queries of a dataset together.
+    Jobs are keyed by provider, rules version and query. Workers take them in leases (batches
+    reserved for some time): a lease that is not finished in time returns to the queue, until the
+    job was leased a maximum number of times and is marked as failed.
+    The first result submitted for a job is the one kept, so every query is stored exactly once
+    in the results table, even if two workers end up geocoding it.
+    The queue is a SQLite database, which can live in a shared folder of the network.
+    """
+
+    def __init__(self, path, version="", lease_seconds=900, max_attempts=3):
+        """
+        :path: Path of the SQLite database file (created if it does not exist).
+        :version: Version of the rules used to build the queries (see RulePack).
+        :lease_seconds: Time a worker has to finish a lease before its jobs return to the queue.
+        :max_attempts: Times a job is leased before it is marked as failed.
+        """
+        self.path = path
+        self.version = version
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs
+                (provider TEXT, version TEXT, query TEXT, address TEXT, priority INTEGER,
+                status TEXT, lease TEXT, worker TEXT, expires REAL, attempts INTEGER DEFAULT 0,
+                PRIMARY KEY (provider, version, query));
+            CREATE TABLE IF NOT EXISTS results
+                (provider TEXT, version TEXT, query TEXT, result TEXT, worker TEXT,
+                PRIMARY KEY (provider, version, query));
+            """
+        )
+
+        # Queues created before the jobs could fail have no attempts column
+        columns = [x[1] for x in self.conn.execute("PRAGMA table_info(jobs)")]
+        if "attempts" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+
+    def jobs_adder(self, provider, queries, addresses=None):
+        """
+        This function adds jobs to the queue. Queries already queued (or done) are ignored,
+        and the most repeated queries get the highest priority.
+
+        :provider: Name of the geocoding service.
+        :queries: List of address queries (may contain duplicates).
+        :addresses: Optional dictionary with the query as key and the structured address
+        to send to the service as value.
+
+        :return: Number of new jobs.
+        """
+        addresses = addresses or {}
+        priority = {}
+        for query in queries:
+            priority[query] = priority.get(query, 0) + 1
+
+        rows = [
+            (
+                provider,
+                self.version,
+                query,
+                json.dumps(addresses[query]) if query in addresses else None,
+                n,
+            )
+            for query, n in priority.items()
+        ]
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        before = self.conn.total_changes
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO jobs (provider, version, query, address, priority, status) "
+            "VALUES (?, ?, ?, ?, ?, 'pending')",
+            rows,
+        )
+        n_new = self.conn.total_changes - before
+        self.conn.execute("COMMIT")
+
+        return n_new
+
+    def lease_getter(self, worker, providers, size=50):
+        """
+        This function reserves a batch of jobs for a worker: pending jobs and jobs of expired
+        leases, most repeated queries first. Jobs of expired leases that were already leased the
+        maximum number of times are marked as failed instead.
+
+        :worker: Name of the worker.
+        :providers: List of the services the worker can call.
+        :size: Maximum number of jobs of the lease.
+
+        :return: Lease id and list of (provider, query, structured address or None) tuples.
+        Empty list if there are no jobs left.
+        """
+        lease = uuid.uuid4().hex
+        now = time.time()
+        placeholders = ",".join("?" * len(providers))
+
+        # Take the write lock first, so two workers can not reserve the same jobs
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute(
+            "UPDATE jobs SET status = 'failed', lease = NULL, expires = NULL "
+            "WHERE version = ? AND status = 'leased' AND expires < ? AND attempts >= ?",
+            (self.version, now, self.max_attempts),
+        )
+        rows = self.conn.execute(
+            "SELECT provider, query, address FROM jobs "
+            f"WHERE version = ? AND provider IN ({placeholders}) "
+            "AND (status = 'pending' OR (status = 'leased' AND expires < ?)) "
+            "ORDER BY priority DESC LIMIT ?",
+            (self.version, *providers, now, size),
+        ).fetchall()
+        self.conn.executemany(
+            "UPDATE jobs SET status = 'leased', lease = ?, worker = ?, expires = ?, "
+            "attempts = attempts + 1 WHERE provider = ? AND version = ? AND query = ?",
+            [
+                (lease, worker, now + self.lease_seconds, provider, self.version, query)
+                for provider, query, _ in rows
+            ],
+        )
+        self.conn.execute("COMMIT")
+
+        jobs = [
+            (provider, query, json.loads(address) if address else None)
+            for provider, query, address in rows
+        ]
+        return lease, jobs
+
+    def results_submitter(self, worker, results):
+        """
+        This function stores the results of a worker and marks their jobs as done. Results of
+        jobs already done by another worker are discarded.
+
+        :worker: Name of the worker.
+        :results: List of (provider, query, result dictionary) tuples.
+
+        :return: Number of results stored.
+        """
+        n_stored = 0
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        for provider, query, result in results:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'done', worker = ? "
+                "WHERE provider = ? AND version = ? AND query = ? AND status != 'done'",
+                (worker, provider, self.version, query),
+            )
+            if cursor.rowcount == 1:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO results (provider, version, query, result, worker) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (provider, self.version, query, json.dumps(result), worker),
+                )
+                n_stored += 1
+        self.conn.execute("COMMIT")
+
+        return n_stored
+
+    def lease_releaser(self, lease):
+        """
+        This function returns the unfinished jobs of a lease to the queue (e.g. when the worker
+        ran out of quota), so other workers can take them without waiting for the lease to expire.
+        The lease does not count as an attempt of its jobs.
+
+        :lease: Lease id.
+        """
+        self.conn.execute(
+            "UPDATE jobs SET status = 'pending', lease = NULL, worker = NULL, expires = NULL, "
+            "attempts = MAX(attempts - 1, 0) WHERE lease = ? AND status = 'leased'",
+            (lease,),
+        )
+
+    def results_getter(self, provider):
+        """
+        This function gets the results submitted by the workers for a service.
+
+        :provider: Name of the geocoding service.
+
+        :return: Dictionary with the query as key and the result dictionary as value.
+        """
+        rows = self.conn.execute(
+            "SELECT query, result FROM results WHERE provider = ? AND version = ?",
+            (provider, self.version),
+        )
+        return {query: json.loads(result) for query, result in rows}
+
+    def failed_getter(self, provider):
+        """
+        This function gets the jobs of a service that failed in every attempt.
+
+        :provider: Name of the geocoding service.
+
+        :return: List of queries.
+        """
+        rows = self.conn.execute(
+            "SELECT query FROM jobs WHERE provider = ? AND version = ? AND status = 'failed'",
+            (provider, self.version),
+        )
+        return [query for (query,) in rows]
+
+    def progress(self):
+        """
+        This function counts the jobs of the queue by service and status.
+
+        :return: Dictionary with (provider, status) as key and the number of jobs as value.
+        """
+        rows = self.conn.execute(
+            "SELECT provider, status, COUNT(*) FROM jobs WHERE version = ? "
+            "GROUP BY provider, status",
+            (self.version,),
+        )
+        return {(provider, status): n for provider, status, n in rows}
+
+    def close(self):
+        self.conn.close()
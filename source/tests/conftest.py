@@ -0,0 +1,31 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+# The modules are imported as the programs do ('from fun.x import ...'), from the source folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def geocode(*args, **kwargs):
+    raise RuntimeError("The Esri client is not installed")
+
+
+class RateLimitExceededError(Exception):
+    pass
+
+
+# The tests never call the paid services: when their clients are not installed, modules with the
+# names imported by fun.geocoders take their place
+stubs = {
+    "arcgis": {},
+    "arcgis.geocoding": {"geocode": geocode},
+    "opencage": {},
+    "opencage.geocoder": {"RateLimitExceededError": RateLimitExceededError},
+}
+missing = {x for x in ["arcgis", "opencage"] if importlib.util.find_spec(x) is None}
+for name, attributes in stubs.items():
+    if name.split(".")[0] in missing:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
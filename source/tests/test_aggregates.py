@@ -0,0 +1,34 @@
+import pandas as pd
+
+from fun.aggregates import AggregateStore, cells_labeler
+
+
+def test_cells_labeler():
+    labels = cells_labeler(pd.Series([-32.9401, None]), pd.Series([-60.6401, -60.6]), 0.005)
+
+    assert labels[0] == "-32.94250,-60.64250"
+    assert pd.isnull(labels[1])
+
+
+def test_month_replaced(tmp_path):
+    store = AggregateStore(tmp_path / "aggregates.sqlite")
+    df = pd.DataFrame({"barrio": ["Centro", "Centro", None], "genero": ["f", "m", "f"]})
+
+    store.month_updater(df, "2023-01", ["barrio", "distrito"], ["genero", "edad"])
+    store.month_updater(df.head(1), "2023-02", ["barrio"], ["genero"])
+
+    totals = store.totals_getter("total")
+    assert totals[["period", "n"]].values.tolist() == [["2023-01", 3], ["2023-02", 1]]
+    by_value = store.totals_getter("barrio", "genero", start="2023-01", end="2023-01")
+    assert by_value[["area", "value", "n"]].values.tolist() == [
+        ["", "f", 1],
+        ["Centro", "f", 1],
+        ["Centro", "m", 1],
+    ]
+
+    # A new run of a month replaces its counts and leaves the other months as they are
+    store.month_updater(df.head(2), "2023-01", ["barrio"], ["genero"])
+    totals = store.totals_getter("total")
+    assert totals[["period", "n"]].values.tolist() == [["2023-01", 2], ["2023-02", 1]]
+    assert store.totals_getter("barrio", start="2023-01", end="2023-01")["n"].tolist() == [2]
+    store.close()
@@ -0,0 +1,77 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fun.archive import archive_reader, archive_writer, cache_warmer
+from fun.geocache import GeocodeCache
+
+
+def month_builder(month, queries):
+    """
+    This function builds the results of a month, as avp-geocode writes them.
+
+    :month: Month of the results (mm).
+    :queries: List of formatted queries.
+
+    :return: Dataframe with the results.
+    """
+    n = len(queries)
+    return pd.DataFrame(
+        {
+            "id": [int(f"2023{month}{i:06d}") for i in range(1, n + 1)],
+            "fecha_ingreso": pd.to_datetime([f"2023-{month}-01"] * n),
+            "direccion_avp": queries,
+            "provider": ["opencage"] * n,
+            "lat": [-32.94 - i / 1000 for i in range(n)],
+            "lon": [-60.64 - i / 1000 for i in range(n)],
+            "score": [9.0] * n,
+            "match_type": ["road"] * n,
+            "bbox_size": [250.0] * n,
+            "direccion_reformulada": [None] * n,
+        }
+    )
+
+
+def test_incremental_month(tmp_path):
+    archive_path = tmp_path / "archive"
+    archive_writer(month_builder("01", ["a", "b"]), archive_path, "2023", "01", "v1")
+
+    # A re-run of a month joins the unchanged rows of the previous results with the new ones
+    df_prev = month_builder("02", ["c", "d"])
+    df_new = month_builder("02", ["e"]).assign(id=202302000003)
+    df = pd.concat([df_prev, df_new.astype(object)], ignore_index=True).sort_values("id")
+    archive_writer(df, archive_path, "2023", "02", "v1")
+
+    df_read = archive_reader(archive_path)
+    assert len(df_read.index) == 5
+    assert pd.api.types.is_datetime64_any_dtype(df_read["fecha_ingreso"])
+    assert df_read.loc[df_read["direccion_avp"] == "e", "lat"].iloc[0] == -32.94
+
+    cache = GeocodeCache(tmp_path / "geocodes.sqlite", "v1")
+    assert cache_warmer(archive_path, cache, ["a", "e", "z"]) == 2
+    assert cache.get("opencage", "e")["lat"] == -32.94
+    cache.close()
+
+
+def test_month_with_text_dates(tmp_path):
+    archive_path = tmp_path / "archive"
+    archive_writer(month_builder("01", ["a"]), archive_path, "2023", "01", "v1")
+
+    # Month written with the dates as text, as earlier versions did for re-runs
+    table = pa.Table.from_pandas(
+        month_builder("02", ["b"]).assign(
+            fecha_ingreso="2023-02-01 00:00:00", version="v1"
+        ),
+        preserve_index=False,
+    )
+    table = table.cast(table.schema.set(1, pa.field("fecha_ingreso", pa.large_string())))
+    (archive_path / "year=2023" / "month=2").mkdir(parents=True)
+    pq.write_table(table, archive_path / "year=2023" / "month=2" / "part-0.parquet")
+
+    df_read = archive_reader(archive_path)
+    assert len(df_read.index) == 2
+    assert pd.api.types.is_datetime64_any_dtype(df_read["fecha_ingreso"])
+
+    cache = GeocodeCache(tmp_path / "geocodes.sqlite", "v1")
+    assert cache_warmer(archive_path, cache, ["a", "b"]) == 2
+    cache.close()
@@ -0,0 +1,83 @@
+import os
+
+import pandas as pd
+
+from fun.corrections import CorrectionStore
+from fun.geocache import GeocodeCache
+
+
+def results_writer(path, rows):
+    """
+    This function writes a results file with the columns read by results_learner.
+
+    :path: Path of the file.
+    :rows: List of (direccion_orig, direccion_avp, provider, lat, lon) tuples.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(
+        rows, columns=["direccion_orig", "direccion_avp", "provider", "lat", "lon"]
+    ).to_excel(path, index=False)
+
+
+def test_results_learner(tmp_path):
+    cache = GeocodeCache(tmp_path / "geocodes.sqlite", "v1")
+    cache.set("opencage", "Oroño 1200, Rosario", {"lat": -32.94, "lon": -60.64})
+    cache.set("esri", "Mitre 200, Rosario", {"lat": -32.95, "lon": -60.65})
+
+    results_writer(
+        tmp_path / "results" / "2023" / "2023-01_AVP-geocoded.xlsx",
+        [
+            ("cordoba 1500", "Cordoba 1500, Rosario", None, -32.96, -60.66),
+            ("oroño 1200", "Oroño 1200, Rosario", "opencage", -32.94, -60.64),
+            ("mitre 200", "Mitre 200, Rosario", "esri", -32.90, -60.60),
+            ("sin coordenadas", "Sin coordenadas, Rosario", None, None, None),
+        ],
+    )
+    store = CorrectionStore(tmp_path / "corrections.sqlite", "v1")
+
+    # The row filled by hand and the one whose Esri result was edited
+    assert store.results_learner(tmp_path / "results", cache) == 2
+    assert store.corrections == {"cordoba 1500": (-32.96, -60.66), "mitre 200": (-32.90, -60.60)}
+
+    # Files already read are skipped
+    assert store.results_learner(tmp_path / "results", cache) == 0
+    store.close()
+    cache.close()
+
+
+def test_manual_edited_again(tmp_path):
+    path = tmp_path / "results" / "2023" / "2023-02_AVP-geocoded.xlsx"
+    store = CorrectionStore(tmp_path / "corrections.sqlite", "v1")
+    store.corrections_adder(["cordoba 1500"], [-32.96], [-60.66], "2023-01_AVP-geocoded.xlsx")
+
+    # The correction was applied, and the reviewer moved it again
+    results_writer(path, [("cordoba 1500", "Cordoba 1500, Rosario", "manual", -32.96, -60.66)])
+    assert store.results_learner(tmp_path / "results") == 0
+
+    results_writer(path, [("cordoba 1500", "Cordoba 1500, Rosario", "manual", -32.97, -60.67)])
+    os.utime(path, (0, os.path.getmtime(path) + 10))
+    assert store.results_learner(tmp_path / "results") == 1
+    store.close()
+
+    store = CorrectionStore(tmp_path / "corrections.sqlite", "v1")
+    assert store.corrections["cordoba 1500"] == (-32.97, -60.67)
+    store.close()
+
+
+def test_rejections_by_version(tmp_path):
+    queries = pd.Series(["oroño 1200", "mitre 200"])
+
+    store = CorrectionStore(tmp_path / "corrections.sqlite", "v1")
+    store.rejections_adder(["oroño 1200"], "opencage")
+    assert store.rejected(queries, "opencage").tolist() == [True, False]
+    assert not store.rejected(queries, "esri").any()
+    store.close()
+
+    # Kept for the same rules, asked again with other rules
+    store = CorrectionStore(tmp_path / "corrections.sqlite", "v1")
+    assert store.rejected(queries, "opencage").tolist() == [True, False]
+    store.close()
+
+    store = CorrectionStore(tmp_path / "corrections.sqlite", "v2")
+    assert not store.rejected(queries, "opencage").any()
+    store.close()
@@ -0,0 +1,53 @@
+import multiprocessing
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fun.formatqueries as fq
+from fun.formatqueries import queries_formatter, rules_loader
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return rules_loader()
+
+
+@pytest.fixture
+def addresses():
+    streets = [
+        "oroño {}",
+        "funes - san martin {}",
+        "vgg - mitre {}",
+        "cordoba y {} de mayo",
+        "av 27 de feb {}",
+        "monumento a la bandera",
+        "Pellegrini {}, Rosario",
+    ]
+    values = [x.format(n) for n in range(100, 1300, 100) for x in streets]
+    values[3] = np.nan
+    values[10] = ""
+    return pd.DataFrame({"id": range(len(values)), "direccion_avp": values})
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn"])
+def test_shards_match_serial(rules, addresses, monkeypatch, method):
+    if method not in multiprocessing.get_all_start_methods():
+        pytest.skip(f"{method} is not available")
+
+    expected = queries_formatter(addresses.copy(), rules)
+
+    # Shard even small inputs, with the start method of the test (spawn is allowed in frozen builds)
+    monkeypatch.setattr(fq, "shard_min_rows", 10)
+    monkeypatch.setattr(fq.multiprocessing, "get_all_start_methods", lambda: [method])
+    monkeypatch.setattr(fq, "sys", types.SimpleNamespace(frozen=True))
+    calls = []
+    shards_formatter = fq.shards_formatter
+    monkeypatch.setattr(
+        fq, "shards_formatter", lambda *args: calls.append(args) or shards_formatter(*args)
+    )
+    result = queries_formatter(addresses.copy(), rules, workers=3)
+
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(result, expected)
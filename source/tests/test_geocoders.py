@@ -0,0 +1,144 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+from fun.geocache import GeocodeCache
+from fun.geocoders import checks_estimator, osm_geocoder, results_remover
+
+# Answers of the stub server for each path: one Nominatim match and one Photon feature
+answers = {
+    "/search": [
+        {
+            "lat": "-32.9442",
+            "lon": "-60.6505",
+            "importance": 0.42,
+            "boundingbox": ["-32.9443", "-32.9441", "-60.6506", "-60.6504"],
+            "addresstype": "building",
+            "address": {"house_number": "1200", "road": "Bulevar Nicasio Oroño"},
+        }
+    ],
+    "/api": {
+        "features": [
+            {
+                "geometry": {"coordinates": [-60.6505, -32.9442]},
+                "properties": {"type": "street", "extent": [-60.66, -32.94, -60.64, -32.95]},
+            }
+        ]
+    },
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Nominatim and Photon server that answers every query with a fixed result and keeps the
+    parameters of the requests.
+    """
+
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        StubHandler.requests.append((url.path, parse_qs(url.query)))
+
+        if url.path not in answers:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = json.dumps(answers[url.path]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StubHandler.requests = []
+    httpd = HTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_nominatim(server):
+    bounds = (-60.8, -33.1, -60.5, -32.8)
+    with requests.Session() as session:
+        result = osm_geocoder(session, server, "Oroño 1200, Rosario", bounds=bounds)
+
+    assert result["lat"] == pytest.approx(-32.9442)
+    assert result["lon"] == pytest.approx(-60.6505)
+    assert result["score"] == pytest.approx(0.42)
+    assert result["match_type"] == "house"
+    assert 0 < result["bbox_size"] < 50
+
+    path, params = StubHandler.requests[0]
+    assert path == "/search"
+    assert params["q"] == ["Oroño 1200, Rosario"]
+    assert params["viewbox"] == [",".join(str(v) for v in bounds)]
+    assert params["bounded"] == ["1"]
+
+
+def test_photon(server):
+    with requests.Session() as session:
+        result = osm_geocoder(
+            session, server, "Oroño, Rosario", engine="photon", proximity=(-32.95, -60.65)
+        )
+
+    assert result["lat"] == pytest.approx(-32.9442)
+    assert result["lon"] == pytest.approx(-60.6505)
+    assert np.isnan(result["score"])
+    assert result["match_type"] == "street"
+    assert result["bbox_size"] > 1000
+
+    path, params = StubHandler.requests[0]
+    assert path == "/api"
+    assert params["lat"] == ["-32.95"]
+    assert params["lon"] == ["-60.65"]
+
+
+def test_server_error(server):
+    with requests.Session() as session:
+        with pytest.raises(requests.HTTPError):
+            osm_geocoder(session, server + "missing", "Oroño 1200, Rosario")
+
+
+def test_results_remover():
+    df = pd.DataFrame(
+        {
+            "lat": [-32.94, -32.95],
+            "lon": [-60.64, -60.65],
+            "provider": ["opencage", "esri"],
+            "score": [9.0, 98.0],
+            "match_type": ["road", "PointAddress"],
+            "bbox_size": [250.0, 0.0],
+            "provider_distance": [12.0, 30.0],
+        }
+    )
+    results_remover(df, pd.Series([True, False]))
+
+    assert df.loc[0, ["lat", "lon", "provider", "provider_distance"]].isnull().all()
+    assert df.loc[1, "provider_distance"] == 30.0
+
+
+def test_checks_estimator(tmp_path):
+    cache = GeocodeCache(tmp_path / "geocodes.sqlite")
+    cache.set("esri", "a", {"lat": -32.94, "lon": -60.64})
+
+    assert checks_estimator(["a", "b", "b", "c", "d", "e"], "esri", cache, 0.5) == 2
+    assert checks_estimator(["b"], "esri", cache, 0) == 0
+    cache.close()
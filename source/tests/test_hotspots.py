@@ -0,0 +1,72 @@
+import sqlite3
+
+import pandas as pd
+
+from fun.hotspots import HotspotStore, cell_snapper
+
+
+def points_builder(n, lat=-32.94005, lon=-60.64005):
+    """
+    This function builds n distinct queries geocoded at the same point.
+
+    :return: Series of queries, Latitudes and Longitudes.
+    """
+    return (
+        pd.Series([f"calle {i}" for i in range(n)]),
+        pd.Series([lat] * n),
+        pd.Series([lon] * n),
+    )
+
+
+def test_cell_snapper():
+    cells = cell_snapper(pd.Series([-32.94005, None]), pd.Series([-60.64005, -60.6]), 0.001)
+
+    assert cells[0] == "-32941:-60641"
+    assert pd.isnull(cells[1])
+
+
+def test_hotspot_flagger(tmp_path):
+    store = HotspotStore(tmp_path / "hotspots.sqlite", cell_size=0.0003, min_queries=5)
+    store.points_adder(*points_builder(4))
+    assert not store.hotspot_flagger(pd.Series([-32.94005]), pd.Series([-60.64005])).any()
+
+    # The same query again does not count, a fifth one makes the cell a hotspot
+    store.points_adder(*points_builder(4))
+    store.points_adder(*points_builder(5))
+    assert store.hotspot_flagger(pd.Series([-32.94005]), pd.Series([-60.64005])).all()
+    assert store.hotspots()["n_queries"].tolist() == [5]
+    store.close()
+
+
+def test_cell_size_change(tmp_path):
+    path = tmp_path / "hotspots.sqlite"
+    store = HotspotStore(path, cell_size=0.0003, min_queries=5)
+    store.points_adder(*points_builder(5))
+    store.close()
+
+    # A larger grid snaps the stored points again, and keeps the ones of the previous grid
+    store = HotspotStore(path, cell_size=0.001, min_queries=5)
+    assert store.hotspots()["cell"].tolist() == ["-32941:-60641"]
+    assert store.hotspot_flagger(pd.Series([-32.9405]), pd.Series([-60.6405])).all()
+    store.close()
+
+    with sqlite3.connect(path) as conn:
+        sizes = conn.execute("SELECT cell_size, COUNT(*) FROM points GROUP BY cell_size")
+        assert dict(sizes) == {0.0003: 5, 0.001: 5}
+
+
+def test_store_without_cell_size(tmp_path):
+    path = tmp_path / "hotspots.sqlite"
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE points (cell TEXT, query TEXT, lat REAL, lon REAL, "
+            "PRIMARY KEY (cell, query))"
+        )
+        conn.executemany(
+            "INSERT INTO points VALUES ('x', ?, -32.94005, -60.64005)",
+            [(f"calle {i}",) for i in range(5)],
+        )
+
+    store = HotspotStore(path, cell_size=0.0003, min_queries=5)
+    assert store.hotspot_flagger(pd.Series([-32.94005]), pd.Series([-60.64005])).all()
+    store.close()
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from fun.incremental import previous_rows_getter, previous_rows_joiner, rows_hasher
+
+
+def delivery_builder(addresses):
+    """
+    This function builds a delivered file of a month, with the hash of each row.
+
+    :addresses: Dictionary with the delivered id as key and the address as value.
+
+    :return: Dataframe with id, direccion_avp and hash_fila columns.
+    """
+    df = pd.DataFrame({"id": list(addresses), "direccion_avp": list(addresses.values())})
+    df["hash_fila"] = rows_hasher(df["id"], df["direccion_avp"])
+    return df
+
+
+def test_rows_hasher():
+    df = delivery_builder({1: "oroño 1200", 2: "oroño 1200", 3: None})
+
+    assert df["hash_fila"].str.len().eq(16).all()
+    assert df["hash_fila"].is_unique
+    assert rows_hasher(df["id"], df["direccion_avp"]).equals(df["hash_fila"])
+
+
+def test_carry_over(tmp_path):
+    path = tmp_path / "2023-01_AVP-geocoded.xlsx"
+
+    # Previous run: row 2 was rejected by the reviewer and left blank
+    df_first = delivery_builder({1: "oroño 1200", 2: "cordoba 1500", 3: "mitre 200"})
+    df_first["lat"] = [-32.94, np.nan, -32.96]
+    df_first["lon"] = [-60.64, np.nan, -60.66]
+    df_first["provider"] = ["opencage", None, "esri"]
+    df_first.to_excel(path, index=False)
+
+    # Row 3 is edited and row 4 is new
+    df = delivery_builder(
+        {1: "oroño 1200", 2: "cordoba 1500", 3: "mitre 2000", 4: "san lorenzo 100"}
+    )
+    df_prev, mask_unchanged = previous_rows_getter(path, df["hash_fila"])
+    assert mask_unchanged.tolist() == [True, True, False, False]
+
+    # Only the edited and new rows are geocoded again
+    df = df.loc[~mask_unchanged, :].copy()
+    df["lat"] = [-32.97, -32.98]
+    df["lon"] = [-60.67, -60.68]
+    df["provider"] = pd.Categorical(["esri", "opencage"])
+
+    df = previous_rows_joiner(df_prev, df).set_index("id")
+    assert df.index.tolist() == [1, 2, 3, 4]
+    assert df.loc[1, "lat"] == -32.94 and df.loc[1, "provider"] == "opencage"
+    assert pd.isnull(df.loc[2, "lat"]) and pd.isnull(df.loc[2, "provider"])
+    assert df.loc[3, "lat"] == -32.97 and df.loc[3, "direccion_avp"] == "mitre 2000"
+    assert pd.api.types.is_float_dtype(df["lat"])
+
+
+def test_no_previous_results(tmp_path):
+    df = delivery_builder({1: "oroño 1200"})
+    df_prev, mask_unchanged = previous_rows_getter(tmp_path / "missing.xlsx", df["hash_fila"])
+
+    assert df_prev.empty
+    assert not mask_unchanged.any()
+    assert previous_rows_joiner(df_prev, df) is df
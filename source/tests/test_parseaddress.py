@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+from fun.formatqueries import queries_formatter, rules_loader
+from fun.parseaddress import address_parser, esri_address_builder
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return rules_loader()
+
+
+def parts_getter(addresses, rules):
+    """
+    This function formats the addresses and splits them into components.
+
+    :addresses: List of raw addresses.
+    :rules: RulePack object.
+
+    :return: Dataframe returned by address_parser.
+    """
+    df = queries_formatter(pd.DataFrame({"direccion_avp": addresses}), rules)
+    return address_parser(df["direccion_avp"], df["ciudad"], rules)
+
+
+@pytest.mark.parametrize(
+    "address, calle, altura",
+    [
+        ("27 de febrero 1500", "Bulevar 27 de Febrero", 1500),
+        ("av 27 de feb 300", "Bulevar 27 de Febrero", 300),
+        ("circunvalacion 300", "Avenida de Circunvalación 25 de Mayo", 300),
+        ("9 de julio 1200", "9 de julio", 1200),
+        ("3 de Febrero 850", "3 de Febrero", 850),
+        ("mendoza 3000", "mendoza", 3000),
+        ("oroño 27", "Bulevar Nicasio Oroño", 27),
+        ("batlle y ordoñez 2000", "Avenida Battle y Ordoñez", 2000),
+    ],
+)
+def test_house_number(rules, address, calle, altura):
+    df_parts = parts_getter([address], rules)
+    assert df_parts.loc[0, "calle"] == calle
+    assert df_parts.loc[0, "altura"] == altura
+    assert df_parts.loc[0, "tipo_direccion"] == "altura"
+
+
+@pytest.mark.parametrize(
+    "address, calle, cruce",
+    [
+        ("mendoza y mitre", "mendoza", "mitre"),
+        ("27 de febrero y mitre", "Bulevar 27 de Febrero", "mitre"),
+        ("3 de febrero y entre rios", "3 de febrero", "entre rios"),
+        ("batlle y ordoñez y mitre", "Avenida Battle y Ordoñez", "mitre"),
+    ],
+)
+def test_intersection(rules, address, calle, cruce):
+    df_parts = parts_getter([address], rules)
+    assert df_parts.loc[0, "calle"] == calle
+    assert df_parts.loc[0, "calle_cruce"] == cruce
+    assert pd.isnull(df_parts.loc[0, "altura"])
+    assert df_parts.loc[0, "tipo_direccion"] == "interseccion"
+
+
+def test_street_and_place(rules):
+    df_parts = parts_getter(["circunvalacion", "hospital centenario"], rules)
+    assert df_parts.loc[0, "calle"] == "Avenida de Circunvalación 25 de Mayo"
+    assert pd.isnull(df_parts.loc[0, "altura"])
+    assert df_parts.loc[0, "tipo_direccion"] == "calle"
+    assert df_parts.loc[1, "lugar"] == "hospital centenario"
+    assert df_parts.loc[1, "tipo_direccion"] == "lugar"
+
+
+def test_esri_address(rules):
+    df_parts = parts_getter(["27 de febrero 1500", "hospital centenario"], rules)
+    addresses = esri_address_builder(df_parts, rules)
+    assert addresses[0] == {
+        "Address": "Bulevar 27 de Febrero 1500",
+        "City": "Rosario",
+        "Region": "Santa Fe",
+        "CountryCode": rules.country_code,
+    }
+    assert addresses[1] == {"SingleLine": "hospital centenario, Rosario, Santa Fe, Argentina"}
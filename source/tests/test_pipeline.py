@@ -0,0 +1,68 @@
+import logging
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import fun.pipeline as pipeline
+from fun.formatqueries import rules_loader
+from fun.geocache import GeocodeCache
+from fun.hotspots import HotspotStore
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return rules_loader()
+
+
+@pytest.fixture
+def osm_settings(monkeypatch):
+    """
+    Settings with a self-hosted OpenStreetMap server that answers every query with the same
+    confident house, so no address is left for the paid services.
+    """
+    def osm_geocoder(session, url, x, engine="nominatim", bounds=None, proximity=None):
+        return {
+            "lat": -32.9442,
+            "lon": -60.6505,
+            "score": 0.5,
+            "match_type": "house",
+            "bbox_size": 20.0,
+        }
+
+    monkeypatch.setattr(pipeline, "osm_geocoder", osm_geocoder)
+    monkeypatch.setenv("OSM_URL", "http://osm.invalid")
+    monkeypatch.setenv("CROSS_CHECK_SAMPLE", "0")
+
+    return pipeline.settings_getter()
+
+
+def points_counter(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM points").fetchone()[0]
+
+
+@pytest.mark.parametrize("learn_hotspots, n_points", [(True, 3), (False, 0)])
+def test_osm_results_learned(rules, osm_settings, tmp_path, learn_hotspots, n_points):
+    df = pd.DataFrame(
+        {"id": [1, 2, 3], "direccion_avp": ["oroño 1200", "cordoba 1500", "mitre 200"]}
+    )
+    cache = GeocodeCache(tmp_path / "geocodes.sqlite", rules.version)
+    hotspots = HotspotStore(tmp_path / "hotspots.sqlite", min_queries=5)
+
+    # avp-service checks the results against the hotspots without recording them
+    df = pipeline.geocode_dataframe(
+        df,
+        rules,
+        None,
+        cache,
+        logging.getLogger(__name__),
+        osm_settings,
+        hotspots=hotspots,
+        learn_hotspots=learn_hotspots,
+    )
+
+    assert (df["provider"] == "osm").all()
+    assert points_counter(tmp_path / "hotspots.sqlite") == n_points
+    hotspots.close()
+    cache.close()
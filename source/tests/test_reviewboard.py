@@ -0,0 +1,88 @@
+import pandas as pd
+import pytest
+
+from fun.reviewboard import ReviewBoard, partitions_splitter
+
+
+@pytest.fixture
+def rows():
+    return pd.DataFrame(
+        {
+            "id": range(1, 9),
+            "direccion_orig": [f"calle {i}" for i in range(1, 9)],
+            "lat": [-32.94, -32.95, -32.96, -32.97, -32.90, -32.91, -32.92, -32.93],
+            "lon": [-60.64, -60.65, -60.66, -60.67, -60.70, -60.71, -60.72, -60.73],
+        }
+    )
+
+
+def test_partitions_splitter(rows):
+    parts = partitions_splitter(rows, 3)
+
+    assert [len(x) for x in parts] == [3, 3, 2]
+    assert sorted(x for part in parts for x in part) == rows.index.tolist()
+    assert len(partitions_splitter(rows.head(2), 4)) == 2
+
+
+def test_partition_leases(tmp_path, rows):
+    board = ReviewBoard(tmp_path / "board.sqlite", lease_seconds=900)
+    assert board.session_opener("2023-01 opencage", rows, 2) == 2
+
+    # Two reviewers get different partitions, a third one gets none
+    session_1, part_1, df_1 = board.partition_getter("ana")
+    session_2, part_2, df_2 = board.partition_getter("juan")
+    assert (session_1, session_2) == ("2023-01 opencage", "2023-01 opencage")
+    assert part_1 != part_2
+    assert set(df_1["id"]).isdisjoint(df_2["id"])
+    assert board.partition_getter("luis") is None
+
+    # A released partition can be taken again
+    board.partition_releaser(session_1, part_1)
+    assert board.partition_getter("luis")[1] == part_1
+    board.close()
+
+
+def test_stale_partition_taken_over(tmp_path, rows):
+    board = ReviewBoard(tmp_path / "board.sqlite", lease_seconds=-1)
+    board.session_opener("2023-01 esri", rows, 1)
+
+    assert board.partition_getter("ana")[1] == 1
+    assert board.partition_getter("juan")[1] == 1
+
+    # The first decision submitted is the one kept
+    assert board.decisions_submitter("2023-01 esri", 1, "juan", [2])
+    assert not board.decisions_submitter("2023-01 esri", 1, "ana", [3])
+    assert board.wrong_getter("2023-01 esri") == [2]
+    assert board.partition_getter("luis") is None
+    board.close()
+
+
+def test_session_reopened(tmp_path, rows):
+    board = ReviewBoard(tmp_path / "board.sqlite")
+    board.session_opener("2023-01 opencage", rows, 2)
+    session, part, df = board.partition_getter("ana")
+    board.decisions_submitter(session, part, "ana", df["id"].head(1).tolist())
+
+    # The same rows keep the decisions, other rows open a new session
+    assert board.session_opener("2023-01 opencage", rows.sample(frac=1, random_state=0), 2) == 2
+    assert board.progress("2023-01 opencage") == {"done": 1, "pending": 1}
+
+    board.session_opener("2023-01 opencage", rows.head(6), 2)
+    assert board.progress("2023-01 opencage") == {"pending": 2}
+    assert board.wrong_getter("2023-01 opencage") == []
+    board.close()
+
+
+def test_wrong_ids_merged(tmp_path, rows):
+    board = ReviewBoard(tmp_path / "board.sqlite")
+    board.session_opener("2023-01 opencage", rows, 2)
+
+    for reviewer in ["ana", "juan"]:
+        session, part, df = board.partition_getter(reviewer)
+        board.decisions_submitter(session, part, reviewer, df["id"].tail(2).tolist())
+
+    wrong = board.wrong_getter("2023-01 opencage")
+    assert len(wrong) == 4
+    assert wrong == sorted(wrong)
+    assert board.progress("2023-01 opencage") == {"done": 2}
+    board.close()
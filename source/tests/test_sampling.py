@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from fun.sampling import sample_selector, strata_evaluator, wilson_interval
+
+
+def test_wilson_interval():
+    # A clean sample of 50 bounds the error rate at about 7% (see README)
+    lower, upper = wilson_interval(0, 50)
+    assert lower == 0
+    assert upper == pytest.approx(0.0713, abs=0.001)
+
+    lower, upper = wilson_interval(5, 50)
+    assert lower < 0.1 < upper
+    assert wilson_interval(0, 0) == (0.0, 1.0)
+
+
+@pytest.fixture
+def rows():
+    # 200 OpenCage streets and 10 Esri places, plus 2 rows in hotspots
+    return pd.DataFrame(
+        {
+            "provider": ["opencage"] * 200 + ["esri"] * 10 + ["opencage"] * 2,
+            "tipo_direccion": ["calle"] * 200 + ["lugar"] * 10 + ["altura"] * 2,
+        }
+    )
+
+
+def test_sample_selector(rows):
+    mask_full = pd.Series([False] * 210 + [True] * 2)
+    index_sample = sample_selector(rows, mask_full, 50)
+
+    # 50 of the large stratum, the whole small one and the hotspots
+    assert len(index_sample) == 62
+    assert set(rows.index[200:]).issubset(index_sample)
+    assert index_sample.equals(sample_selector(rows, mask_full, 50))
+
+
+def test_strata_evaluator(rows):
+    mask_full = pd.Series([False] * 210 + [True] * 2)
+    index_sample = sample_selector(rows, mask_full, 50)
+
+    # A clean sample is accepted
+    report, index_escalated = strata_evaluator(rows, mask_full, index_sample, [], 0.10)
+    assert not report["escalated"].any()
+    assert index_escalated.empty
+
+    # Above REVIEW_MAX_ERROR the rest of the stratum is reviewed in full (the Esri places were
+    # already reviewed in full and are never escalated)
+    index_wrong = list(index_sample[:10]) + list(rows.index[200:205])
+    report, index_escalated = strata_evaluator(rows, mask_full, index_sample, index_wrong, 0.10)
+    report = report.set_index("provider")
+    assert report.loc["opencage", "escalated"]
+    assert not report.loc["esri", "escalated"]
+    assert sorted(index_escalated) == sorted(set(rows.index[:200]) - set(index_sample))
@@ -0,0 +1,66 @@
+import json
+
+import pandas as pd
+
+from fun.tiles import cells_counter, tiles_updater, zooms_parser
+
+
+def test_zooms_parser():
+    assert zooms_parser("10-16") == [10, 16]
+    assert zooms_parser("12") == [12, 12]
+    assert zooms_parser("") == []
+
+
+def test_cells_counter():
+    # Rosario at zoom 12 falls in tile (1358, 2445), two points in the same cell
+    lat = pd.Series([-32.9468, -32.9469, -32.90])
+    df_cells = cells_counter(lat, pd.Series([-60.6393] * 3), 12)
+
+    assert len(df_cells.index) == 2
+    row = df_cells.sort_values("n").iloc[-1]
+    assert (row["x"], row["y"], row["n"]) == (1358, 2445, 2)
+    assert 0 <= df_cells["i"].min() and df_cells["j"].max() < 32
+
+    # At zoom 0 the whole world is a single tile
+    df_cells = cells_counter(pd.Series([-32.9468, 40.0]), pd.Series([-60.6393, 10.0]), 0)
+    assert set(df_cells["x"]) == {0} and set(df_cells["y"]) == {0}
+
+
+def index_reader(path):
+    with open(path / "index.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_month_replaced(tmp_path):
+    df_many = pd.DataFrame({"lat": [-32.9468] * 5, "lon": [-60.6393] * 5})
+    df_few = pd.DataFrame({"lat": [-32.9468] * 2 + [-32.80], "lon": [-60.6393] * 3})
+
+    tiles_updater(df_many, tmp_path, "2023-01", 12, 12)
+    tiles_updater(df_few, tmp_path, "2023-02", 12, 12)
+    assert index_reader(tmp_path)["max_count"] == {"12": 5}
+
+    # Replacing the busiest month with fewer points lowers the scale
+    tiles_updater(df_few, tmp_path, "2023-01", 12, 12)
+    index = index_reader(tmp_path)
+    assert index["months"] == ["2023-01", "2023-02"]
+    assert index["max_count"] == {"12": 2}
+
+    # A month without points removes its tiles
+    tiles_updater(df_few.iloc[:0], tmp_path, "2023-01", 12, 12)
+    tiles_updater(df_few.iloc[:0], tmp_path, "2023-02", 12, 12)
+    assert not list((tmp_path / "12").rglob("*.json"))
+    assert index_reader(tmp_path)["max_count"] == {}
+
+
+def test_index_without_month_max(tmp_path):
+    df = pd.DataFrame({"lat": [-32.9468] * 3, "lon": [-60.6393] * 3})
+    tiles_updater(df, tmp_path, "2023-01", 12, 12)
+    index = index_reader(tmp_path)
+    del index["month_max"]
+    index["max_count"] = {"12": 9}
+    with open(tmp_path / "index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    # The maxima of the months are read again from their tiles
+    tiles_updater(pd.DataFrame({"lat": [-32.9468], "lon": [-60.6393]}), tmp_path, "2023-02", 12, 12)
+    assert index_reader(tmp_path)["max_count"] == {"12": 3}
@@ -0,0 +1,67 @@
+from fun.workqueue import WorkQueue
+
+
+def test_expired_lease_returns_to_queue(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", "v1", lease_seconds=-1)
+    queue.jobs_adder("esri", ["a", "b", "b"])
+
+    # The most repeated query first
+    _, jobs = queue.lease_getter("w1", ["esri"], size=1)
+    assert jobs == [("esri", "b", None)]
+
+    # The lease expired at once, so another worker takes the same job
+    _, jobs = queue.lease_getter("w2", ["esri"], size=2)
+    assert sorted(x[1] for x in jobs) == ["a", "b"]
+    queue.close()
+
+
+def test_unexpired_lease_is_kept(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", "v1", lease_seconds=900)
+    queue.jobs_adder("opencage", ["a"])
+
+    _, jobs = queue.lease_getter("w1", ["opencage"])
+    assert len(jobs) == 1
+    assert queue.lease_getter("w2", ["opencage"])[1] == []
+    queue.close()
+
+
+def test_first_result_kept(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", "v1", lease_seconds=-1)
+    queue.jobs_adder("esri", ["a"])
+    queue.lease_getter("w1", ["esri"])
+    queue.lease_getter("w2", ["esri"])
+
+    assert queue.results_submitter("w2", [("esri", "a", {"lat": 2})]) == 1
+    assert queue.results_submitter("w1", [("esri", "a", {"lat": 1})]) == 0
+    assert queue.results_getter("esri") == {"a": {"lat": 2}}
+
+    # Done jobs are not queued again
+    assert queue.jobs_adder("esri", ["a"]) == 0
+    assert queue.lease_getter("w3", ["esri"])[1] == []
+    queue.close()
+
+
+def test_failed_after_max_attempts(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", "v1", lease_seconds=-1, max_attempts=2)
+    queue.jobs_adder("esri", ["a"])
+
+    assert len(queue.lease_getter("w1", ["esri"])[1]) == 1
+    assert len(queue.lease_getter("w1", ["esri"])[1]) == 1
+    assert queue.lease_getter("w1", ["esri"])[1] == []
+
+    assert queue.failed_getter("esri") == ["a"]
+    assert queue.progress() == {("esri", "failed"): 1}
+    queue.close()
+
+
+def test_released_lease_is_not_an_attempt(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", "v1", lease_seconds=-1, max_attempts=1)
+    queue.jobs_adder("esri", ["a"])
+
+    # A worker out of quota returns its lease
+    lease, _ = queue.lease_getter("w1", ["esri"])
+    queue.lease_releaser(lease)
+
+    assert len(queue.lease_getter("w2", ["esri"])[1]) == 1
+    assert queue.failed_getter("esri") == []
+    queue.close()